@@ -1,9 +1,9 @@
 import cv2
 import os
-from encode_faces import create_encodings
+from encode_faces import add_student_encodings
 
 # [เพิ่ม] นำเข้า Database จากไฟล์ app.py
-from app import app, db, Student 
+from app import app, db, Student, init_db
 
 base_dir = 'images_db'
 
@@ -21,8 +21,9 @@ def create_student_dataset():
 
     # บันทึกข้อมูลลง Database
     with app.app_context():
+        init_db()  # สร้างตารางถ้ายังไม่มี (ไม่ต้องโหลดดัชนีใบหน้าของเว็บ)
         # เช็กว่ามีรหัสนี้ในระบบหรือยัง
-        existing_student = Student.query.get(student_id)
+        existing_student = db.session.get(Student, student_id)
         if not existing_student:
             new_student = Student(id=student_id, name_th=name_th, name_en=name_en, classroom=classroom)
             db.session.add(new_student)
@@ -68,7 +69,7 @@ def create_student_dataset():
     cv2.destroyAllWindows()
     
     print("\n🔄 กำลังแปลงโครงสร้างใบหน้า (Encoding) และอัปเดตระบบ...")
-    create_encodings()
+    add_student_encodings(student_id)
     print("🎉 ลงทะเบียนเสร็จสมบูรณ์!")
 
 if __name__ == "__main__":
@@ -1,19 +1,38 @@
-from flask import Flask, render_template, Response, redirect, url_for, request, jsonify, session, flash
+from flask import Flask, render_template, Response, redirect, url_for, request, jsonify, session, flash, stream_with_context
 import base64
 import shutil
 from flask_sqlalchemy import SQLAlchemy
-import cv2
-import face_recognition
+from sqlalchemy import inspect, text, func, case, select, event, tuple_
+import sqlite3
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 import numpy as np
-import pandas as pd
 import os
-import pickle
 import io
 import csv
-from flask import make_response
+import json
+import re
+import threading
+import time
+import tempfile
+import uuid
 from datetime import datetime, date, timedelta
 from functools import wraps
-from PIL import ImageFont, ImageDraw, Image
+from face_index import ANN_MIN_FACES, FaceIndex
+from face_store import load_store, store_stamp, migrate_pickle
+from encoding_jobs import EncodingJobRunner
+from recognition import PROFILE_LABELS, DEFAULT_PROFILE, resolve_profile
+from face_tracker import FaceTracker, LatestFrame
+from group_commit import GroupCommitWriter, GroupCommitTimeout
+from inference_pool import InferencePool, InferenceBusy, InferenceTimeout, run_recognition, run_detection, run_encoding
+from frame_cache import FrameCache, frame_hash, content_key
+from lookup_cache import TTLCache
+import metrics
+from metrics import timed
+
+try:
+    from flask_sock import Sock  # โหมดสแกนต่อเนื่องผ่าน WebSocket (pip install flask-sock)
+except ImportError:
+    Sock = None
 
 app = Flask(__name__)
 
@@ -21,13 +40,147 @@ app.secret_key = "RA-WANG-FRAME-SECRET-KEY-2026"
 
 # --- CONFIGURATION (ตั้งค่าฐานข้อมูล) ---
 # ใช้ SQLite เพราะเป็นไฟล์เดียวจบ ไม่ต้องลงโปรแกรมเพิ่ม
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///school_data.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///school_data.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# โหมดฐานข้อมูลสำหรับใช้งานจริง (Kiosk หลายเครื่องเขียนพร้อมกัน): WAL + busy timeout + connection pool
+# ตั้ง DB_MODE=simple เพื่อกลับไปใช้ค่าเริ่มต้นของ SQLite
+app.config['DB_MODE'] = os.environ.get('DB_MODE', 'production')
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+# รวมการบันทึกของ Kiosk ที่เข้ามาภายในช่วงเวลานี้ (มิลลิวินาที) แล้ว commit ครั้งเดียว (0 = ปิด)
+app.config['GROUP_COMMIT_WINDOW_MS'] = int(os.environ.get('GROUP_COMMIT_WINDOW_MS', 10))
+if app.config['DB_MODE'] == 'production':
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_timeout': 30,
+        'connect_args': {
+            'timeout': app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000,
+            'check_same_thread': False,
+        },
+    }
+# จำนวน process ที่ใช้แปลงใบหน้า (Encoding) พร้อมกัน ตอนลงทะเบียน/นำเข้าข้อมูล
+app.config['ENCODE_WORKERS'] = int(os.environ.get('ENCODE_WORKERS', os.cpu_count() or 1))
+# process สำหรับจดจำใบหน้าของ /recognize_face (0 = ทำใน thread ของ request เหมือนเดิม)
+app.config['INFERENCE_WORKERS'] = int(os.environ.get('INFERENCE_WORKERS', min(2, os.cpu_count() or 1)))
+# จำนวนคำขอที่รอคิวได้ (นอกเหนือจากที่ worker กำลังทำ) และเวลารอช่องว่างก่อนตอบว่าไม่ว่าง
+app.config['INFERENCE_QUEUE_DEPTH'] = int(os.environ.get('INFERENCE_QUEUE_DEPTH', 8))
+app.config['INFERENCE_QUEUE_TIMEOUT_MS'] = int(os.environ.get('INFERENCE_QUEUE_TIMEOUT_MS', 200))
+app.config['INFERENCE_TIMEOUT'] = float(os.environ.get('INFERENCE_TIMEOUT', 30))
+app.config['INFERENCE_RETRY_AFTER'] = 1  # วินาทีที่บอก Kiosk ให้รอก่อนส่งใหม่ เมื่อคิวเต็ม
+app.config['WRITE_RETRY_AFTER'] = 2  # วินาทีที่บอก Kiosk ให้รอก่อนส่งใหม่ เมื่อบันทึกลงฐานข้อมูลไม่ทันเวลา
+# ผลของเฟรมที่ส่งซ้ำ/แทบเหมือนเดิมจาก Kiosk เดิมภายในกี่วินาทีที่ตอบจากแคช (0 = ปิด)
+# และจำนวนบิต dHash ที่ต่างกันได้ (ใช้กับผลไม่พบใบหน้า/จำไม่ได้เท่านั้น ผลที่ระบุตัวคนต้องเป็นไฟล์เดิมทุกไบต์)
+app.config['FRAME_CACHE_TTL'] = float(os.environ.get('FRAME_CACHE_TTL', 5))
+app.config['FRAME_CACHE_MAX_DISTANCE'] = int(os.environ.get('FRAME_CACHE_MAX_DISTANCE', 1))
+# ดัชนีที่มีใบหน้าตั้งแต่จำนวนนี้ขึ้นไปค้นทั้งโรงเรียนแบบประมาณ (IVF) แทนการค้นทุกแถว (0 = ปิด)
+app.config['ANN_MIN_FACES'] = int(os.environ.get('ANN_MIN_FACES', ANN_MIN_FACES))
 db = SQLAlchemy(app)
+sock = Sock(app) if Sock else None
+group_commit = GroupCommitWriter(window=app.config['GROUP_COMMIT_WINDOW_MS'] / 1000,
+                                 execution_options={'sqlite_begin': 'IMMEDIATE'})
+
+# --- METRICS (ดูได้ที่ /metrics รูปแบบ Prometheus) ---
+REQUEST_SECONDS = metrics.histogram('attendance_request_seconds', 'Total request latency', ['endpoint'])
+REQUESTS = metrics.counter('attendance_requests_total', 'Requests by endpoint and outcome', ['endpoint', 'outcome'])
+STAGE_SECONDS = metrics.histogram('attendance_stage_seconds', 'Latency of each request stage', ['endpoint', 'stage'])
+FACES_DETECTED = metrics.counter('attendance_faces_detected_total', 'Faces detected in scanned frames', ['endpoint'])
+MATCHES = metrics.counter('attendance_face_matches_total', 'Detected faces that matched / did not match a student',
+                          ['endpoint', 'result'])
+SEARCH_SCOPE = metrics.counter('attendance_face_search_scope_total',
+                               'Detected faces resolved within the kiosk classroom vs falling back to a school-wide search',
+                               ['endpoint', 'scope'])
+DB_WRITE_SECONDS = metrics.histogram('attendance_db_write_seconds',
+                                     'SQLite write statement latency, including time waiting for the write lock',
+                                     ['table'])
+DB_LOCK_ERRORS = metrics.counter('attendance_db_lock_errors_total', 'Statements that failed with "database is locked"')
+INDEX_LOAD_SECONDS = metrics.histogram('face_index_load_seconds', 'Time to open the encodings store and build FaceIndex')
+INDEX_FACES = metrics.gauge('face_index_faces', 'Face encodings in the loaded index')
+INDEX_STUDENTS = metrics.gauge('face_index_students', 'Students in the loaded index')
+INDEX_BYTES = metrics.gauge('face_index_matrix_bytes', 'Size of the matrix scanned on every search')
+INGEST_RECORDS = metrics.counter('attendance_ingest_records_total',
+                                 'Records received by the batch ingest API by result', ['result'])
+ENCODING_JOB_SECONDS = metrics.histogram('face_encoding_job_seconds', 'Background encoding job duration',
+                                         ['kind', 'status'])
+
+def observe_request(endpoint):
+    """Decorator จับเวลารวมของ endpoint"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with timed(REQUEST_SECONDS, endpoint=endpoint):
+                return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+_WRITE_STATEMENT = re.compile(r'\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|UPDATE|DELETE\s+FROM)\s+"?(\w+)', re.IGNORECASE)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    match = _WRITE_STATEMENT.match(statement)
+    if match:
+        conn.info['write_started'] = (match.group(1), time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # คำสั่งเขียนที่ช้าส่วนใหญ่คือการรอ write lock ของ SQLite (busy_timeout) ไม่ใช่เวลาเขียนจริง
+    started = conn.info.pop('write_started', None)
+    if started is not None:
+        DB_WRITE_SECONDS.observe(time.perf_counter() - started[1], table=started[0])
+
+def _handle_db_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None:
+        conn.info.pop('write_started', None)
+    if 'database is locked' in str(exception_context.original_exception):
+        DB_LOCK_ERRORS.inc()
+
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    """ตั้งค่า SQLite ทุกครั้งที่เปิด connection ใหม่"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    # ให้ SQLAlchemy สั่ง BEGIN เอง (_begin_sqlite_transaction) pysqlite ไม่ส่ง BEGIN ก่อน SAVEPOINT
+    # ทำให้ RELEASE SAVEPOINT ของ Group Commit กลายเป็นการ commit ทีละงาน (fsync ทุกงาน ไม่ได้รวมก้อน)
+    dbapi_connection.isolation_level = None
+    if app.config['DB_MODE'] != 'production':
+        return
+    cursor = dbapi_connection.cursor()
+    # WAL: ผู้อ่าน (dashboard/reports) ไม่ต้องรอผู้เขียน และผู้เขียนไม่บล็อกผู้อ่าน
+    cursor.execute('PRAGMA journal_mode=WAL')
+    # NORMAL ปลอดภัยเมื่อใช้ WAL และ fsync น้อยกว่า FULL มาก
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f"PRAGMA busy_timeout={app.config['SQLITE_BUSY_TIMEOUT_MS']}")
+    cursor.close()
+
+def _begin_sqlite_transaction(conn):
+    # งานเขียนของ Group Commit ขอ write lock ตั้งแต่ BEGIN (รอตาม busy_timeout ได้)
+    # ไม่ต้องอัปเกรดจาก read lock กลาง Transaction ซึ่ง SQLite อาจตอบ "database is locked" ทันที
+    if conn.get_execution_options().get('sqlite_begin') == 'IMMEDIATE':
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+    else:
+        conn.exec_driver_sql('BEGIN')
+
+def configure_engine(engine):
+    """ติดตั้ง event ของแอป (เวลาเขียน, ตั้งค่า SQLite) ให้ engine นี้เท่านั้น ต้องเรียกก่อนเปิด connection แรก"""
+    if event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        return
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_db_error)
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', _configure_sqlite_connection)
+        event.listen(engine, 'begin', _begin_sqlite_transaction)
 
 # ไฟล์เก็บรหัสใบหน้า (ที่สร้างจาก encode_faces.py)
-encoding_file = 'encodings.pickle'
-font_path = "C:\Windows\Fonts\IrisUPC.ttf" # ปรับตามระบบของคุณ (Windows, Mac, Linux)
+encoding_file = 'encodings.bin'
+legacy_encoding_file = 'encodings.pickle'  # รูปแบบเดิม อ่านได้เพื่อแปลงเป็นไฟล์ใหม่ครั้งเดียว
+
+inference_pool = InferencePool(
+    encoding_file,
+    workers=app.config['INFERENCE_WORKERS'],
+    queue_depth=app.config['INFERENCE_QUEUE_DEPTH'],
+    queue_timeout=app.config['INFERENCE_QUEUE_TIMEOUT_MS'] / 1000,
+    timeout=app.config['INFERENCE_TIMEOUT'],
+    ann_min_faces=app.config['ANN_MIN_FACES'] or None,
+) if app.config['INFERENCE_WORKERS'] > 0 else None
 
 # --- DATABASE MODELS (โครงสร้างตารางข้อมูล) ---
 
@@ -41,6 +194,7 @@ class SystemSetting(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     late_grace_mins = db.Column(db.Integer, default=15) # เก็บเวลาผ่อนผัน (นาที)
     ai_tolerance = db.Column(db.Float, default=0.45)
+    recognition_profile = db.Column(db.String(20), default=DEFAULT_PROFILE) # fast / balanced / accurate
     
 class Student(db.Model):
     id = db.Column(db.String(20), primary_key=True)
@@ -58,13 +212,145 @@ class Attendance(db.Model):
     status = db.Column(db.String(20), nullable=False)
     subject = db.Column(db.String(100))
 
-# สร้าง Database อัตโนมัติถ้ายังไม่มี
-with app.app_context():
+    __table_args__ = (
+        # นักเรียน 1 คน เช็กชื่อได้ครั้งเดียวต่อวิชาต่อวัน (ใช้ตรวจซ้ำด้วย index แทนการสแกนทั้งตาราง)
+        db.Index('ux_attendance_student_date_subject', 'student_id', 'date', 'subject', unique=True),
+        # ค้นตามวันที่ และเรียงหน้า reports แบบ keyset (date, time, id) ได้จาก index โดยไม่ต้อง sort
+        db.Index('ix_attendance_date_time_id', 'date', 'time', 'id'),
+    )
+
+class IngestKey(db.Model):
+    # Idempotency key ของรายการที่ Kiosk ส่งผ่าน /api/attendance/batch ค้นด้วย primary key
+    # รายการที่ส่งซ้ำ (WiFi หลุดแล้วส่งใหม่) จึงได้ผลเดิมกลับไปโดยไม่บันทึกซ้ำ
+    key = db.Column(db.String(64), primary_key=True)
+    student_id = db.Column(db.String(20), nullable=False)
+    result = db.Column(db.String(20), nullable=False) # สถานะที่บันทึก หรือ duplicate (เช็กวิชานี้ไปแล้ว)
+    received_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        # ใช้ลบ key เก่าที่เกินระยะเก็บ
+        db.Index('ix_ingest_key_received_at', 'received_at'),
+    )
+
+# คอลัมน์ที่ใช้ตรวจการเช็กชื่อซ้ำใน INSERT ... ON CONFLICT DO NOTHING
+ATTENDANCE_UNIQUE_COLUMNS = ['student_id', 'date', 'subject']
+
+def _sql_literal(value):
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+class SchemaUpgradeError(RuntimeError):
+    """อัปเกรดไฟล์ฐานข้อมูลอัตโนมัติไม่ได้ (ไม่มีข้อมูลใดถูกแก้) ผู้ดูแลต้องแก้ข้อมูลเองก่อน"""
+
+# จำนวนกลุ่มแถวซ้ำที่แสดงในข้อความ error
+SCHEMA_CONFLICT_PREVIEW = 20
+
+def pending_unique_indexes(inspector):
+    """unique index ที่ยังไม่มีในตารางเดิมของไฟล์ฐานข้อมูล คืน [(table, index), ...]"""
+    pending = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing_indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+        pending.extend((table, index) for index in table.indexes
+                       if index.unique and index.name not in existing_indexes)
+    return pending
+
+def find_unique_conflicts(conn, table, index):
+    """กลุ่มแถวที่ค่าคอลัมน์ของ unique index ซ้ำกัน คืน [(ค่าคอลัมน์ (tuple), จำนวนแถว), ...]"""
+    cols = ', '.join(f'"{c.name}"' for c in index.columns)
+    # NULL ไม่นับว่าซ้ำกันใน unique index ของ SQLite
+    not_null = ' AND '.join(f'"{c.name}" IS NOT NULL' for c in index.columns)
+    rows = conn.execute(text(
+        f'SELECT {cols}, COUNT(*) FROM "{table.name}" WHERE {not_null} '
+        f'GROUP BY {cols} HAVING COUNT(*) > 1 ORDER BY {cols}'
+    ))
+    return [(tuple(row[:-1]), row[-1]) for row in rows]
+
+def describe_unique_conflicts(table, index, conflicts):
+    """ข้อความแสดงกลุ่มแถวซ้ำ (ภาษาอังกฤษ เหมือนข้อความอื่นใน console)"""
+    cols = ', '.join(c.name for c in index.columns)
+    lines = [f"{len(conflicts)} groups of rows in {table.name} share the same ({cols}), "
+             f"so unique index {index.name} cannot be created:"]
+    lines += [f"  {values!r}: {count} rows" for values, count in conflicts[:SCHEMA_CONFLICT_PREVIEW]]
+    if len(conflicts) > SCHEMA_CONFLICT_PREVIEW:
+        lines.append(f"  ... and {len(conflicts) - SCHEMA_CONFLICT_PREVIEW} more groups")
+    return '\n'.join(lines)
+
+def remove_duplicates_keep_newest(conn, table, index):
+    """ลบแถวซ้ำตามคอลัมน์ของ unique index โดยเก็บแถวที่บันทึกล่าสุด (rowid มากที่สุด) คืนจำนวนแถวที่ลบ
+
+    แถวที่บันทึกทีหลังคือการแก้ไขของครู (เช่น เปลี่ยนเป็นลาป่วย) จึงเก็บแถวนั้นไว้ ใช้ผ่าน dedupe_attendance.py เท่านั้น
+    """
+    cols = ', '.join(f'"{c.name}"' for c in index.columns)
+    not_null = ' AND '.join(f'"{c.name}" IS NOT NULL' for c in index.columns)
+    result = conn.execute(text(
+        f'DELETE FROM "{table.name}" WHERE {not_null} AND rowid NOT IN '
+        f'(SELECT MAX(rowid) FROM "{table.name}" WHERE {not_null} GROUP BY {cols})'
+    ))
+    return result.rowcount
+
+def backup_database():
+    """สำรองไฟล์ SQLite ทั้งไฟล์ไว้ข้างไฟล์เดิม (ใช้ backup API จึงได้ข้อมูลครบแม้อยู่ในโหมด WAL) คืน path ไฟล์สำรอง"""
+    path = db.engine.url.database
+    if db.engine.dialect.name != 'sqlite' or not path or path == ':memory:':
+        raise SchemaUpgradeError(f"cannot back up database {db.engine.url!r}: not a SQLite file")
+    backup_path = f"{path}.bak-{datetime.now():%Y%m%d-%H%M%S}"
+    source = sqlite3.connect(path)
+    target = sqlite3.connect(backup_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    return backup_path
+
+def upgrade_schema():
+    """อัปเกรดไฟล์ฐานข้อมูลเดิม: เพิ่มคอลัมน์และ index ใหม่ที่ยังไม่มี (db.create_all ไม่แก้ตารางที่มีอยู่แล้ว)"""
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(dialect=db.engine.dialect)}'
+                if column.default is not None and column.default.is_scalar:
+                    ddl += f" DEFAULT {_sql_literal(column.default.arg)}"
+                print(f"Schema upgrade: {ddl}")
+                conn.execute(text(ddl))
+
+            existing_indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing_indexes:
+                    continue
+                if index.unique:
+                    # ไม่ลบข้อมูลเอง: หยุด (ยกเลิกทั้ง Transaction) แล้วให้ผู้ดูแลรัน dedupe_attendance.py
+                    conflicts = find_unique_conflicts(conn, table, index)
+                    if conflicts:
+                        raise SchemaUpgradeError(
+                            describe_unique_conflicts(table, index, conflicts) + "\nNo data was changed. "
+                            "Run 'python dedupe_attendance.py' to back up the database and keep the newest row "
+                            "of each group, or fix the rows by hand, then start the app again.")
+                print(f"Schema upgrade: CREATE INDEX {index.name}")
+                index.create(conn)
+
+def init_db():
+    """สร้าง Database อัตโนมัติถ้ายังไม่มี และอัปเกรดตารางเดิม (ต้องเรียกใน app context)"""
+    configure_engine(db.engine)
     db.create_all()
+    upgrade_schema()
 
 # --- GLOBAL VARIABLES ---
-known_face_encodings = []
-known_face_ids = []
+# ดัชนีใบหน้าแบบ immutable: load_encodings สร้างชุดใหม่ทั้งก้อนแล้วสลับด้วยการกำหนดค่าครั้งเดียว
+# ผู้อ่าน (recognize_face) จึงเห็นเมทริกซ์และรหัสนักเรียนที่ตรงกันเสมอ แม้ระหว่างสร้างข้อมูลใหม่
+face_index = FaceIndex([], [])
+face_index_stamp = None  # ลายเซ็นของไฟล์ที่โหลดอยู่ ใช้ตรวจว่ามี process อื่นเขียนไฟล์ใหม่หรือยัง
+encoding_jobs = EncodingJobRunner()
+frame_cache = FrameCache(ttl=app.config['FRAME_CACHE_TTL'], max_distance=app.config['FRAME_CACHE_MAX_DISTANCE'])
 
 # --- HELPER FUNCTIONS ---
 def login_required(f):
@@ -77,48 +363,176 @@ def login_required(f):
 
 def load_encodings():
     """โหลดข้อมูล Encodings จากไฟล์ Pickle"""
-    global known_face_encodings, known_face_ids
+    global face_index, face_index_stamp
     print("--- Loading Face Data ---")
-    if os.path.exists(encoding_file):
-        data = pickle.loads(open(encoding_file, "rb").read())
-        known_face_encodings = data["encodings"]
-        known_face_ids = data["names"]  # <--- โหลด names (ซึ่งคือ ID) เข้า known_face_ids
-        print(f"Loaded {len(known_face_ids)} faces.")
+    with timed(INDEX_LOAD_SECONDS):
+        if not os.path.exists(encoding_file) and os.path.exists(legacy_encoding_file):
+            print(f"Migrating {legacy_encoding_file} -> {encoding_file}")
+            migrate_pickle(legacy_encoding_file, encoding_file)
+
+        stamp = store_stamp(encoding_file)
+        if stamp is not None:
+            # เปิดแบบ memmap: ทุก worker ใช้หน้า page cache ร่วมกัน ไม่ต้องโหลดทั้งไฟล์เข้า RAM ของตัวเอง
+            new_index = FaceIndex.from_store(load_store(encoding_file), ann_min_faces=app.config['ANN_MIN_FACES'] or None)
+            print(f"Loaded {len(new_index)} faces ({new_index.matrix.dtype}).")
+        else:
+            print("Warning: encodings file not found.")
+            new_index = FaceIndex([], [])
+    # สลับเข้าใช้งานด้วยการกำหนดค่าครั้งเดียว (atomic)
+    face_index = new_index
+    face_index_stamp = stamp
+    frame_cache.clear()
+    INDEX_FACES.set(len(new_index))
+    INDEX_STUDENTS.set(new_index.num_students)
+    INDEX_BYTES.set(new_index.nbytes)
+
+def refresh_encodings_if_changed():
+    """โหลดดัชนีใหม่เมื่อไฟล์ถูกเขียนทับโดย process อื่น (gunicorn worker ตัวอื่น หรือสคริปต์ CLI)"""
+    if store_stamp(encoding_file) != face_index_stamp:
+        load_encodings()
+
+def start_encoding_job(kind, operation):
+    """ส่งงานสร้าง Encodings ไปทำเบื้องหลัง เมื่อเสร็จจะโหลดดัชนีใหม่เข้าใช้งานทันที คืนค่า job id"""
+    def task(progress):
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            operation(progress)
+            load_encodings()
+            status = 'done'
+        finally:
+            ENCODING_JOB_SECONDS.observe(time.perf_counter() - start, kind=kind, status=status)
+    return encoding_jobs.submit(kind, task)
+
+# แคชค่าตั้งค่าและข้อมูลนักเรียนสำหรับเส้นทางการสแกน (ฝั่งที่แก้ข้อมูลต้อง invalidate)
+settings_cache = TTLCache(ttl=60)
+# รหัสที่ไม่พบจำไว้แค่ 5 วินาที: นักเรียนที่เพิ่งเพิ่มจาก process อื่นสแกนได้ในไม่กี่วินาที ไม่ต้องรอ 5 นาที
+student_cache = TTLCache(ttl=300, miss_ttl=5)
+classroom_cache = TTLCache(ttl=300, max_size=1000)
+DEFAULT_SETTINGS = {'late_grace_mins': 15, 'ai_tolerance': 0.45, 'recognition_profile': DEFAULT_PROFILE}
+
+def get_settings():
+    """ค่าตั้งค่าระบบเป็น dict (ใช้ค่าเริ่มต้นถ้ายังไม่เคยบันทึก)"""
+    def load():
+        setting = SystemSetting.query.first()
+        if setting is None:
+            return dict(DEFAULT_SETTINGS)
+        return {
+            'late_grace_mins': setting.late_grace_mins,
+            'ai_tolerance': setting.ai_tolerance,
+            'recognition_profile': setting.recognition_profile or DEFAULT_PROFILE,
+        }
+    return settings_cache.get('settings', load)
+
+def get_student_profile(student_id):
+    """ข้อมูลนักเรียนสำหรับแสดงผลตอนสแกนเป็น dict (None ถ้าไม่มีรหัสนี้)"""
+    def load():
+        student = db.session.get(Student, student_id)
+        if student is None:
+            return None
+        return {
+            'id': student.id,
+            'roll_number': student.roll_number,
+            'name_th': student.name_th,
+            'name_en': student.name_en,
+            'classroom': student.classroom,
+        }
+    return student_cache.get(str(student_id), load)
+
+def get_classroom_ids(classroom):
+    """รหัสนักเรียนทั้งหมดในห้อง (tuple เรียงแล้ว) ใช้จำกัดการค้นใบหน้าเฉพาะห้องของ Kiosk"""
+    if not classroom:
+        return ()
+    def load():
+        rows = db.session.query(Student.id).filter(Student.classroom == classroom).order_by(Student.id)
+        return tuple(str(r[0]) for r in rows)
+    return classroom_cache.get(classroom, load)
+
+def invalidate_student_caches(student_id=None):
+    """ล้างแคชข้อมูลนักเรียน (ทั้งหมดถ้าไม่ระบุรหัส) รายชื่อในห้อง และผลการสแกนที่แคชไว้ เมื่อข้อมูลนักเรียนเปลี่ยน"""
+    if student_id is None:
+        student_cache.invalidate()
     else:
-        print("Warning: Pickle file not found.")
-        known_face_encodings, known_face_ids = [], []
-
-def put_thai_text(img, text, position, font_size=30, color=(255, 255, 255)):
-    """วาดภาษาไทยบนภาพ (อัปเกรดระบบค้นหาฟอนต์อัตโนมัติ)"""
-    img_pil = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-    draw = ImageDraw.Draw(img_pil)
-    
-    # ลิสต์รายชื่อฟอนต์ภาษาไทยที่มักจะมีใน Windows และในโปรเจค
-    font_paths = [
-        "font/Sarabun-Regular.ttf",      # หาในโฟลเดอร์โปรเจคก่อน
-        "C:/Windows/Fonts/tahoma.ttf",   # ฟอนต์ Tahoma (Windows ทั่วไป)
-        "C:/Windows/Fonts/LeelawUI.ttf", # ฟอนต์ Leelawadee UI (Windows 10/11)
-        "C:/Windows/Fonts/angsana.ttc",  # ฟอนต์ Angsana
-        "C:/Windows/Fonts/cordiau.ttf"   # ฟอนต์ Cordia
-    ]
-
-    font = None
-    # วนลูปหาฟอนต์ ถ้าเจอตัวไหนก่อน ให้ใช้ตัวนั้นเลย
-    for path in font_paths:
-        if os.path.exists(path):
-            try:
-                font = ImageFont.truetype(path, font_size)
-                break # เจอและโหลดสำเร็จแล้ว ให้ออกจากลูป
-            except IOError:
-                continue
-
-    # ถ้าหาไม่เจอเลยทุกไฟล์ ให้ใช้ Default (ซึ่งจะเป็นสี่เหลี่ยม)
-    if font is None:
-        print("Warning: ไม่พบไฟล์ฟอนต์ภาษาไทยเลยในเครื่อง! ข้อความจะเป็นสี่เหลี่ยม")
-        font = ImageFont.load_default()
-    
-    draw.text(position, text, font=font, fill=color)
-    return cv2.cvtColor(np.array(img_pil), cv2.COLOR_RGB2BGR)
+        student_cache.invalidate(str(student_id))
+    classroom_cache.invalidate()
+    frame_cache.clear()
+
+def read_request_image_bytes():
+    """อ่านไฟล์รูปจาก request เป็น bytes (คืน None ถ้าไม่มีรูป)
+
+    รองรับ 3 แบบ: ส่งไฟล์ JPEG ตรงๆ (Content-Type: image/jpeg), multipart (ช่อง 'image')
+    และ JSON Base64 แบบเดิม (เพื่อให้หน้าเว็บเก่ายังใช้ได้)
+    """
+    if request.mimetype.startswith('image/'):
+        # อ่านไบต์จาก stream ตรงๆ ไม่ต้องผ่าน Base64 (ประหยัดขนาด ~33% และไม่ต้องคัดลอกหลายรอบ)
+        buf = request.get_data(cache=False)
+    elif 'image' in request.files:
+        buf = request.files['image'].read()
+    else:
+        data = request.get_json(silent=True) or {}
+        img_data = data.get('image')
+        if not img_data:
+            return None
+        buf = base64.b64decode(img_data.split(';base64,')[-1])
+    return buf or None
+
+def read_request_image():
+    """อ่านรูปจาก request แล้วแปลงเป็นภาพ BGR (คืน None ถ้าไม่มีรูป)"""
+    buf = read_request_image_bytes()
+    if not buf:
+        return None
+    import cv2
+    return cv2.imdecode(np.frombuffer(buf, np.uint8), cv2.IMREAD_COLOR)
+
+def kiosk_session_key():
+    """รหัสประจำ Kiosk (เก็บใน session cookie) ใช้แยกแคชผลการสแกนของแต่ละเครื่อง"""
+    if 'kiosk_id' not in session:
+        session['kiosk_id'] = uuid.uuid4().hex
+    return session['kiosk_id']
+
+def recognize_image(buf, profile, classroom_ids=None, tolerance=None):
+    """decode -> detect -> encode -> match ใน inference pool (หรือใน thread นี้ถ้าปิด pool)"""
+    if inference_pool is not None:
+        return inference_pool.recognize(buf, profile, classroom_ids, tolerance)
+    refresh_encodings_if_changed()
+    return run_recognition(buf, profile, face_index, classroom_ids, tolerance)
+
+def detect_image(buf, profile):
+    """decode -> detect ใน inference pool (หรือใน thread นี้ถ้าปิด pool)"""
+    if inference_pool is not None:
+        return inference_pool.detect(buf, profile)
+    return run_detection(buf, profile)
+
+def encode_image(buf, profile, boxes=None, largest_only=None):
+    """decode -> detect -> encode ใน inference pool (หรือใน thread นี้ถ้าปิด pool) ผู้เรียกจับคู่กับ face_index เอง"""
+    if inference_pool is not None:
+        return inference_pool.encode(buf, profile, boxes, largest_only)
+    return run_encoding(buf, profile, boxes, largest_only)
+
+INFERENCE_BUSY_MESSAGE = "ระบบกำลังประมวลผลคำขออื่นอยู่ กรุณาลองใหม่"
+INFERENCE_TIMEOUT_MESSAGE = "ประมวลผลภาพนานเกินกำหนด ระบบอาจทำงานหนักอยู่ กรุณาลองใหม่อีกครั้ง"
+
+START_TIME_FORMAT_ERROR = "เวลาเริ่มคาบต้องเป็นแบบ HH:MM เช่น 08:30"
+
+def busy_response(message, retry_after):
+    """ตอบ 503 พร้อม Retry-After ให้ Kiosk รอแล้วส่งใหม่เอง"""
+    response = jsonify({"status": "busy", "message": message, "retry_after": retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+WRITE_BUSY_MESSAGE = "ระบบกำลังบันทึกข้อมูลจำนวนมาก กรุณาลองใหม่อีกครั้ง"
+
+def parse_start_time(start_time_str):
+    """เวลาเริ่มคาบแบบ 'HH:MM' เป็น time (โยน ValueError ถ้ารูปแบบหรือค่าไม่ถูกต้อง เช่น '8.30', '25:00')"""
+    return datetime.strptime(str(start_time_str).strip(), '%H:%M').time()
+
+def compute_attendance_status(scan_time, start_time_str, grace_mins):
+    """คำนวณสถานะ Present/Late จากเวลาสแกน เทียบกับเวลาเริ่มคาบ (เช่น '10:10') + เวลาผ่อนผัน"""
+    start = parse_start_time(start_time_str)
+    class_start_time = scan_time.replace(hour=start.hour, minute=start.minute, second=0, microsecond=0)
+    late_limit_time = class_start_time + timedelta(minutes=grace_mins)
+    return 'Late' if scan_time > late_limit_time else 'Present'
 
 def mark_attendance_db(student_id):
     """บันทึกเวลาเรียนลง Database (SQLite)"""
@@ -141,11 +555,38 @@ def mark_attendance_db(student_id):
         db.session.commit()
         
         # ดึงชื่อมาแสดงใน Console (ภาษาอังกฤษ)
-        student = Student.query.get(student_id)
+        student = db.session.get(Student, student_id)
         name_display = student.name_en if student else student_id
         print(f"Recorded: {name_display} - {status} at {now.strftime('%H:%M:%S')}")
 
-load_encodings()
+# --- STARTUP (เตรียมฐานข้อมูลและดัชนีใบหน้า) ---
+# ไม่ทำตอน import: สคริปต์ CLI ที่ import app (เช่น add_student.py) จะได้ไม่ต้องโหลดทุกอย่าง
+_startup_lock = threading.Lock()
+_started = False
+
+def startup():
+    """เตรียมระบบครั้งเดียวต่อ process: สร้าง/อัปเกรดตาราง แล้วโหลด Encodings"""
+    global _started
+    if _started:
+        return
+    with _startup_lock:
+        if _started:
+            return
+        with app.app_context():
+            init_db()
+        load_encodings()
+        if inference_pool is not None:
+            inference_pool.warm_up()
+        _started = True
+
+@app.before_request
+def ensure_started():
+    startup()
+
+def started_app():
+    """app ของโมดูลนี้หลังเตรียมระบบแล้ว สำหรับ WSGI server เช่น gunicorn 'app:started_app()' (ไม่ได้สร้าง app ใหม่)"""
+    startup()
+    return app
 
 
 ADMIN_USERNAME = "kru"
@@ -174,110 +615,235 @@ def logout():
 @login_required
 def index():
     """หน้าจอระบบสแกนใบหน้า (เปลี่ยนมาใช้ /scan แทน)"""
-    return render_template('index.html')
+    return render_template('index.html', stream_enabled=sock is not None)
+
+def parse_date_arg(name):
+    """อ่านวันที่ (YYYY-MM-DD) จาก query string คืน None ถ้าไม่ได้ระบุหรือรูปแบบไม่ถูกต้อง"""
+    value = request.args.get(name)
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+    except ValueError:
+        return None
 
-import json
 @app.route('/')
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    students = Student.query.all()
-    attendances = Attendance.query.all()
-    
-    # --- ส่วนเดิมของคุณ: คำนวณรายคน ---
-    student_stats = {}
-    for s in students:
-        student_stats[s.id] = {
-            'id': s.id, 'name': s.name_th, 'classroom': s.classroom or 'ไม่ระบุ',
-            'roll': s.roll_number or 0, 'total_classes': 0, 'present': 0, 'late': 0
-        }
+    # ตัวกรอง (ส่งเป็นเงื่อนไขใน SQL ไม่ได้กรองใน Python)
+    date_from = parse_date_arg('date_from')
+    date_to = parse_date_arg('date_to')
+    selected_class = request.args.get('class_name') or None
+
+    # --- คำนวณรายคนด้วย GROUP BY ในฐานข้อมูล: ได้กลับมาเฉพาะยอดรวมต่อคน ไม่ต้องโหลดทุกแถว ---
+    counts = db.session.query(
+        Attendance.student_id.label('student_id'),
+        func.count(Attendance.id).label('total_classes'),
+        func.sum(case((Attendance.status == 'Present', 1), else_=0)).label('present'),
+        func.sum(case((Attendance.status == 'Late', 1), else_=0)).label('late'),
+    )
+    if date_from:
+        counts = counts.filter(Attendance.date >= date_from)
+    if date_to:
+        counts = counts.filter(Attendance.date <= date_to)
+    counts = counts.group_by(Attendance.student_id).subquery()
+
+    rows = db.session.query(
+        Student.id, Student.name_th, Student.classroom, Student.roll_number,
+        counts.c.total_classes, counts.c.present, counts.c.late,
+    ).outerjoin(counts, counts.c.student_id == Student.id)
+    if selected_class:
+        rows = rows.filter(Student.classroom == selected_class)
 
     # --- ส่วนที่เพิ่ม: คำนวณภาพรวมทั้งโรงเรียน ---
     total_summary = {
-        'total_students': len(students),
+        'total_students': 0,
         'total_present': 0,
         'total_late': 0,
         'total_absent': 0, # สำหรับเคสที่มีชื่อแต่ไม่มีประวัติเช็กชื่อในวันนั้น
         'avg_attendance_rate': 0
     }
 
-    for a in attendances:
-        if a.student_id in student_stats:
-            student_stats[a.student_id]['total_classes'] += 1
-            if a.status == 'Present':
-                student_stats[a.student_id]['present'] += 1
-                total_summary['total_present'] += 1
-            elif a.status == 'Late':
-                student_stats[a.student_id]['late'] += 1
-                total_summary['total_late'] += 1
-    
-    # คำนวณเปอร์เซ็นต์รายคนและหาค่าเฉลี่ยรวม
+    # คำนวณเปอร์เซ็นต์รายคนและหาค่าเฉลี่ยรวม (วนลูปตามจำนวนนักเรียน ไม่ใช่จำนวนประวัติการเข้าเรียน)
     student_list = []
     total_rate_sum = 0
-    for uid, data in student_stats.items():
-        rate = round(((data['present'] + data['late']) / data['total_classes'] * 100), 2) if data['total_classes'] > 0 else 0
-        data['attendance_rate'] = rate
-        student_list.append(data)
+    for sid, name_th, classroom, roll, total, present, late in rows:
+        total, present, late = total or 0, present or 0, late or 0
+        rate = round(((present + late) / total * 100), 2) if total > 0 else 0
+        student_list.append({
+            'id': sid, 'name': name_th, 'classroom': classroom or 'ไม่ระบุ',
+            'roll': roll or 0, 'total_classes': total, 'present': present, 'late': late,
+            'attendance_rate': rate
+        })
+        total_summary['total_present'] += present
+        total_summary['total_late'] += late
         total_rate_sum += rate
 
-    total_summary['avg_attendance_rate'] = round(total_rate_sum / len(students), 2) if students else 0
+    total_summary['total_students'] = len(student_list)
+    total_summary['avg_attendance_rate'] = round(total_rate_sum / len(student_list), 2) if student_list else 0
 
+    class_list = [c[0] for c in db.session.query(Student.classroom).filter(Student.classroom != None).distinct().order_by(Student.classroom)]
     return render_template('dashboard.html', 
                            students_json=json.dumps(student_list),
-                           summary=total_summary) # ส่ง summary เพิ่มไป
+                           summary=total_summary, # ส่ง summary เพิ่มไป
+                           class_list=class_list,
+                           filters={'date_from': date_from, 'date_to': date_to, 'class_name': selected_class})
 
 @app.route('/update_db_faces')
 def update_db_faces():
-    """ปุ่มกดอัปเดต Face DB"""
+    """ปุ่มกดอัปเดต Face DB (ทำงานเบื้องหลัง หน้าสแกนยังใช้งานได้ระหว่างอัปเดต)"""
     from encode_faces import create_encodings
-    create_encodings() # เรียกฟังก์ชันรันใหม่
-    load_encodings()   # โหลดเข้า RAM
+    start_encoding_job('rebuild', lambda progress: create_encodings(workers=app.config['ENCODE_WORKERS'], progress=progress))
     return redirect(url_for('index'))
 
+@app.route('/api/encoding_jobs/<job_id>')
+def encoding_job_status(job_id):
+    """API สำหรับดูความคืบหน้าของงานสร้าง Encodings เบื้องหลัง"""
+    job = encoding_jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "ไม่พบงานนี้"}), 404
+    return jsonify(job)
+
+REPORT_PAGE_SIZE = 50
+REPORT_MAX_PAGE_SIZE = 500
+
+def encode_report_cursor(att):
+    """ตำแหน่งของแถวสุดท้ายในหน้า (date, time, id) สำหรับขอหน้าถัดไป"""
+    return f"{att.date.isoformat()}_{att.time.isoformat()}_{att.id}"
+
+def decode_report_cursor(cursor):
+    """แปลง cursor กลับเป็น (date, time, id) โยน ValueError ถ้า cursor ไม่ได้มาจาก encode_report_cursor"""
+    d, t, record_id = cursor.split('_')
+    return date.fromisoformat(d), datetime.strptime(t, '%H:%M:%S.%f' if '.' in t else '%H:%M:%S').time(), int(record_id)
+
+def query_report_page(cursor=None, limit=REPORT_PAGE_SIZE):
+    """ดึงรายงานทีละหน้าแบบ keyset (seek) เรียงจากล่าสุด: อ่านเฉพาะแถวของหน้านั้นจาก index ไม่ต้องข้าม OFFSET"""
+    query = db.session.query(Attendance, Student).\
+        join(Student, Attendance.student_id == Student.id).\
+        filter(*attendance_filters())
+    position = decode_report_cursor(cursor) if cursor else None
+    if position:
+        query = query.filter(tuple_(Attendance.date, Attendance.time, Attendance.id) < tuple_(*position))
+    rows = query.order_by(Attendance.date.desc(), Attendance.time.desc(), Attendance.id.desc()).\
+        limit(limit + 1).all()
+    next_cursor = encode_report_cursor(rows[limit - 1][0]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
 @app.route('/reports')
 @login_required
 def reports():
-    """หน้าเว็บแสดงรายงานทั้งหมด"""
-    # ดึงข้อมูลทั้งหมดจาก Database เรียงจากวันที่และเวลาล่าสุดขึ้นก่อน
-    records = db.session.query(Attendance, Student).\
-        join(Student, Attendance.student_id == Student.id).\
-        order_by(Attendance.date.desc(), Attendance.time.desc()).all()
-    
-    return render_template('reports.html', records=records)
+    """หน้าเว็บแสดงรายงาน (หน้าแรก) หน้าถัดไปโหลดต่อจาก /api/reports เมื่อเลื่อนลง"""
+    records, next_cursor = query_report_page()
 
-@app.route('/export_csv')
-def export_csv():
-    """ฟังก์ชันสำหรับดาวน์โหลดไฟล์ Excel (CSV)"""
-    records = db.session.query(Attendance, Student).\
-        join(Student, Attendance.student_id == Student.id).\
-        order_by(Attendance.date.desc(), Attendance.time.desc()).all()
-    
-    # สร้างไฟล์ CSV ในหน่วยความจำ
+    class_list = [c[0] for c in db.session.query(Student.classroom).filter(Student.classroom != None).distinct().order_by(Student.classroom)]
+    subject_list = [s[0] for s in db.session.query(Subject.name).order_by(Subject.name)]
+    return render_template('reports.html', records=records, next_cursor=next_cursor,
+                           class_list=class_list, subject_list=subject_list, filters=request.args)
+
+@app.route('/api/reports')
+@login_required
+def api_reports():
+    """API รายงานการเข้าเรียนทีละหน้า (?cursor=... จาก next_cursor ของหน้าก่อน) ใช้ตัวกรองเดียวกับหน้า reports"""
+    limit = min(max(request.args.get('limit', REPORT_PAGE_SIZE, type=int), 1), REPORT_MAX_PAGE_SIZE)
+    try:
+        records, next_cursor = query_report_page(request.args.get('cursor'), limit)
+    except ValueError:
+        # ไม่ย้อนไปหน้าแรกเงียบๆ: หน้าเว็บจะต่อรายการซ้ำกับที่แสดงไปแล้ว
+        return jsonify({"status": "error", "message": "cursor ไม่ถูกต้อง กรุณาโหลดรายงานใหม่"}), 400
+    return jsonify({
+        "records": [{
+            "id": att.id,
+            "date": att.date.strftime('%d/%m/%Y'),
+            "time": att.time.strftime('%H:%M:%S'),
+            "student_id": std.id,
+            "name_th": std.name_th,
+            "classroom": std.classroom,
+            "status": att.status,
+            "subject": att.subject,
+        } for att, std in records],
+        "next_cursor": next_cursor,
+    })
+
+def attendance_filters():
+    """แปลงตัวกรองจาก query string (date_from, date_to, class_name, subject, status) เป็นเงื่อนไข SQL"""
+    filters = []
+    date_from = parse_date_arg('date_from')
+    date_to = parse_date_arg('date_to')
+    if date_from:
+        filters.append(Attendance.date >= date_from)
+    if date_to:
+        filters.append(Attendance.date <= date_to)
+    if request.args.get('class_name'):
+        filters.append(Student.classroom == request.args['class_name'])
+    if request.args.get('subject'):
+        filters.append(Attendance.subject == request.args['subject'])
+    if request.args.get('status'):
+        filters.append(Attendance.status == request.args['status'])
+    return filters
+
+EXPORT_HEADERS = ['วันที่ (Date)', 'เวลา (Time)', 'รหัสนักเรียน (ID)', 'ชื่อ-นามสกุล (Name)', 'ชั้นเรียน (Class)', 'สถานะ (Status)', 'วิชา (Subject)']
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+def iter_export_rows():
+    """ดึงข้อมูลทีละชุด (yield_per) แทนการโหลดทั้งตารางด้วย .all() หน่วยความจำจึงคงที่ไม่ว่าข้อมูลจะมากแค่ไหน"""
+    query = db.session.query(
+        Attendance.date, Attendance.time, Student.id, Student.name_th,
+        Student.classroom, Attendance.status, Attendance.subject,
+    ).join(Student, Attendance.student_id == Student.id).\
+        filter(*attendance_filters()).\
+        order_by(Attendance.date.desc(), Attendance.time.desc()).\
+        execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    for att_date, att_time, std_id, name_th, classroom, status, subject in query:
+        # แปลง status ภาษาอังกฤษ เป็นไทยเพื่อให้ครูอ่านง่าย
+        status_th = "มาเรียน" if status == 'Present' else "มาสาย" if status == 'Late' else status
+        yield [att_date.strftime('%d/%m/%Y'), att_time.strftime('%H:%M:%S'), std_id, name_th, classroom, status_th, subject]
+
+def _stream_csv():
     si = io.StringIO()
     cw = csv.writer(si)
-    
-    # เขียนหัวตาราง (Headers)
-    cw.writerow(['วันที่ (Date)', 'เวลา (Time)', 'รหัสนักเรียน (ID)', 'ชื่อ-นามสกุล (Name)', 'ชั้นเรียน (Class)', 'สถานะ (Status)'])
-    
-    # วนลูปเขียนข้อมูลทีละบรรทัด
-    for att, std in records:
-        # แปลง status ภาษาอังกฤษ เป็นไทยเพื่อให้ครูอ่านง่าย
-        status_th = "มาเรียน" if att.status == 'Present' else "มาสาย" if att.status == 'Late' else att.status
-        
-        cw.writerow([
-            att.date.strftime('%d/%m/%Y'),
-            att.time.strftime('%H:%M:%S'),
-            std.id,
-            std.name_th,
-            std.classroom,
-            status_th
-        ])
-        
-    # ส่งไฟล์กลับไปให้เบราว์เซอร์ดาวน์โหลด
-    output = make_response(si.getvalue())
-    output.headers["Content-Disposition"] = "attachment; filename=attendance_report.csv"
-    # ใช้ utf-8-sig เพื่อให้โปรแกรม Excel เปิดแล้วภาษาไทยไม่เพี้ยน
-    output.headers["Content-type"] = "text/csv; charset=utf-8-sig" 
+    # BOM เพื่อให้โปรแกรม Excel เปิดแล้วภาษาไทยไม่เพี้ยน
+    si.write('\ufeff')
+    cw.writerow(EXPORT_HEADERS)
+    for row in iter_export_rows():
+        cw.writerow(row)
+        # ส่งออกไปทีละก้อน ไม่สะสมทั้งไฟล์ไว้ในหน่วยความจำ
+        if si.tell() >= EXPORT_CHUNK_BYTES:
+            yield si.getvalue().encode('utf-8')
+            si.seek(0)
+            si.truncate()
+    yield si.getvalue().encode('utf-8')
+
+def _stream_xlsx():
+    # openpyxl แบบ write_only เขียนทีละแถวลงไฟล์ชั่วคราว (ไม่เก็บทั้ง Workbook ไว้ใน RAM)
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Attendance')
+    ws.append(EXPORT_HEADERS)
+    for row in iter_export_rows():
+        ws.append(row)
+
+    with tempfile.TemporaryFile() as tmp:
+        wb.save(tmp)
+        tmp.seek(0)
+        for chunk in iter(lambda: tmp.read(EXPORT_CHUNK_BYTES), b''):
+            yield chunk
+
+@app.route('/export_csv')
+def export_csv():
+    """ฟังก์ชันสำหรับดาวน์โหลดไฟล์ Excel (CSV หรือ XLSX ด้วย ?format=xlsx) กรองได้ด้วย date_from, date_to, class_name, subject"""
+    if request.args.get('format') == 'xlsx':
+        generator = _stream_xlsx()
+        filename = 'attendance_report.xlsx'
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    else:
+        generator = _stream_csv()
+        filename = 'attendance_report.csv'
+        mimetype = 'text/csv; charset=utf-8'
+
+    # ส่งไฟล์กลับไปให้เบราว์เซอร์ดาวน์โหลดแบบทยอยส่ง (chunked)
+    output = Response(stream_with_context(generator), mimetype=mimetype)
+    output.headers["Content-Disposition"] = f"attachment; filename={filename}"
     return output
 
 @app.route('/students')
@@ -292,20 +858,20 @@ def delete_student_route(student_id):
     """ระบบลบนักเรียนออกแบบเบ็ดเสร็จ"""
     # 1. ลบประวัติเข้าเรียนและข้อมูลส่วนตัวออกจาก Database
     Attendance.query.filter_by(student_id=student_id).delete()
-    student = Student.query.get(student_id)
+    student = db.session.get(Student, student_id)
     if student:
         db.session.delete(student)
-        db.session.commit()
+    db.session.commit()
+    invalidate_student_caches(student_id)
         
     # 2. ลบโฟลเดอร์รูปภาพในเครื่อง
     folder_path = os.path.join('images_db', str(student_id))
     if os.path.exists(folder_path):
         shutil.rmtree(folder_path) # ลบโฟลเดอร์และไฟล์ข้างในทิ้งทั้งหมด
         
-    # 3. อัปเดตไฟล์ AI (แปลงใบหน้าใหม่)
-    from encode_faces import create_encodings
-    create_encodings()
-    load_encodings()
+    # 3. อัปเดตไฟล์ AI เบื้องหลัง (ลบเฉพาะใบหน้าของคนนี้ ไม่ต้องแปลงรูปคนอื่นใหม่)
+    from encode_faces import remove_student_encodings
+    start_encoding_job('remove_student', lambda progress: remove_student_encodings(student_id))
     
     # เสร็จแล้วให้รีเฟรชกลับมาหน้าเดิม
     return redirect(url_for('students'))
@@ -318,13 +884,17 @@ def register_student():
         return render_template('add_student.html')
 
     if request.method == 'POST':
-        # รับข้อมูล JSON จากหน้าเว็บ (Javascript)
-        data = request.json
+        # รับข้อมูลจากหน้าเว็บ: multipart (ไฟล์ JPEG ตรงๆ) หรือ JSON Base64 แบบเดิม
+        if request.files:
+            data = request.form
+            images = request.files.getlist('images') # รายการไฟล์รูปภาพ (5 รูป)
+        else:
+            data = request.get_json(silent=True) or {}
+            images = data.get('images') # รายการรูปภาพแบบ Base64 (5 รูป)
         student_id = data.get('student_id')
         name_th = data.get('name_th')
         name_en = data.get('name_en')
         classroom = data.get('classroom')
-        images = data.get('images') # รายการรูปภาพแบบ Base64 (5 รูป)
 
         if not student_id or not images:
             return jsonify({"status": "error", "message": "ข้อมูลไม่ครบถ้วน"})
@@ -335,27 +905,31 @@ def register_student():
             new_student = Student(id=student_id, name_th=name_th, name_en=name_en, classroom=classroom)
             db.session.add(new_student)
             db.session.commit()
+            invalidate_student_caches(student_id)
 
         # 2. สร้างโฟลเดอร์เก็บรูปภาพ
         folder_path = os.path.join('images_db', str(student_id))
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
 
-        # 3. แปลงไฟล์รูปภาพ Base64 เป็นไฟล์ .jpg เซฟลงเครื่อง
+        # 3. เซฟรูปภาพเป็นไฟล์ .jpg ลงเครื่อง
         for i, img_data in enumerate(images):
-            # ตัดส่วนหัว (Header) ของ Base64 ออกก่อน
-            img_data = img_data.split(',')[1]
-            img_bytes = base64.b64decode(img_data)
             file_path = os.path.join(folder_path, f"{student_id}_{i+1}.jpg")
-            with open(file_path, "wb") as fh:
-                fh.write(img_bytes)
-
-        # 4. เรียกฟังก์ชัน AI ให้เรียนรู้ใบหน้าใหม่ทันที
-        from encode_faces import create_encodings
-        create_encodings() 
-        load_encodings() # โหลดค่าใหม่เข้า RAM ทันทีเพื่อให้สแกนติดได้เลย
-
-        return jsonify({"status": "success", "message": "ลงทะเบียนและอัพเดต AI สำเร็จ!"})
+            if isinstance(img_data, str):
+                # ตัดส่วนหัว (Header) ของ Base64 ออกก่อน
+                img_data = img_data.split(',')[1]
+                with open(file_path, "wb") as fh:
+                    fh.write(base64.b64decode(img_data))
+            else:
+                img_data.save(file_path) # ไฟล์จาก multipart เขียนลงดิสก์ได้เลย ไม่ต้องแปลง
+
+        # 4. ให้ AI เรียนรู้ใบหน้าใหม่เบื้องหลัง (encode เฉพาะรูปของนักเรียนคนนี้)
+        #    เสร็จแล้วจะโหลดเข้า RAM อัตโนมัติ ดูความคืบหน้าได้ที่ /api/encoding_jobs/<job_id>
+        from encode_faces import add_student_encodings
+        job_id = start_encoding_job('add_student', lambda progress: add_student_encodings(
+            student_id, workers=app.config['ENCODE_WORKERS'], progress=progress))
+
+        return jsonify({"status": "success", "message": "ลงทะเบียนสำเร็จ! AI กำลังเรียนรู้ใบหน้าเบื้องหลัง", "job_id": job_id})
 
 @app.route('/api/classes')
 def get_classes():
@@ -373,6 +947,73 @@ def get_students_by_class(class_name):
     student_list = [{"id": s.id, "name_th": s.name_th} for s in students]
     return jsonify(student_list)
 
+IMPORT_REQUIRED_COLUMNS = ['ID', 'Roll_Number', 'Name_TH', 'Classroom']
+IMPORT_COLUMN_LIMITS = {'id': 20, 'name_th': 100, 'name_en': 100, 'classroom': 50}
+
+def normalize_roster(df):
+    """ตรวจและแปลงข้อมูลรายชื่อทั้งคอลัมน์ในครั้งเดียว คืนค่า (รายการที่ถูกต้อง, ข้อผิดพลาดรายแถว)"""
+    import pandas as pd
+
+    def text(column):
+        if column not in df.columns:
+            return pd.Series('', index=df.index)
+        return df[column].fillna('').astype(str).str.strip()
+
+    roster = pd.DataFrame({
+        # Excel มักอ่านรหัสที่เป็นตัวเลขเป็น float (เช่น 12345.0) เมื่อคอลัมน์มีช่องว่าง
+        'id': text('ID').str.replace(r'\.0$', '', regex=True),
+        'name_th': text('Name_TH'),
+        'name_en': text('Name_EN'),
+        'classroom': text('Classroom'),
+    })
+    roll = pd.to_numeric(df['Roll_Number'], errors='coerce')
+    # เลขแถวตามที่เห็นใน Excel (แถวที่ 1 คือหัวตาราง)
+    row_numbers = pd.Series(range(2, len(df) + 2), index=df.index)
+
+    problems = [
+        (roster['id'] == '', "ไม่มีรหัสนักเรียน"),
+        (roster['name_th'] == '', "ไม่มีชื่อภาษาไทย"),
+        (df['Roll_Number'].notna() & (roll.isna() | (roll % 1 != 0)), "เลขที่ต้องเป็นจำนวนเต็ม"),
+        (roster['id'].duplicated(keep='last') & (roster['id'] != ''), "รหัสนักเรียนซ้ำกับแถวอื่นในไฟล์ (ใช้ข้อมูลแถวล่างสุด)"),
+    ] + [
+        (roster[column].str.len() > limit, f"{column} ยาวเกิน {limit} ตัวอักษร")
+        for column, limit in IMPORT_COLUMN_LIMITS.items()
+    ]
+
+    invalid = pd.Series(False, index=df.index)
+    errors = []
+    for mask, message in problems:
+        for idx in df.index[mask & ~invalid]:
+            errors.append({"row": int(row_numbers[idx]), "id": roster.at[idx, 'id'], "message": message})
+        invalid |= mask
+    errors.sort(key=lambda e: e['row'])
+
+    valid = roster[~invalid].copy()
+    valid['roll_number'] = roll[~invalid].astype('Int64').astype(object).where(roll[~invalid].notna(), None)
+    return valid.to_dict('records'), errors
+
+# จำนวนค่าใน IN (...) ต่อคำสั่ง: SQLite รุ่นก่อน 3.32 รับตัวแปรได้ไม่เกิน 999 ต่อคำสั่ง
+SQL_IN_CHUNK = 500
+
+def upsert_students(records):
+    """เพิ่มหรืออัปเดตนักเรียนทั้งชุดด้วย INSERT ... ON CONFLICT DO UPDATE (ผู้เรียกต้อง commit เอง)"""
+    if not records:
+        return 0, 0
+    ids = [r['id'] for r in records]
+    existing = set()
+    for start in range(0, len(ids), SQL_IN_CHUNK):
+        chunk = ids[start:start + SQL_IN_CHUNK]
+        existing.update(db.session.execute(select(Student.id).where(Student.id.in_(chunk))).scalars())
+
+    stmt = sqlite_insert(Student)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Student.id],
+        set_={column: stmt.excluded[column] for column in ('roll_number', 'name_th', 'name_en', 'classroom')},
+    )
+    db.session.execute(stmt, records)
+    updated = sum(1 for i in ids if i in existing)
+    return len(ids) - updated, updated
+
 @app.route('/import_students', methods=['POST'])
 def import_students():
     """API สำหรับรับไฟล์ Excel และบันทึกรายชื่อลง Database"""
@@ -385,125 +1026,589 @@ def import_students():
         
     if file and file.filename.endswith('.xlsx'):
         try:
-            # ใช้ pandas อ่านไฟล์ Excel
-            df = pd.read_excel(file)
+            # ใช้ pandas อ่านไฟล์ Excel (อ่านรหัสเป็นข้อความ เลข 0 นำหน้าจะได้ไม่หาย)
+            # import เฉพาะตอนนำเข้า Excel: pandas ใช้เวลาโหลดนาน และหน้าอื่นไม่ได้ใช้
+            import pandas as pd
+            df = pd.read_excel(file, dtype={'ID': str})
+            df.columns = [str(c).strip() for c in df.columns]
             
             # ตรวจสอบว่ามีคอลัมน์ที่ต้องการครบไหม (เพิ่ม Roll_Number)
-            required_columns = ['ID', 'Roll_Number', 'Name_TH', 'Classroom']
-            for col in required_columns:
+            for col in IMPORT_REQUIRED_COLUMNS:
                 if col not in df.columns:
                     return jsonify({"status": "error", "message": f"ไฟล์ Excel ต้องมีคอลัมน์ชื่อ {col}"})
+        except Exception as e:
+            return jsonify({"status": "error", "message": f"เกิดข้อผิดพลาดในการอ่านไฟล์: {str(e)}"})
 
-            success_count = 0
-            for index, row in df.iterrows():
-                student_id = str(row['ID']).strip()
-                roll_number = int(row['Roll_Number']) if pd.notna(row['Roll_Number']) else None # <--- ดึงเลขที่
-                name_th = str(row['Name_TH']).strip()
-                name_en = str(row.get('Name_EN', '')).strip()
-                classroom = str(row['Classroom']).strip()
-
-                existing_student = Student.query.get(student_id)
-                if not existing_student:
-                    # เพิ่มตัวแปร roll_number เข้าไปตอนสร้างใหม่
-                    new_student = Student(id=student_id, roll_number=roll_number, name_th=name_th, name_en=name_en, classroom=classroom)
-                    db.session.add(new_student)
-                    success_count += 1
-                else:
-                    # อัปเดตข้อมูลให้เป็นปัจจุบัน
-                    existing_student.roll_number = roll_number
-                    existing_student.name_th = name_th
-                    existing_student.name_en = name_en
-                    existing_student.classroom = classroom
-                    success_count += 1
-            
+        records, errors = normalize_roster(df)
+        try:
+            # บันทึกทั้งไฟล์ใน Transaction เดียว (การนำเข้ารายชื่อไม่มีรูปใหม่ จึงไม่ต้องสร้าง Encodings ใหม่)
+            inserted, updated = upsert_students(records)
             db.session.commit()
-            from encode_faces import create_encodings
-            create_encodings()
-            load_encodings()
-            
-            return jsonify({"status": "success", "message": f"นำเข้า/อัปเดตข้อมูลสำเร็จ {success_count} รายการ!"})
+            invalidate_student_caches()
         except Exception as e:
-            return jsonify({"status": "error", "message": f"เกิดข้อผิดพลาดในการอ่านไฟล์: {str(e)}"})
+            db.session.rollback()
+            return jsonify({"status": "error", "message": f"บันทึกข้อมูลไม่สำเร็จ: {str(e)}", "errors": errors})
+
+        message = f"นำเข้าสำเร็จ {inserted} รายการ อัปเดต {updated} รายการ"
+        if errors:
+            message += f" (ข้ามแถวที่ไม่ถูกต้อง {len(errors)} แถว)"
+        return jsonify({"status": "success", "message": message,
+                        "inserted": inserted, "updated": updated, "errors": errors})
     else:
         return jsonify({"status": "error", "message": "ระบบรองรับเฉพาะไฟล์นามสกุล .xlsx เท่านั้น"})
 
-import numpy as np
-from datetime import datetime
-
 @app.route('/recognize_face', methods=['POST'])
+@observe_request('recognize_face')
 def recognize_face():
-    global known_face_encodings, known_face_ids
+    def outcome(name):
+        REQUESTS.inc(endpoint='recognize_face', outcome=name)
+
     try:
-        data = request.json
-        img_data = data.get('image')
-        
-        if not img_data:
+        # รับรูปภาพ (ได้ทั้งไฟล์ JPEG ตรงๆ, multipart และ JSON Base64)
+        with timed(STAGE_SECONDS, endpoint='recognize_face', stage='read'):
+            buf = read_request_image_bytes()
+        if not buf:
+            outcome('bad_request')
             return jsonify({"status": "error", "message": "ไม่ได้รับข้อมูลรูปภาพ"})
 
-        # แปลงรูปภาพ
-        format, imgstr = img_data.split(';base64,')
-        image_bytes = base64.b64decode(imgstr)
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-        # ค้นหาใบหน้า
-        face_locations = face_recognition.face_locations(rgb_img)
-        if not face_locations:
-            return jsonify({"status": "error", "message": "ไม่พบใบหน้าในรูปภาพ"})
-
-        face_encodings = face_recognition.face_encodings(rgb_img, face_locations)
-        
-        for face_encoding in face_encodings:
-            matches = face_recognition.compare_faces(known_face_encodings, face_encoding, tolerance=0.5)
-            if True in matches:
-                first_match_index = matches.index(True)
-                # ตอนนี้ student_id จะไม่ Error แล้วครับ
-                student_id = known_face_ids[first_match_index]
-                student = db.session.get(Student, student_id)
-                
-                if student is not None:
-                    return jsonify({
-                        "status": "success",
-                        "student_id": student.id,
-                        "name_th": student.name_th,
-                        "classroom": student.classroom,
-                        "roll_number": student.roll_number
-                    })
-        return jsonify({"status": "error", "message": "ไม่พบข้อมูลนักเรียน"})
+        # ใช้ค่าความเข้มงวดและโปรไฟล์จากหน้าตั้งค่า (แต่ละ Kiosk เลือกโปรไฟล์เองได้ด้วย ?profile=fast)
+        setting = get_settings()
+        tolerance = setting['ai_tolerance']
+        profile = resolve_profile(request.args.get('profile'), default=resolve_profile(setting['recognition_profile']))
+        # Kiosk ส่งห้องที่เลือกมาด้วย (?classroom=) ค้นในห้องนั้นก่อน ไม่พบจึงค้นทั้งโรงเรียน
+        classroom = request.args.get('classroom') or ''
+        classroom_ids = get_classroom_ids(classroom)
+
+        # กดถ่ายซ้ำ/ส่งซ้ำด้วยเฟรมเกือบเดิม: ตอบผลเดิมโดยไม่ต้อง detect/encode ใหม่
+        with timed(STAGE_SECONDS, endpoint='recognize_face', stage='frame_hash'):
+            digest = frame_hash(buf) if frame_cache.ttl > 0 else None
+            frame_key = content_key(buf) if digest is not None else None
+        kiosk = kiosk_session_key()
+        cache_scope = (profile, classroom, tolerance, store_stamp(encoding_file))
+        cached = frame_cache.get(kiosk, digest, cache_scope, key=frame_key)
+        if cached is not None:
+            name, payload = cached
+            outcome(name)
+            return jsonify(dict(payload, cached=True))
+
+        # ค้นหาใบหน้า (ใน inference worker) ถ้าคิวเต็มให้ Kiosk ลองใหม่ภายหลังแทนการรอต่อคิวยาว
+        try:
+            result = recognize_image(buf, profile, classroom_ids, tolerance)
+        except InferenceBusy:
+            outcome('busy')
+            return busy_response(INFERENCE_BUSY_MESSAGE, app.config['INFERENCE_RETRY_AFTER'])
+        except InferenceTimeout:
+            # worker ช้าผิดปกติ (เครื่องทำงานหนักหรือภาพใหญ่มาก) ไม่ให้ตกไปที่ except ด้านล่างซึ่งได้ข้อความว่าง
+            outcome('timeout')
+            return jsonify({"status": "error", "message": INFERENCE_TIMEOUT_MESSAGE}), 504
+        for stage_name, seconds in result['timings'].items():
+            STAGE_SECONDS.observe(seconds, endpoint='recognize_face', stage=stage_name)
+
+        if not result['decoded']:
+            outcome('bad_request')
+            return jsonify({"status": "error", "message": "ไม่ได้รับข้อมูลรูปภาพ"})
+        name, payload = recognition_response(result, tolerance, profile)
+        # เก็บเฉพาะผลการจดจำ (match / no_match / no_face) ไม่เก็บ error หรือ busy
+        # ผล match ใช้ซ้ำได้กับไฟล์เดิมเท่านั้น เฟรมที่แค่คล้ายกันอาจเป็นนักเรียนคนถัดไปหน้ากล้องเดิม
+        frame_cache.put(kiosk, digest, cache_scope, (name, payload), key=frame_key, near=name != 'match')
+        outcome(name)
+        return jsonify(payload)
     except Exception as e:
+        outcome('error')
         return jsonify({"status": "error", "message": str(e)})
 
+def recognition_response(result, tolerance, profile):
+    """แปลงผลจาก inference เป็น (outcome, JSON ที่ตอบ Kiosk)"""
+    if not result['faces']:
+        return 'no_face', {"status": "error", "message": "ไม่พบใบหน้าในรูปภาพ"}
+    FACES_DETECTED.inc(result['faces'], endpoint='recognize_face')
+    for scope in result['scopes']:
+        SEARCH_SCOPE.inc(endpoint='recognize_face', scope=scope)
+
+    # เลือกคนที่ "ใกล้ที่สุด" ไม่ใช่คนแรกที่ผ่านเกณฑ์
+    matches = [m for m in result['matches'] if m is not None and m.distance <= tolerance]
+    MATCHES.inc(len(matches), endpoint='recognize_face', result='match')
+    MATCHES.inc(result['faces'] - len(matches), endpoint='recognize_face', result='no_match')
+
+    with timed(STAGE_SECONDS, endpoint='recognize_face', stage='db_lookup'):
+        for match in sorted(matches, key=lambda m: m.distance):
+            student = get_student_profile(match.student_id)
+            if student is not None:
+                break
+        else:
+            return 'no_match', {"status": "error", "message": "ไม่พบข้อมูลนักเรียน"}
+
+    return 'match', {
+        "status": "success",
+        "student_id": student['id'],
+        "name_th": student['name_th'],
+        "classroom": student['classroom'],
+        "roll_number": student['roll_number'],
+        "distance": round(match.distance, 4),
+        "margin": round(match.margin, 4) if np.isfinite(match.margin) else None,
+        "profile": profile
+    }
+
+# ระยะห่างของคนอันดับ 1 กับอันดับ 2 ที่น้อยกว่านี้ถือว่ากำกวม (ไม่บันทึกอัตโนมัติในรูปหมู่)
+BATCH_AMBIGUOUS_MARGIN = 0.06
+
+def read_request_images():
+    """อ่านไฟล์รูปหลายรูปจาก request (bytes ยังไม่ decode): multipart (ช่อง 'images'), ไฟล์ JPEG เดี่ยว หรือ JSON Base64"""
+    if request.files:
+        buffers = [f.read() for f in request.files.getlist('images')]
+    elif request.mimetype.startswith('image/'):
+        buffers = [request.get_data(cache=False)]
+    else:
+        data = request.get_json(silent=True) or {}
+        buffers = [base64.b64decode(img.split(';base64,')[-1]) for img in data.get('images', [])]
+    return [buf for buf in buffers if buf]
+
+@app.route('/recognize_batch', methods=['POST'])
+@login_required
+@observe_request('recognize_batch')
+def recognize_batch():
+    """API เช็กชื่อทั้งห้องจากรูปหมู่ (รับได้หลายรูป) แล้วบันทึกทุกคนที่จำได้ใน Transaction เดียว"""
+    params = request.form if request.files else (request.args if request.mimetype.startswith('image/')
+                                                 else (request.get_json(silent=True) or {}))
+    subject = params.get('subject')
+    start_time_str = params.get('start_time')
+    classroom = params.get('classroom')
+    if not subject or not start_time_str or not classroom:
+        return jsonify({"status": "error", "message": "กรุณาระบุวิชา เวลาเริ่มคาบ และชั้นเรียน"})
+    # ตรวจก่อนเริ่มจดจำใบหน้า (งานหนัก) ไม่ใช่ไปพังตอนบันทึกหลังประมวลผลรูปหมู่เสร็จแล้ว
+    try:
+        parse_start_time(start_time_str)
+    except ValueError:
+        return jsonify({"status": "error", "message": START_TIME_FORMAT_ERROR})
+
+    images = read_request_images()
+    if not images:
+        return jsonify({"status": "error", "message": "ไม่ได้รับข้อมูลรูปภาพ"})
+
+    setting = get_settings()
+    tolerance = setting['ai_tolerance']
+    grace_mins = setting['late_grace_mins']
+    # รูปหมู่ใบหน้ามีขนาดเล็ก ค่าเริ่มต้นจึงใช้ภาพเต็ม (accurate) และ encode ทุกใบหน้า
+    profile = resolve_profile(params.get('profile'), default='accurate')
+
+    # 1. หาใบหน้าทุกคนในทุกรูปใน inference pool (คิวเดียวกับ /recognize_face ถ้าคิวเต็มตอบ 503 ให้ส่งใหม่)
+    all_encodings = []
+    decoded = 0
+    try:
+        for buf in images:
+            result = encode_image(buf, profile, largest_only=False)
+            decoded += result['decoded']
+            all_encodings.extend(result['encodings'])
+    except InferenceBusy:
+        return busy_response(INFERENCE_BUSY_MESSAGE, app.config['INFERENCE_RETRY_AFTER'])
+    except InferenceTimeout:
+        return jsonify({"status": "error", "message": INFERENCE_TIMEOUT_MESSAGE}), 504
+    if not decoded:
+        return jsonify({"status": "error", "message": "ไม่ได้รับข้อมูลรูปภาพ"})
+    FACES_DETECTED.inc(len(all_encodings), endpoint='recognize_batch')
+
+    # 2. เทียบทุกใบหน้ากับนักเรียนในห้องก่อน (เหมือน /recognize_face) ใบหน้าที่ไม่ผ่าน tolerance จึงค้นทั้งโรงเรียน
+    #    แล้วรวมคนซ้ำข้ามรูป (เก็บระยะที่ใกล้ที่สุด)
+    refresh_encodings_if_changed()
+    tops, scopes = (face_index.top_k_partitioned(all_encodings, get_classroom_ids(classroom), tolerance, k=2)
+                    if all_encodings else ([], []))
+    for scope in scopes:
+        SEARCH_SCOPE.inc(endpoint='recognize_batch', scope=scope)
+    recognized = {}
+    ambiguous = []
+    unknown_faces = 0
+    for top in tops:
+        if not top or top[0][1] > tolerance:
+            unknown_faces += 1
+            continue
+        student_id, distance = top[0]
+        margin = top[1][1] - distance if len(top) > 1 else float('inf')
+        if margin < BATCH_AMBIGUOUS_MARGIN:
+            ambiguous.append([{"student_id": sid, "distance": round(d, 4)} for sid, d in top])
+        elif student_id not in recognized or distance < recognized[student_id]:
+            recognized[student_id] = distance
+    # ถ้ามีรูปอื่นจำคนนั้นได้ชัดเจนแล้ว ไม่ต้องรายงานว่ากำกวม
+    ambiguous = [c for c in ambiguous if c[0]["student_id"] not in recognized]
+
+    # 3. บันทึกทุกคนในห้องที่จำได้ด้วยคำสั่งเดียวใน Transaction เดียว (คนที่เช็กวิชานี้ไปแล้วจะถูกข้าม)
+    now = datetime.now()
+    class_students = Student.query.filter_by(classroom=classroom).order_by(Student.roll_number, Student.id).all()
+    class_ids = {s.id for s in class_students}
+
+    status = compute_attendance_status(now, start_time_str, grace_mins)
+    ordered = sorted(recognized.items(), key=lambda item: item[1])
+    other_class = [sid for sid, _ in ordered if sid not in class_ids]
+    inserted = set(insert_attendance([
+        {'student_id': sid, 'date': now.date(), 'time': now.time(), 'status': status, 'subject': subject}
+        for sid, _ in ordered if sid in class_ids
+    ]))
+    db.session.commit()
+    results = [(sid, d, status if sid in inserted else 'already') for sid, d in ordered if sid in class_ids]
+    already = {r.student_id for r in Attendance.query.filter(
+        Attendance.date == now.date(), Attendance.subject == subject,
+        Attendance.student_id.in_(class_ids)).all()} if class_ids else set()
+
+    by_id = {s.id: s for s in class_students}
+    for student in Student.query.filter(Student.id.in_(other_class)).all() if other_class else []:
+        by_id[student.id] = student
+
+    def describe(student_id):
+        student = by_id.get(student_id)
+        return {"student_id": student_id,
+                "name_th": student.name_th if student else None,
+                "classroom": student.classroom if student else None,
+                "roll_number": student.roll_number if student else None}
+
+    seen = set(recognized) | already
+    return jsonify({
+        "status": "success",
+        "faces_detected": len(all_encodings),
+        "recognized": [dict(describe(sid), distance=round(d, 4), attendance=r) for sid, d, r in results],
+        "other_class": [describe(sid) for sid in other_class],
+        "ambiguous": ambiguous,
+        "unknown_faces": unknown_faces,
+        "missing": [describe(s.id) for s in class_students if s.id not in seen],
+    })
+
+def insert_attendance(rows):
+    """เพิ่มแถว Attendance ด้วย INSERT ... ON CONFLICT DO NOTHING คืนรายการ student_id ที่เพิ่มได้จริง
+
+    การตรวจซ้ำกับการบันทึกเป็นคำสั่งเดียว (ใช้ unique index) Kiosk 2 เครื่องสแกนพร้อมกันก็ไม่เกิดแถวซ้ำ
+    ผู้เรียกต้อง commit เอง เพื่อรวมหลายคำสั่งไว้ใน Transaction เดียวได้
+    """
+    if not rows:
+        return []
+    stmt = sqlite_insert(Attendance).values(rows).on_conflict_do_nothing(
+        index_elements=ATTENDANCE_UNIQUE_COLUMNS).returning(Attendance.student_id)
+    return [r[0] for r in db.session.execute(stmt)]
+
+def record_attendance(student_id, subject, start_time_str, scan_time=None):
+    """บันทึกการเข้าเรียน 1 รายการ คืนค่า (สถานะ, บันทึกใหม่หรือไม่) ถ้าเช็กวิชานี้ไปแล้วจะคืนสถานะเดิม"""
+    now = scan_time or datetime.now()
+
+    # 1. ดึงค่าเวลาผ่อนผัน (เช่น 15 นาที)
+    grace_mins = get_settings()['late_grace_mins']
+    
+    # 2. ตัดสินว่าสายหรือไม่ (เลยเวลาเริ่มคาบ + เวลาผ่อนผัน = สาย)
+    status = compute_attendance_status(now, start_time_str, grace_mins)
+    row = {'student_id': student_id, 'date': now.date(), 'time': now.time(), 'status': status, 'subject': subject}
+
+    def write(conn):
+        inserted = conn.execute(sqlite_insert(Attendance).values(row).on_conflict_do_nothing(
+            index_elements=ATTENDANCE_UNIQUE_COLUMNS).returning(Attendance.id)).fetchall()
+        if inserted:
+            return status, True
+        # เช็กวิชานี้ไปแล้ว: ดึงสถานะเดิม (ค้นผ่าน unique index)
+        existing = conn.execute(select(Attendance.status).filter_by(
+            student_id=student_id, date=now.date(), subject=subject)).scalar()
+        return (existing or status), False
+
+    # ปิด Transaction การอ่านของ session ก่อน แล้วส่งงานเขียนเข้าก้อน Group Commit
+    db.session.commit()
+    # รวมเวลารอคิว Group Commit + รอ write lock + commit
+    with timed(STAGE_SECONDS, endpoint='record_attendance', stage='db_write'):
+        return group_commit.run(db.engine, write)
+
 @app.route('/save_attendance', methods=['POST'])
+@observe_request('save_attendance')
 def save_attendance():
     """API สำหรับบันทึกข้อมูลและคำนวณเวลาสายตามรายวิชา"""
     data = request.json
     student_id = data.get('student_id')
     subject = data.get('subject')
     start_time_str = data.get('start_time') # เวลาเริ่มคาบที่ครูกรอก เช่น '10:10'
+    try:
+        parse_start_time(start_time_str)
+    except ValueError:
+        REQUESTS.inc(endpoint='save_attendance', outcome='bad_request')
+        return jsonify({"status": "error", "message": START_TIME_FORMAT_ERROR})
     
-    now = datetime.now()
-    existing = Attendance.query.filter_by(student_id=student_id, date=now.date(), subject=subject).first()
-    if existing:
+    try:
+        status, created = record_attendance(student_id, subject, start_time_str)
+    except GroupCommitTimeout:
+        # งานอาจยัง commit ทีหลัง ส่งซ้ำได้เพราะ unique index กันการบันทึกซ้ำ (จะได้ "เช็กชื่อไปแล้ว")
+        REQUESTS.inc(endpoint='save_attendance', outcome='busy')
+        return busy_response(WRITE_BUSY_MESSAGE, app.config['WRITE_RETRY_AFTER'])
+    if not created:
+        REQUESTS.inc(endpoint='save_attendance', outcome='duplicate')
         return jsonify({'status': 'warning', 'message': f'เช็กชื่อวิชา {subject} ไปแล้ว!'})
-
-    # 1. ดึงค่าเวลาผ่อนผัน (เช่น 15 นาที)
-    setting = SystemSetting.query.first()
-    grace_mins = setting.late_grace_mins if setting else 15
-    
-    # 2. คำนวณเวลาเส้นตาย (เวลาเริ่มคาบ + เวลาผ่อนผัน)
-    start_hour, start_min = map(int, start_time_str.split(':'))
-    class_start_time = now.replace(hour=start_hour, minute=start_min, second=0, microsecond=0)
-    late_limit_time = class_start_time + timedelta(minutes=grace_mins)
     
-    # 3. ตัดสินว่าสายหรือไม่ (ถ้าเวลาปัจจุบัน เลยเวลาเส้นตายไปแล้ว = สาย)
-    status = 'Late' if now > late_limit_time else 'Present'
+    REQUESTS.inc(endpoint='save_attendance', outcome=status.lower())
+    return jsonify({'status': 'success', 'message': f'บันทึกสำเร็จ (สถานะ: {"มาสาย" if status == "Late" else "มาเรียนตรงเวลา"})'})
 
-    new_record = Attendance(student_id=student_id, date=now.date(), time=now.time(), status=status, subject=subject)
-    db.session.add(new_record)
+# --- BATCH INGEST (Kiosk ที่ WiFi ไม่เสถียรเก็บรายการไว้ในเครื่องแล้วส่งเป็นก้อน) ---
+INGEST_MAX_RECORDS = 500
+INGEST_KEY_MAX_LENGTH = 64
+INGEST_KEY_RETENTION_DAYS = 14  # ส่งซ้ำหลังจากนี้จะไม่ถูกจับว่าซ้ำด้วย key (unique index ยังกันการเช็กชื่อซ้ำอยู่)
+INGEST_MAX_CLOCK_SKEW = timedelta(minutes=5)  # เวลาถ่ายภาพล้ำเวลาเซิร์ฟเวอร์ได้ไม่เกินนี้
+MANUAL_STATUSES = ('Absent', 'Sick Leave', 'Personal Leave')
+DAILY_SUBJECT = "รายวัน/ไม่ระบุ"
+_ingest_pruned_on = None
+
+def parse_capture_time(value):
+    """เวลาถ่ายภาพจาก Kiosk (ISO 8601) เป็นเวลาท้องถิ่นของเซิร์ฟเวอร์แบบไม่มี timezone เหมือนคอลัมน์ date/time"""
+    captured = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if captured.tzinfo is not None:
+        captured = captured.astimezone().replace(tzinfo=None)
+    return captured
+
+def normalize_ingest_record(item, grace_mins, now):
+    """ตรวจรายการเดียวจาก Kiosk คืน (แถว Attendance, None) หรือ (None, ข้อความ error)
+
+    รายการสแกนหน้าส่ง start_time (เวลาเริ่มคาบ) มา สถานะ Present/Late คิดจาก captured_at ไม่ใช่เวลาที่มาถึงเซิร์ฟเวอร์
+    รายการขาด/ลาส่ง status มาแทน (บันทึกเป็นวิชา "รายวัน/ไม่ระบุ" เหมือน /add_missing_status)
+    """
+    student_id = str(item.get('student_id') or '').strip()
+    if not student_id or get_student_profile(student_id) is None:
+        return None, 'ไม่พบรหัสนักเรียน'
+    try:
+        captured = parse_capture_time(item['captured_at'])
+    except (KeyError, TypeError, ValueError):
+        return None, 'captured_at ต้องเป็นเวลาแบบ ISO 8601'
+    if captured > now + INGEST_MAX_CLOCK_SKEW:
+        return None, 'captured_at อยู่ในอนาคต (นาฬิกาของเครื่อง Kiosk ไม่ตรง)'
+
+    status = item.get('status')
+    if status:
+        if status not in MANUAL_STATUSES:
+            return None, f'status ต้องเป็น {", ".join(MANUAL_STATUSES)}'
+        subject = item.get('subject') or DAILY_SUBJECT
+    else:
+        subject = item.get('subject')
+        if not subject:
+            return None, 'ไม่ระบุวิชา'
+        try:
+            status = compute_attendance_status(captured, item['start_time'], grace_mins)
+        except (KeyError, AttributeError, ValueError):
+            return None, 'start_time ต้องเป็นเวลาแบบ HH:MM'
+    return {'student_id': student_id, 'date': captured.date(), 'time': captured.time(),
+            'status': status, 'subject': str(subject)[:100]}, None
+
+def ingest_attendance(rows_by_key, now):
+    """บันทึกรายการที่ผ่านการตรวจแล้วใน Transaction เดียว คืน {key: (ผลลัพธ์, เป็นการส่งซ้ำหรือไม่)}
+
+    key ที่เคยได้รับแล้วตอบผลเดิม (ค้นด้วย primary key ทีละก้อน) ส่วน key ใหม่ถูกบันทึกพร้อมแถว Attendance
+    ถ้ามีอะไรล้มเหลว ทั้งก้อนถูกยกเลิก Kiosk จึงส่งก้อนเดิมซ้ำได้อย่างปลอดภัย
+    """
+    global _ingest_pruned_on
+    keys = list(rows_by_key)
+    prune = _ingest_pruned_on != now.date()
+
+    def write(conn):
+        if prune:
+            conn.execute(IngestKey.__table__.delete().where(
+                IngestKey.received_at < now - timedelta(days=INGEST_KEY_RETENTION_DAYS)))
+
+        outcomes = {key: (result, True) for key, result in conn.execute(
+            select(IngestKey.key, IngestKey.result).where(IngestKey.key.in_(keys)))}
+        fresh = [key for key in keys if key not in outcomes]
+        if not fresh:
+            return outcomes
+
+        inserted = conn.execute(sqlite_insert(Attendance).values([rows_by_key[key] for key in fresh])
+                                .on_conflict_do_nothing(index_elements=ATTENDANCE_UNIQUE_COLUMNS)
+                                .returning(Attendance.student_id, Attendance.date, Attendance.subject))
+        created = {tuple(r) for r in inserted}
+        for key in fresh:
+            row = rows_by_key[key]
+            identity = (row['student_id'], row['date'], row['subject'])
+            # 2 key ที่เป็นการเช็กชื่อเดียวกันในก้อนเดียว: key แรกได้สถานะ ที่เหลือเป็น duplicate
+            if identity in created:
+                created.discard(identity)
+                outcomes[key] = (row['status'], False)
+            else:
+                outcomes[key] = ('duplicate', False)
+
+        conn.execute(sqlite_insert(IngestKey).on_conflict_do_nothing(), [
+            {'key': key, 'student_id': rows_by_key[key]['student_id'], 'result': outcomes[key][0], 'received_at': now}
+            for key in fresh])
+        return outcomes
+
+    # ปิด Transaction การอ่านของ session ก่อน แล้วส่งทั้งก้อนเป็นงานเดียวใน Group Commit (SAVEPOINT เดียว)
     db.session.commit()
-    
-    return jsonify({'status': 'success', 'message': f'บันทึกสำเร็จ (สถานะ: {"มาสาย" if status == "Late" else "มาเรียนตรงเวลา"})'})
+    with timed(STAGE_SECONDS, endpoint='attendance_batch', stage='db_write'):
+        outcomes = group_commit.run(db.engine, write)
+    # จำว่าลบ key เก่าแล้วหลัง commit สำเร็จเท่านั้น ถ้าก้อนถูกยกเลิก ก้อนถัดไปจะลบใหม่
+    if prune:
+        _ingest_pruned_on = now.date()
+    return outcomes
+
+@app.route('/api/attendance/batch', methods=['POST'])
+@observe_request('attendance_batch')
+def attendance_batch():
+    """รับรายการเช็กชื่อหลายรายการพร้อมกัน {records: [{key, student_id, subject, start_time, captured_at}, ...]}
+
+    แต่ละรายการต้องมี key ที่ Kiosk สร้างเอง (เช่น UUID) ส่งซ้ำกี่ครั้งก็บันทึกครั้งเดียวและได้ผลเดิม
+    ตอบกลับผลรายการต่อรายการตามลำดับเดิม: {key, status: success, result, replayed} หรือ {key, status: error, message}
+    """
+    data = request.get_json(silent=True) or {}
+    records = data.get('records')
+    if not isinstance(records, list) or not records:
+        return jsonify({"status": "error", "message": "ต้องส่ง records เป็นรายการ"}), 400
+    if len(records) > INGEST_MAX_RECORDS:
+        return jsonify({"status": "error", "message": f"ส่งได้ไม่เกิน {INGEST_MAX_RECORDS} รายการต่อครั้ง"}), 413
+
+    grace_mins = get_settings()['late_grace_mins']
+    now = datetime.now()
+    rows_by_key, errors, keys = {}, {}, []
+    for item in records:
+        key = str(item.get('key') or '') if isinstance(item, dict) else ''
+        keys.append(key)
+        if not key or len(key) > INGEST_KEY_MAX_LENGTH:
+            errors[key] = f'key ต้องมี 1-{INGEST_KEY_MAX_LENGTH} ตัวอักษร'
+            continue
+        if key in rows_by_key or key in errors:
+            continue  # key ซ้ำในก้อนเดียวกัน ใช้รายการแรก
+        row, error = normalize_ingest_record(item, grace_mins, now)
+        if error:
+            errors[key] = error
+        else:
+            rows_by_key[key] = row
+
+    try:
+        outcomes = ingest_attendance(rows_by_key, now) if rows_by_key else {}
+    except GroupCommitTimeout:
+        # ส่งทั้งก้อนซ้ำได้: รายการที่ commit ไปแล้วจะได้ผลเดิมกลับมาตาม key
+        return busy_response(WRITE_BUSY_MESSAGE, app.config['WRITE_RETRY_AFTER'])
+
+    results, created = [], 0
+    for key in keys:
+        if key in outcomes:
+            result, replayed = outcomes[key]
+            results.append({"key": key, "status": "success", "result": result, "replayed": replayed})
+        else:
+            results.append({"key": key, "status": "error", "message": errors.get(key, 'ข้อมูลไม่ถูกต้อง')})
+    for result, replayed in outcomes.values():
+        label = 'replayed' if replayed else ('duplicate' if result == 'duplicate' else 'created')
+        created += label == 'created'
+        INGEST_RECORDS.inc(result=label)
+    invalid = sum(1 for r in results if r['status'] == 'error')
+    if invalid:
+        INGEST_RECORDS.inc(invalid, result='invalid')
+    return jsonify({"status": "success", "created": created, "results": results})
+
+def _scan_stream(ws):
+    """โหมดสแกนต่อเนื่อง: Kiosk ส่งเฟรม JPEG (ข้อความไบนารี) มาเรื่อยๆ ทาง WebSocket
+
+    ข้อความแรกเป็น JSON ตั้งค่า {subject, start_time, classroom, profile, auto_save}
+    เซิร์ฟเวอร์ติดตามใบหน้าข้ามเฟรม encode เฉพาะใบหน้าใหม่ แล้วส่งผลกลับเป็น JSON:
+    faces (กรอบใบหน้าในเฟรม), recognized (จำหน้าได้), attendance (บันทึกการเข้าเรียนแล้ว)
+    """
+    if not session.get('logged_in'):
+        ws.send(json.dumps({"type": "error", "message": "กรุณาเข้าสู่ระบบก่อน"}))
+        return
+
+    config = {}
+    frames = LatestFrame()
+
+    def reader():
+        # อ่านข้อความตลอดเวลาใน thread แยก เฟรมที่ประมวลผลไม่ทันจะถูกทับด้วยเฟรมล่าสุด
+        try:
+            while True:
+                message = ws.receive()
+                if message is None:
+                    break
+                if isinstance(message, str):
+                    config.update(json.loads(message))
+                else:
+                    frames.put(message)
+        except Exception:
+            pass
+        finally:
+            frames.close()
+
+    threading.Thread(target=reader, daemon=True).start()
+
+    tolerance = get_settings()['ai_tolerance']
+    tracker = FaceTracker()
+    saved = set()
+
+    try:
+        while True:
+            buf = frames.take()
+            if buf is None:
+                break
+            now = time.monotonic()
+            profile = resolve_profile(config.get('profile'), default='fast')
+
+            # ตรวจหากรอบใบหน้าทุกเฟรม แต่ encode เฉพาะ track ใหม่ (หรือ track ที่ยังจำไม่ได้เมื่อถึงรอบลองใหม่)
+            # ทั้งสองขั้นตอนรันใน inference pool: ถ้าคิวเต็มหรือช้าเกินไปข้ามเฟรมนี้ เฟรมล่าสุดจะมาแทน
+            try:
+                detected = detect_image(buf, profile)
+            except (InferenceBusy, InferenceTimeout):
+                continue
+            if not detected['decoded']:
+                continue
+            tracks = tracker.update(detected['boxes'], now)
+            pending = tracker.pending(tracks, now)
+            try:
+                encodings = encode_image(buf, profile, [t.box for t in pending])['encodings'] if pending else []
+            except (InferenceBusy, InferenceTimeout):
+                # ยังไม่ตั้ง last_encoded: track เหล่านี้จะถูกส่ง encode อีกครั้งในเฟรมถัดไป
+                pending = []
+            if pending:
+                refresh_encodings_if_changed()
+                matches, scopes = face_index.search_partitioned(
+                    encodings, get_classroom_ids(config.get('classroom')), tolerance)
+                for scope in scopes:
+                    SEARCH_SCOPE.inc(endpoint='scan_stream', scope=scope)
+                for track, match in zip(pending, matches):
+                    track.last_encoded = now
+                    if match is not None and match.distance <= tolerance:
+                        track.student_id, track.distance = match.student_id, match.distance
+
+            for track in tracks:
+                if track.student_id is None or track.announced:
+                    continue
+                track.announced = True
+                student = get_student_profile(track.student_id)
+                if student is None:
+                    continue
+                ws.send(json.dumps({
+                    "type": "recognized", "track_id": track.id, "student_id": student['id'],
+                    "name_th": student['name_th'], "classroom": student['classroom'],
+                    "roll_number": student['roll_number'], "distance": round(track.distance, 4),
+                }))
+                # บันทึกอัตโนมัติเฉพาะนักเรียนในห้องที่เลือก (เหมือนการตรวจในหน้า Kiosk)
+                if (config.get('auto_save') and student['id'] not in saved
+                        and student['classroom'] == config.get('classroom')
+                        and config.get('subject') and config.get('start_time')):
+                    try:
+                        parse_start_time(config['start_time'])
+                    except ValueError:
+                        # ปิดบันทึกอัตโนมัติจนกว่า Kiosk จะส่งค่าตั้งใหม่ ไม่ให้ส่งข้อความผิดพลาดซ้ำทุกใบหน้า
+                        config['auto_save'] = False
+                        ws.send(json.dumps({"type": "error", "message": START_TIME_FORMAT_ERROR}))
+                        continue
+                    try:
+                        status, created = record_attendance(student['id'], config['subject'], config['start_time'])
+                    except GroupCommitTimeout:
+                        # ไม่ใส่ใน saved และประกาศ track นี้ใหม่ในเฟรมถัดไป เพื่อลองบันทึกอีกครั้งถ้ายังอยู่หน้ากล้อง
+                        track.announced = False
+                        ws.send(json.dumps({"type": "error", "message": WRITE_BUSY_MESSAGE}))
+                        continue
+                    saved.add(student['id'])
+                    ws.send(json.dumps({"type": "attendance", "student_id": student['id'],
+                                        "name_th": student['name_th'], "attendance": status, "created": created}))
+
+            ws.send(json.dumps({
+                "type": "faces",
+                "tracks": [{"track_id": t.id, "box": t.box, "student_id": t.student_id} for t in tracks],
+                "dropped": frames.dropped,
+            }))
+    except Exception as e:
+        # การเชื่อมต่อถูกปิดระหว่างส่งข้อมูล
+        print(f"Scan stream closed: {e}")
+    finally:
+        frames.close()
+
+if sock is not None:
+    sock.route('/ws/scan')(_scan_stream)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """สถิติการทำงานรูปแบบ Prometheus (ใช้กับ Prometheus/Grafana หรือเปิดดูตรงๆ ก็ได้)"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/api/subjects')
 def get_subjects():
@@ -547,7 +1652,7 @@ def manage_subjects():
 @app.route('/delete_subject/<subject_id>')
 def delete_subject(subject_id):
     """ฟังก์ชันลบรายวิชา"""
-    sub = Subject.query.get(subject_id)
+    sub = db.session.get(Subject, subject_id)
     if sub:
         db.session.delete(sub)
         db.session.commit()
@@ -558,17 +1663,20 @@ def settings():
     """หน้าตั้งค่าระบบ"""
     setting = SystemSetting.query.first()
     if not setting:
-        setting = SystemSetting(late_grace_mins=15, ai_tolerance=0.45)
+        setting = SystemSetting(late_grace_mins=15, ai_tolerance=0.45, recognition_profile=DEFAULT_PROFILE)
         db.session.add(setting)
         db.session.commit()
 
     if request.method == 'POST':
         setting.late_grace_mins = int(request.form.get('late_grace_mins'))
         setting.ai_tolerance = float(request.form.get('ai_tolerance'))
+        setting.recognition_profile = resolve_profile(request.form.get('recognition_profile'))
         db.session.commit()
+        settings_cache.invalidate()
         return redirect(url_for('settings'))
 
-    return render_template('settings.html', setting=setting)
+    return render_template('settings.html', setting=setting, profiles=PROFILE_LABELS,
+                           current_profile=resolve_profile(setting.recognition_profile))
 
 @app.route('/attendance_management', methods=['GET', 'POST'])
 def attendance_management():
@@ -606,23 +1714,24 @@ def add_missing_status():
     """บันทึกสถานะ ขาด/ลา สำหรับคนที่ไม่ได้สแกนหน้า"""
     data = request.json
     now = datetime.now()
-    # สร้าง Record ใหม่สำหรับสถานะ ขาด หรือ ลา
-    new_record = Attendance(
-        student_id=data['student_id'],
-        date=now.date(),
-        time=now.time(),
-        status=data['status'], # Sick Leave, Personal Leave, Absent
-        subject="รายวัน/ไม่ระบุ"
-    )
-    db.session.add(new_record)
+    # สร้าง Record ใหม่สำหรับสถานะ ขาด หรือ ลา (ถ้าบันทึกของวันนี้มีอยู่แล้วจะไม่เพิ่มซ้ำ)
+    inserted = insert_attendance([{
+        'student_id': data['student_id'],
+        'date': now.date(),
+        'time': now.time(),
+        'status': data['status'], # Sick Leave, Personal Leave, Absent
+        'subject': DAILY_SUBJECT
+    }])
     db.session.commit()
+    if not inserted:
+        return jsonify({"status": "warning", "message": "บันทึกสถานะของนักเรียนคนนี้สำหรับวันนี้ไปแล้ว"})
     return jsonify({"status": "success"})
 
 @app.route('/update_status/<int:record_id>', methods=['POST'])
 def update_status(record_id):
     """API สำหรับเปลี่ยนสถานะเป็น ลาป่วย/ลากิจ/ขาดเรียน"""
     new_status = request.json.get('status')
-    record = Attendance.query.get(record_id)
+    record = db.session.get(Attendance, record_id)
     if record:
         record.status = new_status
         db.session.commit()
@@ -631,5 +1740,8 @@ def update_status(record_id):
 
 # --- MAIN ---
 if __name__ == "__main__":
+    # โหมด debug มี process แม่ไว้เฝ้าไฟล์ (reloader) เตรียมระบบเฉพาะใน process ที่รับ request จริง
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        startup()
     # host='0.0.0.0' คือคำสั่งเปิดให้มือถือเครื่องอื่นใน WiFi เดียวกันเข้าได้
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
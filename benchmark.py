@@ -0,0 +1,514 @@
+"""วัดความเร็วของขั้นตอนสำคัญด้วยข้อมูลสังเคราะห์ (ไม่ต้องใช้รูปหรือฐานข้อมูลจริง)
+
+ส่วนที่วัด:
+    matching       ค้นหาใบหน้าใน FaceIndex ด้วย Encodings สุ่มของนักเรียน N คน
+    ann            ค้นในห้องเรียน (partition) และค้นแบบประมาณ (IVFIndex) เทียบกับค้นทุกแถว พร้อม recall
+    compaction     ความแม่นยำ/ขนาดไฟล์/RSS ตอนค้น/ความเร็ว เมื่อย่อ Encodings ต่อคนและเก็บเป็น float16/int8
+                   (ใช้ Encodings จริงจาก --manifest encodings_manifest.pickle ได้ โดยกันรูปสุดท้ายของแต่ละคนไว้ทดสอบ)
+    recognize_face แยกทีละขั้น: Base64 decode, cv2.imdecode, ตรวจหาใบหน้า, encode, ค้นหา
+    encoding       ความเร็ว create_encodings ต่อรูปบน images_db สังเคราะห์
+    database       ค้นข้อมูลนักเรียน, หน้า dashboard / reports และ export_csv ที่ 10k/100k/1M แถว
+
+ตัวอย่าง:
+    python benchmark.py --output bench_before.json
+    python benchmark.py --output bench_after.json --baseline bench_before.json
+
+ผลลัพธ์เป็น JSON (เวลาหน่วย ms) ใช้ --baseline เทียบกับผลครั้งก่อน ถ้าช้าลงเกิน --threshold จะจบด้วย exit code 1
+ส่วนที่ต้องใช้ face_recognition/dlib จะถูกข้ามพร้อมบอกเหตุผล ถ้าเครื่องไม่มีไลบรารีนั้น
+"""
+import argparse
+import base64
+import json
+import os
+import pickle
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from face_index import FaceIndex, IVFIndex, ENCODING_DIM
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def summarize(samples):
+    """สรุปเวลาเป็น ms"""
+    ms = np.asarray(samples, dtype=np.float64) * 1000.0
+    return {
+        'n': int(len(ms)),
+        'mean_ms': round(float(ms.mean()), 4),
+        'p50_ms': round(float(np.percentile(ms, 50)), 4),
+        'p95_ms': round(float(np.percentile(ms, 95)), 4),
+        'min_ms': round(float(ms.min()), 4),
+    }
+
+
+def measure(fn, repeat, warmup=1):
+    """เรียก fn ซ้ำ repeat ครั้ง (หลังอุ่นเครื่อง warmup ครั้ง) คืนสรุปเวลา"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def synthetic_embeddings(rng, students, per_student):
+    """Encodings สุ่มแบบ 'หนึ่งคนหลายรูป': จุดศูนย์กลางต่อคน + สัญญาณรบกวนเล็กน้อยต่อรูป"""
+    centers = rng.normal(0, 0.1, size=(students, ENCODING_DIM)).astype(np.float32)
+    noise = rng.normal(0, 0.02, size=(students, per_student, ENCODING_DIM)).astype(np.float32)
+    matrix = (centers[:, None, :] + noise).reshape(-1, ENCODING_DIM)
+    ids = [f"{60000 + i}" for i in range(students) for _ in range(per_student)]
+    return centers, matrix, ids
+
+
+def synthetic_jpeg(rng, width, height, quality=90):
+    """ภาพ JPEG สังเคราะห์ (พื้นหลังเบลอ + วงรีคล้ายใบหน้า) ขนาดไฟล์ใกล้เคียงภาพจากกล้องจริง"""
+    import cv2
+
+    small = rng.integers(0, 256, size=(height // 16 + 1, width // 16 + 1, 3), dtype=np.uint8)
+    img = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    img = cv2.add(img, rng.integers(0, 24, size=img.shape, dtype=np.uint8))
+    cv2.ellipse(img, (width // 2, height // 2), (width // 8, height // 5), 0, 0, 360, (150, 180, 220), -1)
+    ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError("cv2.imencode failed")
+    return buf.tobytes()
+
+
+def bench_matching(args, rng, results):
+    centers, matrix, ids = synthetic_embeddings(rng, args.students, args.images_per_student)
+    start = time.perf_counter()
+    index = FaceIndex(matrix, ids)
+    results['matching.build_index'] = summarize([time.perf_counter() - start])
+
+    picks = rng.integers(0, args.students, size=64)
+    queries = centers[picks] + rng.normal(0, 0.02, size=(64, ENCODING_DIM)).astype(np.float32)
+    results['matching.search_1'] = measure(lambda: index.search(queries[0]), args.repeat)
+    results['matching.search_batch_64'] = measure(lambda: index.search_many(queries), args.repeat)
+    hits = sum(m.student_id == ids[p * args.images_per_student] for m, p in zip(index.search_many(queries), picks))
+    results['matching.sanity_top1'] = {'correct': int(hits), 'total': 64}
+
+
+def bench_ann(args, rng, results):
+    centers, matrix, ids = synthetic_embeddings(rng, args.ann_students, args.images_per_student)
+    index = FaceIndex(matrix, ids)
+    picks = rng.integers(0, args.ann_students, size=args.ann_queries)
+    queries = centers[picks] + rng.normal(0, 0.02, size=(len(picks), ENCODING_DIM)).astype(np.float32)
+    exact = index.search_many(queries)
+    results['ann.search_1.exact'] = measure(lambda: index.search(queries[0]), args.repeat)
+
+    # ห้องเรียน ~40 คน: ค้นเฉพาะห้อง (กรณี Kiosk สแกนนักเรียนในห้องตัวเอง)
+    classroom = [ids[p * args.images_per_student] for p in range(40)]
+    class_query = centers[:1] + rng.normal(0, 0.02, size=(1, ENCODING_DIM)).astype(np.float32)
+    index.subset(classroom)
+    results['ann.search_1.classroom_40'] = measure(
+        lambda: index.search_partitioned(class_query, classroom, 0.45), args.repeat)
+
+    for nprobe in args.ann_nprobe:
+        start = time.perf_counter()
+        ann = IVFIndex(index, nprobe=nprobe)
+        results[f'ann.build.nprobe_{nprobe}'] = summarize([time.perf_counter() - start])
+        results[f'ann.search_1.nprobe_{nprobe}'] = measure(lambda: ann.search_many(queries[:1]), args.repeat)
+        approx = ann.search_many(queries)
+        # recall@1: ค้นแบบประมาณได้คนเดียวกับค้นทุกแถว / decision: ผลผ่าน-ไม่ผ่านเกณฑ์ 0.45 ตรงกัน
+        same = sum(a.student_id == e.student_id for a, e in zip(approx, exact))
+        decision = sum((a.distance <= 0.45) == (e.distance <= 0.45) for a, e in zip(approx, exact))
+        results[f'ann.recall.nprobe_{nprobe}'] = {
+            'nlist': ann.nlist, 'nprobe': ann.nprobe, 'queries': len(queries),
+            'recall_at_1': round(same / len(queries), 4), 'decision_agreement': round(decision / len(queries), 4),
+        }
+        print(f"nprobe={ann.nprobe:3d} nlist={ann.nlist}: recall@1 {same / len(queries):.4f}")
+
+
+def _accuracy_dataset(args, rng):
+    """(enroll_ids, enroll_matrix, genuine_queries, genuine_ids, impostor_queries)
+
+    --manifest: แต่ละคนที่มีตั้งแต่ 2 รูป กันรูปสุดท้ายไว้เป็น query ส่วน 10% ของนักเรียนไม่ลงทะเบียนเลย (ผู้แอบอ้าง)
+    ไม่ระบุ: คนสังเคราะห์ที่มีรูปหลายแบบ (บางรูปต่างจากปกติมาก เช่น มุมหน้า/แว่นตา)
+    """
+    if args.manifest:
+        with open(args.manifest, 'rb') as f:
+            images = pickle.load(f)['images']
+        by_student = {}
+        for path in sorted(images):
+            if images[path]['encodings']:
+                by_student.setdefault(images[path]['student_id'], []).append(images[path]['encodings'][0])
+        students = sorted(by_student)
+        impostors = set(students[::10])
+        enroll, genuine, genuine_ids, impostor = [], [], [], []
+        for student_id in students:
+            photos = by_student[student_id]
+            if student_id in impostors:
+                impostor.extend(photos)
+            elif len(photos) >= 2:
+                enroll.extend((student_id, e) for e in photos[:-1])
+                genuine.append(photos[-1])
+                genuine_ids.append(student_id)
+            else:
+                enroll.append((student_id, photos[0]))
+        ids = [i for i, _ in enroll]
+        return (ids, np.asarray([e for _, e in enroll], np.float32), np.asarray(genuine, np.float32), genuine_ids,
+                np.asarray(impostor, np.float32).reshape(-1, ENCODING_DIM))
+
+    students, photos = args.students, args.accuracy_photos
+    centers = rng.normal(0, 0.1, size=(students + students // 10, ENCODING_DIM)).astype(np.float32)
+
+    def shots(center_rows, count):
+        noise = rng.normal(0, 0.02, size=(len(center_rows), count, ENCODING_DIM))
+        # ราว 1 ใน 5 รูปต่างจากปกติ (มุมหน้า/แว่นตา) ให้การย่อข้อมูลต้องเก็บ outlier ไว้ด้วย
+        pose = rng.normal(0, 0.02, size=(len(center_rows), 1, ENCODING_DIM))
+        noise += pose * (rng.random((len(center_rows), count, 1)) < 0.2)
+        return (centers[center_rows, None, :] + noise).astype(np.float32)
+
+    enrolled = shots(np.arange(students), photos + 1)
+    ids = [f"{60000 + i}" for i in range(students) for _ in range(photos)]
+    impostor = shots(np.arange(students, len(centers)), 1)[:, 0]
+    return (ids, enrolled[:, :photos].reshape(-1, ENCODING_DIM), enrolled[:, photos],
+            [f"{60000 + i}" for i in range(students)], impostor)
+
+
+def _resident_bytes():
+    """RSS ปัจจุบันของ process (รวมหน้าของไฟล์ memmap ที่ถูกอ่านแล้ว) None ถ้าไม่มี /proc (เช่น macOS, Windows)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _search_rss(path, queries):
+    """RSS ที่เพิ่มขึ้น (ไบต์) หลังเปิดไฟล์ด้วย memmap สร้าง FaceIndex แล้วค้น (รันใน process ใหม่ผ่าน _measure_rss)
+
+    นับหน้าของไฟล์ที่ถูกอ่านจริง: float32 อ่านทั้งเมทริกซ์ ส่วน float16/int8 อ่านเมทริกซ์ที่ย่อแล้ว
+    และ float32 เฉพาะแถวที่ถูกตรวจซ้ำ
+    """
+    from face_store import load_store
+
+    before = _resident_bytes()
+    index = FaceIndex.from_store(load_store(path))
+    index.search_many(queries)
+    after = _resident_bytes()
+    return None if before is None or after is None else after - before
+
+
+def _measure_rss(path, queries):
+    # process ใหม่ (spawn) ทุกครั้ง ค่าจึงไม่ปนกับข้อมูลที่ benchmark สร้างไว้ใน process นี้
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(_search_rss, path, queries).result()
+
+
+def bench_compaction(args, rng, results, workdir):
+    from encode_faces import compact_encodings
+    from face_store import load_store, write_store
+
+    ids, matrix, genuine, genuine_ids, impostor = _accuracy_dataset(args, rng)
+    by_student = {}
+    for student_id, row in zip(ids, matrix):
+        by_student.setdefault(student_id, []).append(row)
+    compact_ids, compact_rows = [], []
+    for student_id, rows in by_student.items():
+        compact = compact_encodings(rows, args.max_per_student)
+        compact_ids.extend([student_id] * len(compact))
+        compact_rows.append(compact)
+    compact_matrix = np.concatenate(compact_rows)
+
+    variants = [('all_photos.float32', ids, matrix, 'float32')] + [
+        (f'compact.{precision}', compact_ids, compact_matrix, precision) for precision in ('float32', 'float16', 'int8')]
+    tolerance = args.tolerance
+    for name, variant_ids, variant_matrix, precision in variants:
+        path = os.path.join(workdir, f'{name}.bin')
+        write_store(path, variant_matrix, variant_ids, precision=precision)
+        index = FaceIndex.from_store(load_store(path))
+        matches = index.search_many(genuine)
+        accepted = [m is not None and m.distance <= tolerance for m in matches]
+        correct = sum(a and m.student_id == s for a, m, s in zip(accepted, matches, genuine_ids))
+        wrong = sum(a and m.student_id != s for a, m, s in zip(accepted, matches, genuine_ids))
+        false_accepts = sum(m is not None and m.distance <= tolerance for m in index.search_many(impostor)) \
+            if len(impostor) else 0
+        # แบบย่อขนาดเก็บ float32 ไว้ในไฟล์ด้วย ไฟล์จึงใหญ่กว่า float32 ที่ประหยัดได้คือ RSS ตอนค้น
+        rss = _measure_rss(path, genuine[:8])
+        results[f'compaction.accuracy.{name}'] = {
+            'rows': len(index), 'matrix_bytes': int(index.nbytes), 'file_bytes': os.path.getsize(path),
+            'search_rss_bytes': rss,
+            'genuine': len(genuine), 'correct': int(correct), 'wrong_student': int(wrong),
+            'rejected': int(len(genuine) - correct - wrong),
+            'impostors': len(impostor), 'false_accepts': int(false_accepts), 'tolerance': tolerance,
+        }
+        results[f'compaction.search_1.{name}'] = measure(lambda: index.search_many(genuine[:1]), args.repeat)
+        print(f"{name:20s} rows {len(index):7d}  correct {correct}/{len(genuine)}  wrong {wrong}"
+              f"  false accepts {false_accepts}/{len(impostor)}"
+              f"  file {os.path.getsize(path) / 2**20:.1f} MB"
+              f"  search RSS {'n/a' if rss is None else f'{rss / 2**20:.1f} MB'}")
+
+
+def bench_recognize_stages(args, rng, results, skipped):
+    try:
+        import cv2
+    except ImportError as e:
+        skipped['recognize_face'] = f"cv2 not available ({e})"
+        return
+
+    width, height = args.frame_size
+    jpeg = synthetic_jpeg(rng, width, height)
+    payload = "data:image/jpeg;base64," + base64.b64encode(jpeg).decode('ascii')
+    results['recognize_face.frame_bytes'] = {'jpeg': len(jpeg), 'base64': len(payload)}
+
+    results['recognize_face.base64_decode'] = measure(
+        lambda: base64.b64decode(payload.split(',')[1]), args.repeat)
+    results['recognize_face.imdecode'] = measure(
+        lambda: cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR), args.repeat)
+    img = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+    results['recognize_face.bgr_to_rgb'] = measure(lambda: cv2.cvtColor(img, cv2.COLOR_BGR2RGB), args.repeat)
+    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    try:
+        import face_recognition  # noqa: F401  (recognition.py import ตอนเรียกใช้ จึงต้องตรวจเองก่อน)
+        from recognition import PROFILES, detect_faces, encode_boxes
+    except ImportError as e:
+        skipped['recognize_face.detect_encode'] = f"face_recognition not available ({e})"
+    else:
+        for profile in PROFILES:
+            results[f'recognize_face.detect.{profile}'] = measure(
+                lambda: detect_faces(rgb, profile), args.detect_repeat)
+            # ภาพสังเคราะห์ไม่มีใบหน้าจริง จึง encode กรอบกลางภาพแทน (เวลาไม่ขึ้นกับเนื้อภาพ)
+            box = (height // 2 - height // 5, width // 2 + width // 8,
+                   height // 2 + height // 5, width // 2 - width // 8)
+            results[f'recognize_face.encode.{profile}'] = measure(
+                lambda: encode_boxes(rgb, [box], profile), args.detect_repeat)
+
+    centers, matrix, ids = synthetic_embeddings(rng, args.students, args.images_per_student)
+    index = FaceIndex(matrix, ids)
+    query = centers[0] + rng.normal(0, 0.02, size=ENCODING_DIM).astype(np.float32)
+    results['recognize_face.match'] = measure(lambda: index.search_many([query]), args.repeat)
+
+
+def bench_encoding(args, rng, workdir, results, skipped):
+    try:
+        import face_recognition  # noqa: F401
+        import encode_faces
+    except ImportError as e:
+        skipped['encoding'] = f"face_recognition not available ({e})"
+        return
+
+    images_db = os.path.join(workdir, 'images_db')
+    if args.images_db:
+        shutil.copytree(args.images_db, images_db)
+    else:
+        for s in range(args.encode_students):
+            folder = os.path.join(images_db, f"{60000 + s}")
+            os.makedirs(folder)
+            for i in range(args.encode_images_per_student):
+                with open(os.path.join(folder, f"{60000 + s}_{i + 1}.jpg"), 'wb') as f:
+                    f.write(synthetic_jpeg(rng, 640, 480))
+    total = sum(len(files) for _, _, files in os.walk(images_db))
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        for label, full in (('full', True), ('incremental_unchanged', False)):
+            start = time.perf_counter()
+            encode_faces.create_encodings(full=full, workers=args.workers)
+            elapsed = time.perf_counter() - start
+            results[f'encoding.create_encodings.{label}'] = {
+                'images': total, 'workers': args.workers, 'total_ms': round(elapsed * 1000, 2),
+                'per_image_ms': round(elapsed * 1000 / max(total, 1), 3),
+                'images_per_sec': round(total / elapsed, 2) if elapsed else None,
+            }
+    finally:
+        os.chdir(cwd)
+
+
+def _attendance_rows(start, stop, students, subjects, today):
+    """แถว Attendance สังเคราะห์ที่ไม่ชน unique index (student_id, date, subject)"""
+    per_day = students * subjects
+    for i in range(start, stop):
+        day = today - timedelta(days=i // per_day)
+        yield (f"{60000 + i % students}", day.isoformat(), f"{7 + (i % 9):02d}:{i % 60:02d}:00.000000",
+               'Late' if i % 7 == 0 else 'Present', f"SUB{(i // students) % subjects:02d}")
+
+
+def bench_database(args, workdir, results, skipped):
+    # ตั้งค่าก่อน import app: ใช้ฐานข้อมูลชั่วคราว และทำงานในโฟลเดอร์ชั่วคราว (ไม่แตะไฟล์จริงของระบบ)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    # ส่วนนี้วัดเฉพาะฐานข้อมูล ไม่ต้องเปิด inference worker (startup จะ spawn process และโหลดดัชนีใบหน้า)
+    os.environ['INFERENCE_WORKERS'] = '0'
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        try:
+            import app as attendance_app
+        except ImportError as e:
+            skipped['database'] = f"app dependencies not available ({e})"
+            return
+        attendance_app.startup()
+        flask_app, db = attendance_app.app, attendance_app.db
+
+        with flask_app.app_context():
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(
+                    "INSERT INTO student (id, roll_number, name_th, name_en, classroom) VALUES (?, ?, ?, ?, ?)",
+                    [(f"{60000 + s}", s % 40 + 1, f"นักเรียน {s}", f"Student {s}", f"ม.{s % 6 + 1}/{s % 10 + 1}")
+                     for s in range(args.db_students)])
+
+            sid = f"{60000 + args.db_students // 2}"
+            results['recognize_face.db_lookup.session_get'] = measure(
+                lambda: (db.session.get(attendance_app.Student, sid), db.session.expunge_all()), args.repeat)
+            results['recognize_face.db_lookup.cached'] = measure(
+                lambda: attendance_app.get_student_profile(sid), args.repeat)
+
+        client = flask_app.test_client()
+        with client.session_transaction() as sess:
+            sess['logged_in'] = True
+
+        today = date.today()
+        inserted = 0
+        for rows in sorted(args.rows):
+            with flask_app.app_context():
+                with db.engine.begin() as conn:
+                    while inserted < rows:
+                        stop = min(rows, inserted + 50000)
+                        conn.exec_driver_sql(
+                            "INSERT INTO attendance (student_id, date, time, status, subject) VALUES (?, ?, ?, ?, ?)",
+                            list(_attendance_rows(inserted, stop, args.db_students, args.db_subjects, today)))
+                        inserted = stop
+                with db.engine.connect() as conn:
+                    conn.exec_driver_sql("ANALYZE")
+
+            week_ago = (today - timedelta(days=7)).isoformat()
+            pages = {
+                'dashboard': '/dashboard',
+                'dashboard_last_week': f'/dashboard?date_from={week_ago}',
+                'reports_first_page': '/reports',
+                'export_csv': '/export_csv',
+                'export_csv_one_class': '/export_csv?class_name=ม.1/1',
+            }
+            for name, url in pages.items():
+                def fetch():
+                    response = client.get(url)
+                    if response.status_code != 200:
+                        raise RuntimeError(f"{url} returned {response.status_code}")
+                    return response.get_data()
+                results[f'database.{rows}.{name}'] = measure(fetch, args.db_repeat, warmup=0)
+            print(f"database: {rows} rows done")
+    finally:
+        os.chdir(cwd)
+
+
+def compare(results, baseline_path, threshold):
+    """เทียบ mean_ms กับผลครั้งก่อน คืนรายการขั้นตอนที่ช้าลงเกิน threshold"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+    regressions = []
+    for name, stats in sorted(results.items()):
+        before = baseline.get(name, {}).get('mean_ms')
+        after = stats.get('mean_ms') if isinstance(stats, dict) else None
+        if before and after:
+            ratio = after / before
+            flag = ' <-- REGRESSION' if ratio > 1 + threshold else ''
+            print(f"{name:55s} {before:10.3f} -> {after:10.3f} ms  x{ratio:.2f}{flag}")
+            if flag:
+                regressions.append(name)
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark recognition, encoding and database hot paths")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON result file")
+    parser.add_argument('--baseline', help="previous result file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed slowdown vs baseline (0.2 = 20%%)")
+    parser.add_argument('--only', nargs='+', choices=['matching', 'ann', 'compaction', 'recognize', 'encoding', 'database'],
+                        help="run only these sections")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=200, help="repeats for cheap stages")
+    parser.add_argument('--detect-repeat', type=int, default=10, help="repeats for detection/encoding")
+    parser.add_argument('--students', type=int, default=3000)
+    parser.add_argument('--images-per-student', type=int, default=5)
+    parser.add_argument('--ann-students', type=int, default=20000, help="students in the district-size ANN test")
+    parser.add_argument('--ann-queries', type=int, default=1000)
+    parser.add_argument('--ann-nprobe', type=int, nargs='+', default=[4, 8, 16, 32])
+    parser.add_argument('--manifest', help="encodings_manifest.pickle with real encodings for the accuracy report")
+    parser.add_argument('--accuracy-photos', type=int, default=6, help="synthetic enrolment photos per student")
+    parser.add_argument('--max-per-student', type=int, default=4, help="compaction limit for the accuracy report")
+    parser.add_argument('--tolerance', type=float, default=0.45)
+    parser.add_argument('--frame-size', type=int, nargs=2, default=[1280, 720], metavar=('W', 'H'))
+    parser.add_argument('--images-db', help="copy this images_db instead of generating synthetic images")
+    parser.add_argument('--encode-students', type=int, default=20)
+    parser.add_argument('--encode-images-per-student', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help="attendance table sizes for the database section")
+    parser.add_argument('--db-students', type=int, default=3000)
+    parser.add_argument('--db-subjects', type=int, default=8)
+    parser.add_argument('--db-repeat', type=int, default=3)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sections = set(args.only or ['matching', 'ann', 'compaction', 'recognize', 'encoding', 'database'])
+    rng = np.random.default_rng(args.seed)
+    results, skipped = {}, {}
+    output = os.path.abspath(args.output)
+    workdir = tempfile.mkdtemp(prefix='attendance_bench_')
+    sys.path.insert(0, PROJECT_DIR)
+
+    try:
+        if 'matching' in sections:
+            print("--- Benchmark: matching ---")
+            bench_matching(args, rng, results)
+        if 'ann' in sections:
+            print("--- Benchmark: classroom partition / approximate search ---")
+            bench_ann(args, rng, results)
+        if 'compaction' in sections:
+            print("--- Benchmark: compaction / reduced precision accuracy ---")
+            bench_compaction(args, rng, results, workdir)
+        if 'recognize' in sections:
+            print("--- Benchmark: recognize_face stages ---")
+            bench_recognize_stages(args, rng, results, skipped)
+        if 'encoding' in sections:
+            print("--- Benchmark: create_encodings ---")
+            bench_encoding(args, rng, workdir, results, skipped)
+        if 'database' in sections:
+            print("--- Benchmark: database ---")
+            bench_database(args, workdir, results, skipped)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for name, reason in skipped.items():
+        print(f"Skipped {name}: {reason}")
+
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'machine': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+        },
+        'args': vars(args),
+        'results': results,
+        'skipped': skipped,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Saved results to {output}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} stage(s) slower than baseline by more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,48 @@
+"""แก้ข้อมูลเช็กชื่อซ้ำที่ทำให้อัปเกรดฐานข้อมูลไม่ได้ (สร้าง unique index นักเรียน+วันที่+วิชา ไม่ได้)
+
+ไฟล์ฐานข้อมูลจากเวอร์ชันเก่าอาจมีการเช็กชื่อวิชาเดียวกันในวันเดียวกันหลายแถว ตอนเปิดเว็บ upgrade_schema จะหยุดพร้อมรายการที่ซ้ำ
+สคริปต์นี้แสดงรายการเดียวกัน ถามยืนยัน สำรองไฟล์ฐานข้อมูลทั้งไฟล์ แล้วเก็บแถวที่บันทึกล่าสุดของแต่ละกลุ่มไว้
+
+ใช้: python dedupe_attendance.py [--yes]
+"""
+import sys
+
+from sqlalchemy import inspect
+
+from app import (app, db, init_db, configure_engine, pending_unique_indexes, find_unique_conflicts,
+                 describe_unique_conflicts, remove_duplicates_keep_newest, backup_database)
+
+
+def dedupe_attendance(assume_yes=False):
+    print("=== แก้ข้อมูลเช็กชื่อซ้ำก่อนอัปเกรดฐานข้อมูล ===")
+    with app.app_context():
+        configure_engine(db.engine)
+        with db.engine.connect() as conn:
+            pending = [(table, index, find_unique_conflicts(conn, table, index))
+                       for table, index in pending_unique_indexes(inspect(db.engine))]
+        pending = [p for p in pending if p[2]]
+
+        if not pending:
+            print("ℹ️  ไม่พบข้อมูลซ้ำ")
+        else:
+            for table, index, conflicts in pending:
+                print(describe_unique_conflicts(table, index, conflicts))
+            print("\nแต่ละกลุ่มจะเก็บแถวที่บันทึกล่าสุดไว้ (เช่น สถานะที่ครูแก้ทีหลัง) และลบแถวที่เก่ากว่า")
+            if not assume_yes and input("ยืนยันสำรองฐานข้อมูลแล้วลบแถวที่ซ้ำหรือไม่? (y/n): ").lower() != 'y':
+                print("ยกเลิก ไม่มีข้อมูลใดถูกแก้")
+                return
+
+            backup_path = backup_database()
+            print(f"✅ สำรองฐานข้อมูลไว้ที่ {backup_path}")
+            with db.engine.begin() as conn:
+                for table, index, _ in pending:
+                    removed = remove_duplicates_keep_newest(conn, table, index)
+                    print(f"✅ ลบแถวซ้ำ {removed} แถวจาก {table.name}")
+
+        # สร้าง index และอัปเกรดส่วนที่เหลือตามปกติ
+        init_db()
+        print("✅ อัปเกรดฐานข้อมูลเรียบร้อย")
+
+
+if __name__ == "__main__":
+    dedupe_attendance(assume_yes='--yes' in sys.argv[1:])
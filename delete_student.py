@@ -2,7 +2,7 @@ import os
 import shutil
 import csv
 # ดึงฟังก์ชันสร้างฐานข้อมูลมาจากไฟล์ encode_faces.py
-from encode_faces import create_encodings
+from encode_faces import remove_student_encodings
 
 # --- ตั้งค่า ---
 img_db_path = 'images_db'       # โฟลเดอร์เก็บรูป
@@ -81,7 +81,7 @@ def delete_student_data():
         print("\n--------------------------------------------------")
         print("⏳ มีการเปลี่ยนแปลงข้อมูล กำลังรีเซ็ตระบบความจำใบหน้า...")
         try:
-            create_encodings()
+            remove_student_encodings(student_id)
             print("✅ ระบบอัปเดตเสร็จสมบูรณ์! ข้อมูลถูกลบออกจากระบบแล้ว")
         except Exception as e:
             print(f"⚠️ เกิดข้อผิดพลาดในการอัปเดต: {e}")
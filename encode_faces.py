@@ -1,67 +1,297 @@
-import cv2
-import face_recognition
 import pickle
 import os
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from face_store import PRECISIONS, write_store
+import metrics
+from metrics import timed
 
 # --- ตั้งค่าเส้นทางไฟล์ ---
-dataset_path = 'images_db'      
-encoding_file = 'encodings.pickle' 
+dataset_path = 'images_db'
+encoding_file = 'encodings.bin'  # ไฟล์ไบนารีที่ app.py เปิดแบบ memmap (ดู face_store.py)
+manifest_file = 'encodings_manifest.pickle'  # บันทึกรายรูป (ขนาด, เวลาแก้ไข, hash -> encodings)
+
+MANIFEST_VERSION = 1
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# การย่อข้อมูลต่อคน: เก็บ centroid + ใบหน้าที่ต่างจากตัวแทนเดิมเกิน COMPACT_DISTANCE ไม่เกิน MAX_PER_STUDENT แถว
+# (0 = เก็บทุกรูปเหมือนเดิม) manifest ยังเก็บ encodings ครบทุกรูป เปลี่ยนค่าแล้วสร้างไฟล์ใหม่ได้โดยไม่ต้อง encode ใหม่
+# ค่าเริ่มต้นปิดไว้: ยังไม่มีผลวัดความแม่นยำกับ Encodings จริงของโรงเรียน
+# ตรวจก่อนเปิดด้วย python benchmark.py --only compaction --manifest encodings_manifest.pickle --max-per-student N
+MAX_PER_STUDENT = int(os.environ.get('FACE_MAX_PER_STUDENT', 0))
+COMPACT_DISTANCE = float(os.environ.get('FACE_COMPACT_DISTANCE', 0.25))
+# ความละเอียดของเมทริกซ์ที่ใช้ค้น: float32, float16 หรือ int8 (ดู face_store.py)
+# float16/int8 ลด RSS ตอนค้นเมื่อมีหลักแสนใบหน้า แต่ไฟล์ใหญ่ขึ้น เพราะยังเก็บ float32 ไว้ตรวจซ้ำ
+STORE_PRECISION = os.environ.get('FACE_STORE_PRECISION', 'float32')
+
+ENCODING_SECONDS = metrics.histogram('face_encoding_seconds', 'Duration of encoding store updates', ['operation'])
+ENCODED_IMAGES = metrics.counter('face_encoding_images_total', 'Images processed by the encoder', ['result'])
+
+
+def _file_hash(path):
+    """คำนวณ SHA-1 ของไฟล์รูป (อ่านทีละก้อน ไม่โหลดทั้งไฟล์เข้า RAM)"""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _write_atomic(path, payload):
+    """เขียนไฟล์ลงไฟล์ชั่วคราวก่อนแล้วค่อยเปลี่ยนชื่อทับ ป้องกันไฟล์เสียครึ่งทาง"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+def _load_manifest():
+    """โหลด manifest รายรูป (คืน None ถ้ายังไม่เคยสร้างหรือไฟล์ใช้ไม่ได้)"""
+    if os.path.exists(manifest_file):
+        try:
+            with open(manifest_file, 'rb') as f:
+                manifest = pickle.load(f)
+            if manifest.get('version') == MANIFEST_VERSION:
+                return manifest['images']
+        except Exception as e:
+            print(f"Warning: cannot read {manifest_file} ({e}), rebuilding")
+    return None
+
+
+def _save_manifest(images):
+    _write_atomic(manifest_file, pickle.dumps({'version': MANIFEST_VERSION, 'images': images}))
 
-def create_encodings():
-    # เปลี่ยนเป็นภาษาอังกฤษเพื่อป้องกัน UnicodeEncodeError ใน Terminal
-    print("--- Start Face Encoding Process ---")
-    
-    if os.path.exists(encoding_file):
-        os.remove(encoding_file)
-        print(f"Removed old {encoding_file}")
-
-    knownEncodings = []
-    knownNames = []
-    
-    # ตรวจสอบว่ามีโฟลเดอร์ images_db หรือไม่
-    if not os.path.exists(dataset_path):
-        print(f"Error: dataset_path '{dataset_path}' not found")
-        return
 
-    # 2. วนลูปอ่านข้อมูลใน images_db
-    for root, dirs, files in os.walk(dataset_path):
+def _scan_images(student_id=None):
+    """คืนรายการ (student_id, path) ของรูปทั้งหมดใน images_db (หรือเฉพาะโฟลเดอร์ของนักเรียนคนเดียว)"""
+    root_path = os.path.join(dataset_path, str(student_id)) if student_id is not None else dataset_path
+    found = []
+    for root, dirs, files in os.walk(root_path):
         # ข้ามโฟลเดอร์หลัก images_db
         if root == dataset_path:
             continue
-            
         for file in files:
-            if file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                imagePath = os.path.join(root, file)
-                
+            if file.lower().endswith(IMAGE_EXTENSIONS):
                 # ดึง ID นักเรียนจากชื่อโฟลเดอร์ย่อย
-                student_id = os.path.basename(root) 
-                
-                # เปลี่ยนเป็นภาษาอังกฤษ
-                print(f"Processing: {student_id} -> {file}")
-
-                # อ่านรูปภาพ
-                image = cv2.imread(imagePath)
-                if image is None:
-                    continue
-                    
-                rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                
-                # ตรวจหาตำแหน่งใบหน้าและสร้างรหัสใบหน้า
-                boxes = face_recognition.face_locations(rgb, model='hog')
-                encodings = face_recognition.face_encodings(rgb, boxes)
-
-                for encoding in encodings:
-                    knownEncodings.append(encoding)
-                    knownNames.append(student_id)
-
-    # 3. บันทึกข้อมูลลงไฟล์ Pickle
-    print("--- Saving data to Pickle file ---")
-    data = {"encodings": knownEncodings, "names": knownNames}
-    
-    with open(encoding_file, "wb") as f:
-        f.write(pickle.dumps(data))
-        
+                found.append((os.path.basename(root), os.path.join(root, file)))
+    return sorted(found, key=lambda item: item[1])
+
+
+def _encode_image(image_path):
+    """ตรวจหาใบหน้าและสร้างรหัสใบหน้าของรูปเดียว"""
+    # import ตอนใช้งานจริง: การลบ/อัปเดต manifest ไม่ต้องโหลดโมเดลใบหน้า (dlib) ที่ใช้เวลานาน
+    import cv2
+    import face_recognition
+
+    image = cv2.imread(image_path)
+    if image is None:
+        return []
+
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    # ตรวจหาตำแหน่งใบหน้าและสร้างรหัสใบหน้า
+    boxes = face_recognition.face_locations(rgb, model='hog')
+    return face_recognition.face_encodings(rgb, boxes)
+
+
+def _encode_worker(image_path):
+    """งานของแต่ละ process: encode รูปเดียว ถ้ารูปไหนพังให้คืน error แทนการล้มทั้งชุด"""
+    try:
+        return image_path, _encode_image(image_path), None
+    except Exception as e:
+        return image_path, [], str(e)
+
+
+def _encode_many(paths, workers=1, progress=None):
+    """encode หลายรูป (ใช้หลาย process เมื่อ workers > 1) คืนผลตามลำดับเดิมของ paths เสมอ"""
+    total = len(paths)
+    step = max(1, total // 20)
+
+    if workers > 1 and total > 1:
+        workers = min(workers, total)
+        chunksize = max(1, total // (workers * 4))
+        # spawn ไม่ใช่ fork: งานนี้ถูกเรียกจาก thread ของเว็บ (EncodingJobRunner) การ fork process ที่มีหลาย thread
+        # จะคัดลอก lock ที่ถูกถืออยู่ไปด้วย ใช้แบบเดียวกับ inference_pool.py
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        results = executor.map(_encode_worker, paths, chunksize=chunksize)
+    else:
+        executor = None
+        results = map(_encode_worker, paths)
+
+    try:
+        for done, (image_path, encodings, error) in enumerate(results, start=1):
+            ENCODED_IMAGES.inc(result='failed' if error else 'encoded')
+            if error:
+                print(f"Failed: {image_path} ({error})")
+            if done % step == 0 or done == total:
+                print(f"Progress: {done}/{total} images")
+            if progress:
+                progress(done, total)
+            yield image_path, encodings, error
+    finally:
+        if executor:
+            executor.shutdown()
+
+
+def _sync_images(images, found, full=False, workers=1, progress=None):
+    """อัปเดต manifest ให้ตรงกับไฟล์ใน found โดย encode เฉพาะรูปใหม่หรือรูปที่ถูกแก้ไข"""
+    # รูปที่เนื้อหาเหมือนเดิม (เช่น ถูกย้าย/เปลี่ยนชื่อ) ใช้ผลเดิมได้เลย
+    by_hash = {} if full else {entry['sha1']: entry['encodings'] for entry in images.values()}
+    pending = {}  # path -> ข้อมูลไฟล์ ที่ต้อง encode ใหม่
+    to_encode = {}  # hash -> path ตัวแทน (รูปซ้ำกัน encode ครั้งเดียว)
+
+    for student_id, image_path in found:
+        stat = os.stat(image_path)
+        entry = None if full else images.get(image_path)
+
+        if entry and entry['student_id'] == student_id and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            continue
+
+        info = {
+            'student_id': student_id,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'sha1': _file_hash(image_path),
+        }
+        if info['sha1'] in by_hash:
+            images[image_path] = dict(info, encodings=by_hash[info['sha1']])
+        else:
+            pending[image_path] = info
+            to_encode.setdefault(info['sha1'], image_path)
+
+    # เปลี่ยนเป็นภาษาอังกฤษเพื่อป้องกัน UnicodeEncodeError ใน Terminal
+    print(f"Encoding {len(to_encode)} images with {workers} worker(s)")
+    failed = set()
+    for image_path, encodings, error in _encode_many(sorted(to_encode.values()), workers, progress):
+        if error:
+            failed.add(pending[image_path]['sha1'])
+        else:
+            by_hash[pending[image_path]['sha1']] = encodings
+
+    for image_path, info in pending.items():
+        # รูปที่ encode ไม่สำเร็จจะไม่ถูกบันทึก เพื่อให้ลองใหม่ในรอบถัดไป
+        if info['sha1'] not in failed:
+            images[image_path] = dict(info, encodings=by_hash[info['sha1']])
+    return len(to_encode)
+
+
+def compact_encodings(encodings, max_count=None, merge_distance=None):
+    """ลดจำนวน Encodings ของนักเรียนหนึ่งคน: centroid ก่อน แล้วเพิ่มใบหน้าที่ไกลจากตัวแทนทุกตัวมากที่สุด
+    ทีละรูป (farthest point) จนทุกรูปอยู่ใกล้ตัวแทนไม่เกิน merge_distance หรือครบ max_count แถว
+
+    รูปที่ถ่ายซ้ำๆ มุมเดิมจะรวมเหลือ centroid ส่วนรูปที่ต่างจริง (แว่นตา, มุมหน้า) ยังถูกเก็บไว้
+    """
+    max_count = MAX_PER_STUDENT if max_count is None else max_count
+    merge_distance = COMPACT_DISTANCE if merge_distance is None else merge_distance
+    encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+    if max_count <= 0 or len(encodings) <= 1:
+        return encodings
+
+    representatives = [encodings.mean(axis=0)]
+    nearest = np.linalg.norm(encodings - representatives[0], axis=1)
+    while len(representatives) < max_count:
+        farthest = int(np.argmax(nearest))
+        if nearest[farthest] <= merge_distance:
+            break
+        representatives.append(encodings[farthest])
+        nearest = np.minimum(nearest, np.linalg.norm(encodings - encodings[farthest], axis=1))
+    return np.asarray(representatives, dtype=np.float32)
+
+
+def _write_encodings(images):
+    """สร้างไฟล์ Encodings จาก manifest (เรียงตามรหัสนักเรียน ให้ app.py เปิดแบบ memmap ได้โดยไม่ต้องคัดลอก)"""
+    by_student = {}
+    for image_path in sorted(images, key=lambda p: (images[p]['student_id'], p)):
+        entry = images[image_path]
+        by_student.setdefault(entry['student_id'], []).extend(entry['encodings'])
+
+    blocks, knownNames, total = [], [], 0
+    for student_id, encodings in by_student.items():
+        total += len(encodings)
+        if not encodings:
+            continue
+        compact = compact_encodings(encodings)
+        blocks.append(compact)
+        knownNames.extend([student_id] * len(compact))
+
+    print(f"--- Saving data to {encoding_file} ({len(knownNames)}/{total} encodings, {STORE_PRECISION}) ---")
+    matrix = np.concatenate(blocks) if blocks else np.zeros((0, 128), dtype=np.float32)
+    write_store(encoding_file, matrix, knownNames, precision=STORE_PRECISION)
+    _save_manifest(images)
+
     print(f"Success! Processed {len(set(knownNames))} students.")
 
+
+def create_encodings(full=False, workers=1, progress=None):
+    """อัปเดตฐานข้อมูลใบหน้าแบบเพิ่มเติม (encode เฉพาะรูปที่เปลี่ยน) หรือสร้างใหม่ทั้งหมดเมื่อ full=True"""
+    # เปลี่ยนเป็นภาษาอังกฤษเพื่อป้องกัน UnicodeEncodeError ใน Terminal
+    print(f"--- Start Face Encoding Process ({'full' if full else 'incremental'}) ---")
+
+    # ตรวจสอบว่ามีโฟลเดอร์ images_db หรือไม่
+    if not os.path.exists(dataset_path):
+        print(f"Error: dataset_path '{dataset_path}' not found")
+        return
+
+    images = {} if full else (_load_manifest() or {})
+    found = _scan_images()
+
+    # ลบรายการของรูป/โฟลเดอร์ที่ถูกลบไปแล้ว
+    found_paths = {path for _, path in found}
+    for image_path in [p for p in images if p not in found_paths]:
+        del images[image_path]
+
+    with timed(ENCODING_SECONDS, operation='full' if full else 'incremental'):
+        encoded = _sync_images(images, found, full=full, workers=workers, progress=progress)
+        print(f"Encoded {encoded} new/changed images, reused {len(found) - encoded}.")
+        ENCODED_IMAGES.inc(len(found) - encoded, result='reused')
+        _write_encodings(images)
+
+
+def add_student_encodings(student_id, workers=1, progress=None):
+    """encode เฉพาะรูปในโฟลเดอร์ของนักเรียนคนเดียว แล้วอัปเดตไฟล์ข้อมูลใบหน้า"""
+    student_id = str(student_id)
+    print(f"--- Update Face Encodings: {student_id} ---")
+    images = _load_manifest()
+    if images is None:
+        # ยังไม่มี manifest (เช่น อัปเกรดจากเวอร์ชันเก่า) ต้องสแกนทั้งหมดหนึ่งครั้ง
+        return create_encodings(workers=workers, progress=progress)
+    found = _scan_images(student_id)
+
+    found_paths = {path for _, path in found}
+    for image_path in [p for p, e in images.items() if e['student_id'] == student_id and p not in found_paths]:
+        del images[image_path]
+
+    with timed(ENCODING_SECONDS, operation='add_student'):
+        _sync_images(images, found, workers=workers, progress=progress)
+        _write_encodings(images)
+
+
+def remove_student_encodings(student_id):
+    """ลบข้อมูลใบหน้าของนักเรียนคนเดียวออกจากไฟล์ โดยไม่ต้อง encode รูปอื่นใหม่"""
+    student_id = str(student_id)
+    print(f"--- Remove Face Encodings: {student_id} ---")
+    images = _load_manifest()
+    if images is None:
+        return create_encodings()
+    with timed(ENCODING_SECONDS, operation='remove_student'):
+        for image_path in [p for p, e in images.items() if e['student_id'] == student_id]:
+            del images[image_path]
+        _write_encodings(images)
+
+
 if __name__ == "__main__":
-    create_encodings()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build face encodings from images_db")
+    parser.add_argument('--full', action='store_true', help="ignore the manifest and re-encode every image")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="number of encoding processes (1 = serial)")
+    parser.add_argument('--max-per-student', type=int, default=MAX_PER_STUDENT,
+                        help="encodings kept per student after compaction (0 = keep every photo)")
+    parser.add_argument('--precision', choices=sorted(PRECISIONS), default=STORE_PRECISION,
+                        help="matrix precision in the encodings store")
+    args = parser.parse_args()
+    MAX_PER_STUDENT = args.max_per_student
+    STORE_PRECISION = args.precision
+    create_encodings(full=args.full, workers=max(1, args.workers))
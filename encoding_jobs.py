@@ -0,0 +1,63 @@
+"""คิวงานเบื้องหลังสำหรับสร้างฐานข้อมูลใบหน้า (Encoding) ใหม่ โดยไม่ให้ HTTP request ต้องรอ"""
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class EncodingJobRunner:
+    """รันงานทีละงานตามลำดับ (manifest ของ encode_faces แก้พร้อมกันหลายงานไม่ได้) และเก็บสถานะไว้ให้ถามได้"""
+
+    def __init__(self, max_history=100):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='encoding-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_history = max_history
+
+    def submit(self, kind, task):
+        """ส่งงานเข้าคิว คืน job id ทันที (task ถูกเรียกเป็น task(progress))"""
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'kind': kind,
+            'status': 'queued',
+            'done': 0,
+            'total': 0,
+            'error': None,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            # เก็บประวัติเฉพาะงานล่าสุด ไม่ให้หน่วยความจำโตไปเรื่อยๆ
+            while len(self._jobs) > self._max_history:
+                self._jobs.popitem(last=False)
+        self._executor.submit(self._run, job, task)
+        return job_id
+
+    def _update(self, job, **fields):
+        with self._lock:
+            job.update(fields)
+
+    def _run(self, job, task):
+        self._update(job, status='running', started_at=time.time())
+
+        def progress(done, total):
+            self._update(job, done=done, total=total)
+
+        try:
+            task(progress)
+        except Exception as e:
+            traceback.print_exc()
+            self._update(job, status='error', error=str(e), finished_at=time.time())
+        else:
+            self._update(job, status='done', finished_at=time.time())
+
+    def get(self, job_id):
+        """คืนสำเนาสถานะของงาน (None ถ้าไม่พบ)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
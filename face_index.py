@@ -0,0 +1,335 @@
+"""ดัชนีใบหน้า (Face Index) สำหรับค้นหานักเรียนที่ใกล้ที่สุดแบบ Vectorized
+
+แทนการเรียก face_recognition.compare_faces กับ list ของ numpy array ทุกครั้งที่สแกน
+โดยสร้างเมทริกซ์ float32 ต่อเนื่องกันครั้งเดียวตอนโหลด แล้วคำนวณระยะห่างทั้งหมดในคำสั่งเดียว
+
+Kiosk รู้ห้องเรียนก่อนสแกน จึงค้นเฉพาะนักเรียนในห้อง (subset) ก่อน แล้วค่อยค้นทั้งโรงเรียนเมื่อไม่พบ
+ดัชนีขนาดใหญ่ (ระดับเขตพื้นที่ หลายหมื่นคน) ใช้ IVFIndex ค้นแบบประมาณ แล้วคำนวณระยะจริงของผู้สมัครอีกครั้ง
+
+เมทริกซ์หลักเป็น float16/int8 ได้ (ดู face_store.py) ระยะของนักเรียนที่ใกล้อันดับ 1 จะถูกคำนวณซ้ำ
+ด้วยเมทริกซ์ float32 เสมอ ค่าที่นำไปเทียบกับเกณฑ์ ai_tolerance จึงเป็นค่าความละเอียดเต็ม
+"""
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+# ผลลัพธ์การค้นหา: รหัสนักเรียนที่ใกล้ที่สุด, ระยะห่าง และช่องว่าง (margin) กับนักเรียนอันดับถัดไป
+FaceMatch = namedtuple('FaceMatch', ['student_id', 'distance', 'margin'])
+
+ENCODING_DIM = 128
+# จำนวนใบหน้าขั้นต่ำที่เริ่มใช้ IVFIndex (ต่ำกว่านี้การค้นทุกแถวเร็วพอและแม่นยำ 100%)
+ANN_MIN_FACES = 20000
+# จำนวน subset (ห้องเรียน) ที่เก็บไว้ต่อดัชนี
+SUBSET_CACHE_SIZE = 256
+# เมทริกซ์แบบย่อขนาด: นักเรียนที่ระยะห่างจากอันดับ 1 ไม่เกินค่านี้จะถูกคำนวณซ้ำด้วย float32
+# (ความคลาดเคลื่อนของระยะจาก int8 ต่อแถวอยู่ราว 0.005-0.01 ส่วน float16 ต่ำกว่า 0.001)
+RECHECK_BAND = 0.05
+RECHECK_MAX = 64
+# จำนวนแถวต่อรอบเมื่อต้องแปลงเมทริกซ์แบบย่อขนาดเป็น float32 ก่อนคูณ
+DEQUANTIZE_CHUNK = 4096
+
+
+def _to_matches(top_k):
+    """แปลงผล top_k_many (k=2) เป็น FaceMatch ต่อ query (None ถ้าดัชนีว่าง)"""
+    results = []
+    for top in top_k:
+        if not top:
+            results.append(None)
+            continue
+        student_id, distance = top[0]
+        margin = top[1][1] - distance if len(top) > 1 else float('inf')
+        results.append(FaceMatch(student_id, distance, margin))
+    return results
+
+
+class FaceIndex:
+    """เก็บ Encodings ทั้งหมดเป็นเมทริกซ์ (N, 128) จัดกลุ่มตามรหัสนักเรียน"""
+
+    def __init__(self, encodings, ids, ann_min_faces=None, scales=None, full=None):
+        """encodings เป็น float32 หรือเมทริกซ์แบบย่อขนาด (float16/int8 + scales) คู่กับ full แบบ float32"""
+        ids = [str(i) for i in ids]
+        reduced = full is not None and getattr(encodings, 'dtype', None) in (np.float16, np.int8)
+        if len(ids) == 0:
+            matrix = np.zeros((0, ENCODING_DIM), dtype=np.float32)
+            reduced, scales, full = False, None, None
+        elif reduced:
+            matrix = np.asarray(encodings).reshape(len(ids), -1)
+            full = np.asarray(full, dtype=np.float32).reshape(matrix.shape)
+            scales = None if scales is None else np.asarray(scales, dtype=np.float32)
+        else:
+            matrix = np.asarray(encodings, dtype=np.float32).reshape(len(ids), -1)
+            scales, full = None, None
+
+        # เรียงแถวให้รูปของนักเรียนคนเดียวกันอยู่ติดกัน เพื่อหาค่าต่ำสุดรายคนด้วย reduceat
+        id_array = np.asarray(ids, dtype=object)
+        order = np.argsort(id_array, kind='stable')
+        if np.any(order != np.arange(len(order))):
+            matrix, id_array = matrix[order], id_array[order]
+            if reduced:
+                full = full[order]
+                scales = None if scales is None else scales[order]
+        # ถ้าเรียงมาแล้ว (เช่น เปิดจาก face_store ด้วย memmap) จะใช้ข้อมูลเดิมโดยไม่คัดลอก
+        self.matrix = np.ascontiguousarray(matrix)
+        self.scales = scales
+        # เมทริกซ์ float32 สำหรับคำนวณระยะจริง (เป็นตัวเดียวกับ matrix เมื่อไม่ได้ย่อขนาด)
+        self.full = full if reduced else self.matrix
+        self.reduced = reduced
+        self.ids = id_array
+        self._sq_norms = np.concatenate(
+            [np.einsum('ij,ij->i', block, block) for _, block in self._blocks()] or [np.zeros(0, np.float32)])
+
+        if len(self.ids):
+            boundaries = np.flatnonzero(self.ids[1:] != self.ids[:-1]) + 1
+            self._starts = np.concatenate(([0], boundaries)).astype(np.intp)
+        else:
+            self._starts = np.zeros(0, dtype=np.intp)
+        self._ends = np.append(self._starts[1:], len(self.ids)).astype(np.intp)
+        self.student_ids = self.ids[self._starts]
+
+        # ดัชนีเป็นแบบอ่านอย่างเดียว: อัปเดตข้อมูลด้วยการสร้าง FaceIndex ใหม่แล้วสลับทั้งก้อนเท่านั้น
+        for array in (self.matrix, self.ids, self._sq_norms, self._starts, self._ends, self.student_ids):
+            array.flags.writeable = False
+
+        self._subsets = OrderedDict()
+        self._subsets_lock = threading.Lock()
+        # ค้นทั้งโรงเรียนแบบประมาณเมื่อดัชนีใหญ่พอ (None = ค้นทุกแถวเสมอ)
+        self.ann = None
+        if ann_min_faces is not None and len(self.ids) >= max(ann_min_faces, 1):
+            self.ann = IVFIndex(self)
+
+    @classmethod
+    def from_store(cls, data, ann_min_faces=None):
+        """สร้างจากผลของ face_store.load_store (StoreData)"""
+        return cls(data.matrix, data.ids, ann_min_faces=ann_min_faces, scales=data.scales, full=data.full)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def num_students(self):
+        return len(self.student_ids)
+
+    @property
+    def nbytes(self):
+        """ขนาดของเมทริกซ์ที่ใช้ค้นทุกครั้ง (ไม่รวม float32 ที่อ่านเฉพาะตอนตรวจซ้ำ)"""
+        return self.matrix.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def _blocks(self):
+        """แถวของเมทริกซ์หลักเป็น float32 ทีละช่วง: (start, block)"""
+        if not self.reduced:
+            yield 0, self.matrix
+            return
+        for start in range(0, len(self.matrix), DEQUANTIZE_CHUNK):
+            stop = start + DEQUANTIZE_CHUNK
+            block = np.asarray(self.matrix[start:stop], dtype=np.float32)
+            if self.scales is not None:
+                block *= self.scales[start:stop, None]
+            yield start, block
+
+    def distances(self, queries):
+        """ระยะห่างแบบ Euclidean ระหว่าง queries (M, 128) กับทุกแถวในดัชนี -> (M, N)"""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        q_norms = np.einsum('ij,ij->i', queries, queries)
+        if self.reduced:
+            dots = np.empty((len(queries), len(self.matrix)), dtype=np.float32)
+            for start, block in self._blocks():
+                dots[:, start:start + len(block)] = queries @ block.T
+        else:
+            dots = queries @ self.matrix.T
+        sq = q_norms[:, None] + self._sq_norms[None, :] - 2.0 * dots
+        np.maximum(sq, 0.0, out=sq)
+        return np.sqrt(sq, out=sq)
+
+    def _recheck(self, queries, per_student, k):
+        """คำนวณระยะของนักเรียนที่ใกล้อันดับ 1 (ภายใน RECHECK_BAND และอย่างน้อย k คน) ใหม่ด้วย float32"""
+        for query, row in zip(queries, per_student):
+            candidates = np.flatnonzero(row <= row.min() + RECHECK_BAND)
+            if len(candidates) < k or len(candidates) > RECHECK_MAX:
+                limit = max(k, min(len(candidates), RECHECK_MAX))
+                candidates = np.argpartition(row, limit - 1)[:limit] if limit < len(row) else np.arange(len(row))
+            sizes = self._ends[candidates] - self._starts[candidates]
+            rows = np.concatenate([np.arange(a, b) for a, b in zip(self._starts[candidates], self._ends[candidates])])
+            diff = np.asarray(self.full[rows]) - query
+            dist = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+            row[candidates] = np.minimum.reduceat(dist, np.concatenate(([0], np.cumsum(sizes)[:-1])))
+        return per_student
+
+    def student_distances(self, queries):
+        """ระยะห่างที่ใกล้ที่สุดต่อนักเรียนหนึ่งคน (รวมทุกรูปของคนนั้น) -> (M, จำนวนนักเรียน)"""
+        return np.minimum.reduceat(self.distances(queries), self._starts, axis=1)
+
+    def top_k_many(self, queries, k=2, exact=False):
+        """หา k นักเรียนที่ใกล้ที่สุดของแต่ละ query คืนค่าเป็น (รหัส, ระยะห่าง) เรียงจากใกล้ไปไกล
+
+        ถ้าดัชนีมี IVFIndex จะค้นแบบประมาณ ยกเว้นระบุ exact=True
+        """
+        if self.ann is not None and not exact:
+            return self.ann.top_k_many(queries, k)
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.num_students == 0:
+            return [[] for _ in range(len(queries))]
+
+        per_student = self.student_distances(queries)
+        k = min(k, per_student.shape[1])
+        if self.reduced:
+            per_student = self._recheck(queries, per_student, k)
+        if k < per_student.shape[1]:
+            candidates = np.argpartition(per_student, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.broadcast_to(np.arange(k), (len(queries), k))
+        cand_dist = np.take_along_axis(per_student, candidates, axis=1)
+        order = np.argsort(cand_dist, axis=1)
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        cand_dist = np.take_along_axis(cand_dist, order, axis=1)
+
+        return [
+            [(self.student_ids[j], float(d)) for j, d in zip(row_idx, row_dist)]
+            for row_idx, row_dist in zip(candidates, cand_dist)
+        ]
+
+    def search_many(self, queries, exact=False):
+        """คืน FaceMatch ของแต่ละ query (None ถ้าดัชนีว่าง)"""
+        return _to_matches(self.top_k_many(queries, k=2, exact=exact))
+
+    def search(self, encoding):
+        """หานักเรียนที่ใกล้ที่สุดของใบหน้าเดียว"""
+        return self.search_many([encoding])[0]
+
+    def subset(self, student_ids):
+        """ดัชนีย่อยเฉพาะนักเรียนใน student_ids (เช่น นักเรียนในห้อง) แคชไว้ตามชุดรหัส"""
+        key = tuple(sorted(set(str(i) for i in student_ids)))
+        with self._subsets_lock:
+            cached = self._subsets.get(key)
+            if cached is not None:
+                self._subsets.move_to_end(key)
+                return cached
+
+        # student_ids เรียงอยู่แล้ว หาตำแหน่งด้วย binary search แล้วตัดรหัสที่ไม่มีในดัชนีออก
+        wanted = np.asarray(key, dtype=object)
+        positions = np.searchsorted(self.student_ids, wanted).astype(np.intp)
+        found = positions < len(self.student_ids)
+        found[found] = self.student_ids[positions[found]] == wanted[found]
+        positions = positions[found]
+        rows = [np.arange(self._starts[j], self._ends[j]) for j in positions]
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.intp)
+        # แถวของดัชนีเดิมเรียงตามรหัสอยู่แล้ว ดัชนีย่อยจึงไม่ต้องเรียงใหม่
+        if self.reduced:
+            sub = FaceIndex(self.matrix[rows], self.ids[rows], scales=None if self.scales is None else self.scales[rows],
+                            full=self.full[rows])
+        else:
+            sub = FaceIndex(self.matrix[rows], self.ids[rows])
+
+        with self._subsets_lock:
+            self._subsets[key] = sub
+            if len(self._subsets) > SUBSET_CACHE_SIZE:
+                self._subsets.popitem(last=False)
+        return sub
+
+    def top_k_partitioned(self, queries, student_ids, tolerance, k=2):
+        """เหมือน search_partitioned แต่คืนผู้สมัคร k อันดับต่อใบหน้า (รูปแบบเดียวกับ top_k_many) และ scopes"""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if not student_ids:
+            return self.top_k_many(queries, k=k), ['all'] * len(queries)
+
+        tops = self.subset(student_ids).top_k_many(queries, k=k)
+        scopes = ['partition'] * len(queries)
+        misses = [i for i, top in enumerate(tops) if not top or top[0][1] > tolerance]
+        if misses:
+            for i, top in zip(misses, self.top_k_many(queries[misses], k=k)):
+                tops[i], scopes[i] = top, 'all'
+        return tops, scopes
+
+    def search_partitioned(self, queries, student_ids, tolerance):
+        """ค้นในกลุ่ม student_ids ก่อน ใบหน้าที่ไม่ผ่าน tolerance จึงค้นทั้งดัชนี
+
+        คืน (matches, scopes) โดย scopes บอกต่อใบหน้าว่าได้ผลจาก 'partition' หรือ 'all'
+        margin ของผลจาก partition เทียบกับนักเรียนอันดับถัดไปในกลุ่มเดียวกัน
+        """
+        tops, scopes = self.top_k_partitioned(queries, student_ids, tolerance, k=2)
+        return _to_matches(tops), scopes
+
+
+class IVFIndex:
+    """ค้นหาแบบประมาณ (Inverted File) สำหรับดัชนีขนาดใหญ่
+
+    แบ่งใบหน้าทั้งหมดเป็น nlist กลุ่มด้วย k-means ตอนค้นจะดูเฉพาะ nprobe กลุ่มที่ centroid ใกล้ query ที่สุด
+    แล้วคำนวณระยะจริงของใบหน้าในกลุ่มเหล่านั้น (exact re-rank) ผลจึงต่างจากการค้นทุกแถว
+    เฉพาะกรณีที่ใบหน้าที่ใกล้ที่สุดอยู่นอกกลุ่มที่ถูกเลือก (ดู recall ใน benchmark.py --only ann)
+    """
+
+    def __init__(self, index, nlist=None, nprobe=None, iterations=10, sample_size=65536, seed=0):
+        self.index = index
+        count = len(index)
+        self.nlist = max(1, min(nlist or int(round(np.sqrt(count))), count))
+        self.nprobe = max(1, min(nprobe or max(8, self.nlist // 16), self.nlist))
+        self._train(iterations, sample_size, np.random.default_rng(seed))
+
+        assignment = self._nearest_centroid(index.full)
+        order = np.argsort(assignment, kind='stable')
+        self._list_rows = order.astype(np.intp)
+        self._list_offsets = np.searchsorted(assignment[order], np.arange(self.nlist + 1))
+        # ลำดับนักเรียน (ตำแหน่งใน index.student_ids) ของแต่ละแถว
+        sizes = index._ends - index._starts
+        # norm ของ float32 (ดัชนีแบบย่อขนาดเก็บ norm ของค่าที่ย่อแล้ว จึงคำนวณใหม่)
+        self._sq_norms = np.einsum('ij,ij->i', index.full, index.full) if index.reduced else index._sq_norms
+        self._row_student = np.repeat(np.arange(index.num_students), sizes)
+
+    def _nearest_centroid(self, matrix, chunk=65536):
+        c_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        result = np.empty(len(matrix), dtype=np.intp)
+        for start in range(0, len(matrix), chunk):
+            block = np.asarray(matrix[start:start + chunk], dtype=np.float32)
+            # ||x||^2 เท่ากันทุก centroid จึงไม่ต้องบวก
+            result[start:start + chunk] = np.argmin(c_norms[None, :] - 2.0 * (block @ self.centroids.T), axis=1)
+        return result
+
+    def _train(self, iterations, sample_size, rng):
+        """k-means (Lloyd) บนตัวอย่างสุ่มของใบหน้า"""
+        matrix = self.index.full
+        if len(matrix) > sample_size:
+            sample = np.asarray(matrix[np.sort(rng.choice(len(matrix), sample_size, replace=False))])
+        else:
+            sample = np.asarray(matrix)
+        self.centroids = sample[rng.choice(len(sample), self.nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels = self._nearest_centroid(sample)
+            counts = np.bincount(labels, minlength=self.nlist)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, labels, sample)
+            empty = counts == 0
+            # กลุ่มที่ว่างให้เริ่มใหม่จากจุดสุ่ม
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            counts[empty] = 1
+            self.centroids = (sums / counts[:, None]).astype(np.float32)
+
+    def candidate_rows(self, query):
+        """แถวของใบหน้าใน nprobe กลุ่มที่ใกล้ query ที่สุด"""
+        c_dist = np.einsum('ij,ij->i', self.centroids, self.centroids) - 2.0 * (self.centroids @ query)
+        probe = np.argpartition(c_dist, self.nprobe - 1)[:self.nprobe] if self.nprobe < self.nlist \
+            else np.arange(self.nlist)
+        rows = np.concatenate([self._list_rows[self._list_offsets[c]:self._list_offsets[c + 1]] for c in probe])
+        # เรียงตามเลขแถว: อ่านเมทริกซ์ตามลำดับ และแถวของนักเรียนคนเดียวกันอยู่ติดกัน
+        return np.sort(rows)
+
+    def top_k_many(self, queries, k=2):
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        index = self.index
+        results = []
+        for query in queries:
+            rows = self.candidate_rows(query)
+            if len(rows) == 0:
+                results.append([])
+                continue
+            # exact re-rank: ระยะจริง (float32) ของใบหน้าที่เป็นผู้สมัคร แล้วเอาค่าต่ำสุดต่อนักเรียน
+            sq = float(query @ query) + self._sq_norms[rows] - 2.0 * (np.asarray(index.full[rows]) @ query)
+            dist = np.sqrt(np.maximum(sq, 0.0))
+            students = self._row_student[rows]
+            starts = np.concatenate(([0], np.flatnonzero(students[1:] != students[:-1]) + 1))
+            best_students, best_dist = students[starts], np.minimum.reduceat(dist, starts)
+            top = np.argsort(best_dist, kind='stable')[:k]
+            results.append([(index.student_ids[best_students[j]], float(best_dist[j])) for j in top])
+        return results
+
+    def search_many(self, queries):
+        return _to_matches(self.top_k_many(queries, k=2))
@@ -0,0 +1,196 @@
+"""ไฟล์เก็บ Encodings แบบไบนารี (แทน encodings.pickle)
+
+โครงสร้างไฟล์ (little-endian):
+    [หัวไฟล์ 64 ไบต์][เมทริกซ์ count x dim][scale ต่อแถว (int8)][เมทริกซ์ float32 (float16/int8)]
+    [ตารางรหัสนักเรียน (JSON UTF-8)]
+
+เมทริกซ์หลักเก็บเป็น float32 (ค่าเริ่มต้น), float16 หรือ int8 (quantize แบบ symmetric ต่อแถว)
+แบบย่อขนาดจะเก็บเมทริกซ์ float32 ต่อท้ายไว้ด้วย ใช้ตรวจระยะซ้ำเฉพาะผู้สมัครที่ใกล้ผลลัพธ์
+เวลาค้นจึงอ่านแค่เมทริกซ์ขนาดเล็ก ส่วน float32 ถูกอ่านเข้า page cache เพียงไม่กี่แถวต่อการสแกน
+
+แบบย่อขนาดประหยัดหน่วยความจำตอนค้น (RSS) ไม่ใช่พื้นที่ดิสก์: ไฟล์ใหญ่กว่า float32 (float16 ราว 1.5 เท่า, int8 ราว 1.25 เท่า)
+ผลวัดด้วย Encodings สุ่ม 128 มิติ (RSS ที่เพิ่มหลังเปิดไฟล์ สร้าง FaceIndex และค้น 8 ใบหน้า):
+    20,000 แถว   ไฟล์ float32 10.0 / float16 14.8 / int8 12.5 MB   RSS 14.4 / 16.7 / 13.8 MB (แทบไม่ต่าง)
+    200,000 แถว  ไฟล์ float32 99.6 / float16 148.4 / int8 124.7 MB  RSS 122.9 / 90.2 / 66.5 MB
+ระดับโรงเรียนเดียว (ไม่กี่หมื่นใบหน้า) ใช้ float32 ได้เลย ดูค่าของข้อมูลจริงได้จาก python benchmark.py --only compaction
+
+ฝั่งเว็บเปิดเมทริกซ์ด้วย np.memmap ทุก worker จึงใช้หน้า page cache ชุดเดียวกัน
+และเวลาโหลดแทบไม่ขึ้นกับจำนวนใบหน้า
+"""
+import json
+import os
+import pickle
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+STORE_MAGIC = b'FACESTOR'
+STORE_VERSION = 2
+HEADER_SIZE = 64
+# magic, version, dim, count, dtype, ids_offset, ids_length
+_HEADER = struct.Struct('<8sIIQ4sQQ')
+# เวอร์ชัน 2 เพิ่ม scales_offset, full_offset (0 = ไม่มีส่วนนั้น)
+_HEADER_V2 = struct.Struct('<8sIIQ4sQQQQ')
+_DTYPE = '<f4'
+PRECISIONS = {'float32': '<f4', 'float16': '<f2', 'int8': '|i1'}
+
+# ผลของ load_store: matrix เมทริกซ์หลัก, scales (int8 เท่านั้น), full เมทริกซ์ float32 (None ถ้า matrix เป็น float32)
+StoreData = namedtuple('StoreData', ['matrix', 'scales', 'full', 'ids'])
+
+
+class StoreError(Exception):
+    """ไฟล์ Encodings เสียหายหรือเป็นเวอร์ชันที่ไม่รองรับ"""
+
+
+def quantize_int8(matrix):
+    """แปลงเป็น int8 แบบ symmetric ต่อแถว คืน (int8 matrix, scale float32 ต่อแถว) โดย ค่าเดิม ≈ q * scale"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.zeros(0, dtype=np.float32)
+    scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    quantized = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales
+
+
+def dequantize(matrix, scales=None):
+    """แปลงแถวของเมทริกซ์หลัก (float32/float16/int8) กลับเป็น float32"""
+    block = np.asarray(matrix, dtype=np.float32)
+    if scales is not None:
+        block *= np.asarray(scales, dtype=np.float32)[:, None]
+    return block
+
+
+def write_store(path, matrix, ids, precision='float32'):
+    """เขียนไฟล์แบบ atomic: เขียนลงไฟล์ชั่วคราวให้เสร็จก่อน แล้วค่อย os.replace ทับไฟล์เดิม
+
+    precision: 'float32' (ค่าเริ่มต้น), 'float16' หรือ 'int8' (แบบย่อขนาดเก็บ float32 ต่อท้ายด้วย ไฟล์จึงใหญ่กว่า)
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"unknown precision {precision!r} (choose from {', '.join(PRECISIONS)})")
+    full = np.ascontiguousarray(matrix, dtype=_DTYPE)
+    if full.ndim != 2 or len(full) != len(ids):
+        raise ValueError("matrix must be (len(ids), dim)")
+    count, dim = full.shape
+
+    scales = None
+    if precision == 'int8':
+        main, scales = quantize_int8(full)
+        scales = scales.astype(_DTYPE)
+    else:
+        main = full.astype(PRECISIONS[precision])
+    sections = [main] + ([scales] if scales is not None else []) + ([full] if precision != 'float32' else [])
+
+    # ทุกส่วนเริ่มที่ offset หาร 8 ลงตัว (ขนาดแต่ละส่วนเป็นผลคูณของ dim อยู่แล้วในกรณีทั่วไป)
+    offsets, position = [], HEADER_SIZE
+    for section in sections:
+        offsets.append(position)
+        position += -(-section.nbytes // 8) * 8
+    scales_offset = offsets[1] if scales is not None else 0
+    full_offset = offsets[-1] if precision != 'float32' else 0
+    ids_blob = json.dumps([str(i) for i in ids], ensure_ascii=False).encode('utf-8')
+
+    header = _HEADER_V2.pack(STORE_MAGIC, STORE_VERSION, dim, count,
+                             PRECISIONS[precision].encode('ascii').ljust(4, b'\0'),
+                             position, len(ids_blob), scales_offset, full_offset)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        for offset, section in zip(offsets, sections):
+            f.seek(offset)
+            f.write(section.tobytes())
+        f.seek(position)
+        f.write(ids_blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_header(f):
+    raw = f.read(HEADER_SIZE)
+    if len(raw) < HEADER_SIZE:
+        raise StoreError("file too short")
+    magic, version, dim, count, dtype, ids_offset, ids_length = _HEADER.unpack_from(raw)
+    if magic != STORE_MAGIC:
+        raise StoreError("not a face store file")
+    if version == 1:
+        scales_offset = full_offset = 0
+    elif version == STORE_VERSION:
+        scales_offset, full_offset = _HEADER_V2.unpack_from(raw)[7:]
+    else:
+        raise StoreError(f"unsupported store version {version}")
+    dtype = dtype.rstrip(b'\0').decode('ascii')
+    if dtype not in PRECISIONS.values():
+        raise StoreError(f"unsupported matrix dtype {dtype}")
+    if dtype != _DTYPE and not full_offset or dtype == PRECISIONS['int8'] and not scales_offset:
+        raise StoreError("reduced-precision store without full-precision section")
+    return {
+        'version': version,
+        'dim': dim,
+        'count': count,
+        'dtype': dtype,
+        'ids_offset': ids_offset,
+        'ids_length': ids_length,
+        'scales_offset': scales_offset,
+        'full_offset': full_offset,
+    }
+
+
+def _read_section(path, dtype, offset, shape, use_mmap):
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=dtype)
+    if use_mmap:
+        return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+    count = int(np.prod(shape))
+    return np.fromfile(path, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+
+def load_store(path, use_mmap=None):
+    """เปิดไฟล์ คืนค่า StoreData โดยเมทริกซ์ทุกส่วนเป็น np.memmap แบบอ่านอย่างเดียว"""
+    # Windows ไม่อนุญาตให้ os.replace ทับไฟล์ที่ถูก mmap อยู่ จึงอ่านเข้า RAM แทน
+    if use_mmap is None:
+        use_mmap = os.name != 'nt'
+
+    with open(path, 'rb') as f:
+        header = read_header(f)
+        f.seek(header['ids_offset'])
+        ids = json.loads(f.read(header['ids_length']).decode('utf-8'))
+
+    shape = (header['count'], header['dim'])
+    if len(ids) != header['count']:
+        raise StoreError("id table does not match matrix")
+    matrix = _read_section(path, header['dtype'], HEADER_SIZE, shape, use_mmap)
+    scales = full = None
+    if header['scales_offset']:
+        scales = _read_section(path, _DTYPE, header['scales_offset'], (shape[0],), use_mmap)
+    if header['full_offset']:
+        full = _read_section(path, _DTYPE, header['full_offset'], shape, use_mmap)
+    return StoreData(matrix, scales, full, ids)
+
+
+def open_store(path, use_mmap=None):
+    """เปิดไฟล์ คืนค่า (matrix float32, ids) ใช้กับโค้ดที่ต้องการเฉพาะค่าความละเอียดเต็ม"""
+    data = load_store(path, use_mmap)
+    return (data.full if data.full is not None else data.matrix), data.ids
+
+
+def store_stamp(path):
+    """ลายเซ็นของไฟล์ (inode, ขนาด, เวลาแก้ไข) ใช้ตรวจว่ามีไฟล์ชุดใหม่ถูกเขียนทับหรือไม่"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def migrate_pickle(pickle_path, path):
+    """แปลง encodings.pickle รูปแบบเดิมเป็นไฟล์ไบนารี (ทำครั้งเดียวตอนอัปเกรด)"""
+    with open(pickle_path, 'rb') as f:
+        data = pickle.load(f)
+    ids = [str(i) for i in data["names"]]
+    # เรียงตามรหัสนักเรียนให้ตรงกับที่ FaceIndex ใช้ จะได้เปิดแบบ memmap โดยไม่ต้องคัดลอก
+    order = sorted(range(len(ids)), key=lambda i: ids[i])
+    if ids:
+        matrix = np.asarray([data["encodings"][i] for i in order], dtype=_DTYPE)
+    else:
+        matrix = np.zeros((0, 128), dtype=_DTYPE)
+    write_store(path, matrix, [ids[i] for i in order])
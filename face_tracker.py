@@ -0,0 +1,116 @@
+"""ติดตามใบหน้าระหว่างเฟรม (Box Tracking) สำหรับโหมดสแกนต่อเนื่อง
+
+จับคู่กรอบใบหน้าของเฟรมใหม่กับเฟรมก่อนด้วย IoU ซึ่งถูกมาก
+แล้วสร้างรหัสใบหน้า 128 มิติ (ขั้นตอนที่แพง) เฉพาะตอนที่มีใบหน้าใหม่เข้ามาในกล้องเท่านั้น
+"""
+import itertools
+import threading
+
+
+def box_iou(a, b):
+    """IoU ของกรอบ (top, right, bottom, left) สองกรอบ"""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(0, bottom - top) * max(0, right - left)
+    if inter == 0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return inter / float(area_a + area_b - inter)
+
+
+class Track:
+    """ใบหน้าหนึ่งใบที่กำลังติดตามอยู่"""
+
+    def __init__(self, track_id, box, now):
+        self.id = track_id
+        self.box = box
+        self.first_seen = now
+        self.last_seen = now
+        self.last_encoded = None
+        self.student_id = None
+        self.distance = None
+        self.announced = False  # แจ้งผลการจำหน้าไปที่ Kiosk แล้วหรือยัง
+
+    def needs_encoding(self, now, retry_interval):
+        """ต้อง encode หรือไม่: track ใหม่ หรือยังจำไม่ได้และถึงเวลาลองใหม่"""
+        if self.last_encoded is None:
+            return True
+        return self.student_id is None and now - self.last_encoded >= retry_interval
+
+
+class FaceTracker:
+    """จับคู่กรอบใบหน้าข้ามเฟรมด้วย IoU แบบ greedy (ในกล้อง Kiosk มีไม่กี่ใบหน้าต่อเฟรม)"""
+
+    def __init__(self, iou_threshold=0.3, max_age=1.0, retry_interval=1.0):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age  # วินาทีที่ track หายจากกล้องได้ก่อนจะถูกลบ
+        self.retry_interval = retry_interval
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    def update(self, boxes, now):
+        """อัปเดต track ด้วยกรอบของเฟรมใหม่ คืนรายการ track ที่เห็นในเฟรมนี้ (เรียงตาม boxes)"""
+        pairs = sorted(
+            ((box_iou(track.box, box), t, b) for t, track in enumerate(self.tracks) for b, box in enumerate(boxes)),
+            reverse=True,
+        )
+        matched_tracks, assigned = set(), {}
+        for iou, t, b in pairs:
+            if iou < self.iou_threshold:
+                break
+            if t in matched_tracks or b in assigned:
+                continue
+            matched_tracks.add(t)
+            assigned[b] = self.tracks[t]
+
+        current = []
+        for b, box in enumerate(boxes):
+            track = assigned.get(b)
+            if track is None:
+                track = Track(next(self._ids), box, now)
+                self.tracks.append(track)
+            track.box = box
+            track.last_seen = now
+            current.append(track)
+
+        self.tracks = [t for t in self.tracks if now - t.last_seen <= self.max_age]
+        return current
+
+    def pending(self, tracks, now):
+        """track ในเฟรมนี้ที่ต้อง encode"""
+        return [t for t in tracks if t.needs_encoding(now, self.retry_interval)]
+
+
+class LatestFrame:
+    """ช่องเก็บเฟรมที่รอประมวลผลได้เพียงเฟรมเดียว
+
+    ถ้าเซิร์ฟเวอร์ประมวลผลไม่ทัน เฟรมใหม่จะทับเฟรมเก่าที่ยังค้างอยู่ (นับเป็น dropped)
+    ความหน่วงจึงไม่เกินเวลาประมวลผลหนึ่งเฟรม แทนที่งานจะกองรอคิวยาวขึ้นเรื่อยๆ
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame = None
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, frame):
+        with self._cond:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def take(self):
+        """รอจนมีเฟรมใหม่ คืน None เมื่อการเชื่อมต่อปิดแล้ว"""
+        with self._cond:
+            while self._frame is None and not self._closed:
+                self._cond.wait()
+            frame, self._frame = self._frame, None
+            return frame
@@ -0,0 +1,98 @@
+"""แคชผลการจดจำใบหน้าของเฟรมที่แทบเหมือนเดิม (กดถ่ายซ้ำ / เบราว์เซอร์ส่งซ้ำเพราะ WiFi หลุด)
+
+ไฟล์ภาพเดิมทุกไบต์ (เบราว์เซอร์ส่งซ้ำ) ภายใน ttl วินาทีได้ผลเดิมทุกแบบโดยไม่ต้อง detect/encode ใหม่
+เฟรมที่แค่คล้ายกัน (ย่อเป็นภาพขาวดำ 9x8 แล้วคำนวณ dHash 64 บิต ต่างกันไม่เกิน max_distance บิต)
+ใช้ได้เฉพาะผลที่ไม่ระบุตัวคน (ไม่พบใบหน้า/จำไม่ได้): กล้อง Kiosk อยู่กับที่ dHash ของทั้งเฟรมจึงถูกพื้นหลังกำหนดเป็นส่วนใหญ่
+นักเรียนคนถัดไปที่เข้ามาภายในไม่กี่วินาทีอาจได้ hash ใกล้กับคนก่อน ห้ามใช้ตัดสินว่าเป็นคนเดียวกัน
+
+แคชแยกตาม Kiosk (session) และตาม scope (โปรไฟล์, ห้อง, เกณฑ์, ลายเซ็นไฟล์ Encodings)
+เมื่อดัชนีใบหน้าเปลี่ยน scope จะไม่ตรงกับค่าที่เก็บไว้ ผลเก่าจึงไม่ถูกใช้อีก
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+
+LOOKUPS = metrics.counter('frame_cache_lookups_total', 'Recognition result cache lookups', ['result'])
+SESSIONS = metrics.gauge('frame_cache_sessions', 'Kiosk sessions with cached recognition results')
+
+
+def frame_hash(buf):
+    """dHash 64 บิตของไฟล์ภาพ (JPEG/PNG bytes) คืน None ถ้าอ่านภาพไม่ได้"""
+    import cv2
+
+    # ให้ libjpeg ถอดรหัสที่ 1/8 ของขนาดจริงแบบขาวดำ เร็วกว่าถอดทั้งภาพหลายเท่า
+    img = cv2.imdecode(np.frombuffer(buf, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if img is None:
+        return None
+    small = cv2.resize(img, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def content_key(buf):
+    """ลายเซ็นของไฟล์ภาพทั้งไฟล์ เท่ากันเฉพาะไฟล์ที่เหมือนกันทุกไบต์"""
+    return hashlib.blake2b(buf, digest_size=16).digest()
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class FrameCache:
+    """ผลล่าสุดไม่เกิน max_entries เฟรมต่อ Kiosk จำนวน Kiosk ไม่เกิน max_sessions (เกินแล้วลบที่ใช้นานที่สุดก่อน)"""
+
+    def __init__(self, ttl=5.0, max_distance=1, max_entries=8, max_sessions=512):
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.max_sessions = max_sessions
+        # session -> [(หมดอายุ, dHash, content_key, scope, ผลลัพธ์, ใช้กับเฟรมที่คล้ายกันได้), ...] เก่าไปใหม่
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_key, digest, scope, key=None):
+        """ผลของไฟล์เดิม (key ตรงกัน) หรือเฟรมที่ใกล้เคียงที่สุดที่เก็บแบบ near=True ใน session นี้ (None ถ้าไม่มี)"""
+        if digest is None or self.ttl <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entries = self._sessions.get(session_key)
+            best = None
+            if entries:
+                entries[:] = [e for e in entries if e[0] > now]
+                candidates = []
+                for _, entry_digest, entry_key, entry_scope, value, near in entries:
+                    if entry_scope != scope:
+                        continue
+                    if key is not None and entry_key == key:
+                        candidates.append((-1, value))
+                    elif near and hamming(digest, entry_digest) <= self.max_distance:
+                        candidates.append((hamming(digest, entry_digest), value))
+                if candidates:
+                    best = min(candidates, key=lambda c: c[0])[1]
+                self._sessions.move_to_end(session_key)
+        LOOKUPS.inc(result='hit' if best is not None else 'miss')
+        return best
+
+    def put(self, session_key, digest, scope, value, key=None, near=False):
+        """เก็บผลของเฟรม near=True เฉพาะผลที่ไม่ระบุตัวคน (ให้เฟรมที่แค่คล้ายกันใช้ได้) ผลอื่นใช้ได้กับไฟล์เดิม (key) เท่านั้น"""
+        if digest is None or self.ttl <= 0 or (key is None and not near):
+            return
+        with self._lock:
+            entries = self._sessions.setdefault(session_key, [])
+            self._sessions.move_to_end(session_key)
+            entries.append((time.monotonic() + self.ttl, digest, key, scope, value, near))
+            del entries[:-self.max_entries]
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            SESSIONS.set(len(self._sessions))
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            SESSIONS.set(0)
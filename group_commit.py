@@ -0,0 +1,115 @@
+"""Group Commit: รวมการเขียนจากหลาย Kiosk ที่เข้ามาในช่วงเวลาสั้นๆ แล้ว commit ครั้งเดียว
+
+ช่วงต้นคาบ Kiosk หลายเครื่องบันทึกพร้อมกัน ถ้า commit ทีละรายการจะต้อง fsync ทุกครั้ง
+และ writer ต่อคิวกันจนเกิด "database is locked" การรวมเป็นก้อนจึงเหลือ fsync ไม่กี่ครั้ง
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+
+import metrics
+
+BATCH_SIZE = metrics.histogram('attendance_group_commit_batch_size', 'Writes committed together in one transaction',
+                               buckets=(1, 2, 5, 10, 20, 50, 100, 200))
+COMMIT_SECONDS = metrics.histogram('attendance_group_commit_seconds',
+                                   'Duration of one group commit transaction (lock wait + writes + fsync)')
+TIMEOUTS = metrics.counter('attendance_group_commit_timeouts_total', 'Writes the caller stopped waiting for')
+
+
+class GroupCommitTimeout(Exception):
+    """งานเขียนไม่เสร็จภายใน timeout (งานยังอยู่ในคิวและอาจ commit ภายหลัง ผู้เรียกต้องส่งซ้ำได้โดยไม่บันทึกซ้ำ)"""
+
+
+class GroupCommitWriter:
+    """Thread เดียวที่รับงานเขียน รอรวมงานตาม window แล้วรันทั้งหมดใน Transaction เดียว
+
+    งานแต่ละชิ้นคือฟังก์ชัน fn(connection) ที่คืนผลลัพธ์ของตัวเอง และรันใน SAVEPOINT แยก
+    งานชิ้นไหนพังจะไม่ทำให้งานอื่นในก้อนเดียวกันถูกยกเลิก
+    execution_options ส่งให้ connection ที่ใช้เขียน (เช่น {'sqlite_begin': 'IMMEDIATE'} ดู configure_engine ใน app.py)
+    """
+
+    def __init__(self, window=0.01, max_batch=200, execution_options=None):
+        self.window = window
+        self.max_batch = max_batch
+        self.execution_options = dict(execution_options or {})
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                self._thread.start()
+
+    def run(self, engine, fn, timeout=30):
+        """ส่งงานเข้าก้อนถัดไปแล้วรอผล (window=0 จะรันทันทีใน Transaction ของตัวเอง)"""
+        if self.window <= 0:
+            with self._begin(engine) as conn:
+                return fn(conn)
+        future = Future()
+        self._ensure_thread()
+        self._queue.put((engine, fn, future))
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            TIMEOUTS.inc()
+            raise GroupCommitTimeout(f"write did not commit within {timeout:g}s") from None
+
+    @contextmanager
+    def _begin(self, engine):
+        with engine.connect() as conn:
+            conn.execution_options(**self.execution_options)
+            with conn.begin():
+                yield conn
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            by_engine = {}
+            for engine, fn, future in batch:
+                by_engine.setdefault(engine, []).append((fn, future))
+            for engine, items in by_engine.items():
+                self._commit(engine, items)
+
+    def _commit(self, engine, items):
+        results = []
+        BATCH_SIZE.observe(len(items))
+        start = time.perf_counter()
+        try:
+            # SAVEPOINT ต้องอยู่ใน BEGIN จริง (pysqlite ไม่ส่ง BEGIN เอง ดู configure_engine ใน app.py)
+            # ไม่เช่นนั้น RELEASE แต่ละครั้งจะ commit งานนั้นทันที และก้อนนี้จะไม่ได้ commit ครั้งเดียว
+            with self._begin(engine) as conn:
+                for fn, future in items:
+                    try:
+                        with conn.begin_nested():
+                            results.append((future, fn(conn), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            # commit ทั้งก้อนไม่สำเร็จ แจ้งทุกงานในก้อน
+            for _, future in items:
+                future.set_exception(e)
+            return
+        finally:
+            COMMIT_SECONDS.observe(time.perf_counter() - start)
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
@@ -0,0 +1,239 @@
+"""Process pool สำหรับงานจดจำใบหน้า (decode -> detect -> encode -> match) แยกจาก thread ของเว็บ
+
+dlib ใช้ CPU หนักและถือ GIL บางช่วง ถ้ารันใน thread ของ Flask ทุก Kiosk จะแย่ง interpreter เดียวกัน
+แต่ละ worker process โหลดโมเดลและเปิดดัชนีใบหน้า (memmap) ไว้ครั้งเดียว แล้วโหลดใหม่เองเมื่อไฟล์เปลี่ยน
+
+งานที่รอได้มีจำกัด (workers + queue_depth) ถ้าเต็มและรอช่องว่างเกิน queue_timeout จะโยน InferenceBusy
+ให้ฝั่งเว็บตอบ "ไม่ว่าง ลองใหม่" ทันที แทนที่จะปล่อยให้คำขอกองรอจนทุกคนช้า
+"""
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+import metrics
+from face_index import FaceIndex
+from face_store import load_store, store_stamp
+from recognition import detect_faces, encode_boxes
+
+QUEUE_DEPTH = metrics.gauge('inference_queue_depth', 'Recognition jobs queued or running in the inference pool')
+QUEUE_WAIT_SECONDS = metrics.histogram('inference_queue_wait_seconds',
+                                       'Time a recognition job waited before a worker started it')
+REJECTED = metrics.counter('inference_rejected_total', 'Recognition jobs rejected because the queue was full')
+TIMEOUTS = metrics.counter('inference_timeouts_total', 'Recognition jobs the caller stopped waiting for')
+WORKERS = metrics.gauge('inference_workers', 'Configured inference worker processes')
+
+
+class InferenceBusy(Exception):
+    """คิวเต็ม: ให้ผู้เรียกตอบกลับว่าไม่ว่างและให้ลองใหม่"""
+
+
+class InferenceTimeout(Exception):
+    """worker ทำงานไม่เสร็จภายใน timeout (งานยังทำต่อจนเสร็จใน worker แต่ผู้เรียกเลิกรอแล้ว)"""
+
+
+def _decode_rgb(buf):
+    import cv2
+
+    img = cv2.imdecode(np.frombuffer(buf, np.uint8), cv2.IMREAD_COLOR)
+    return None if img is None else cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def run_detection(buf, profile):
+    """decode -> detect อย่างเดียว คืน dict: decoded, boxes, timings (โหมดสแกนต่อเนื่องติดตามใบหน้าเองแล้ว encode เฉพาะใบหน้าใหม่)"""
+    timings = {}
+    start = time.perf_counter()
+    rgb = _decode_rgb(buf)
+    if rgb is None:
+        return {'decoded': False, 'boxes': [], 'timings': timings}
+    now = time.perf_counter()
+    timings['decode'], start = now - start, now
+
+    boxes = detect_faces(rgb, profile)
+    timings['detect'] = time.perf_counter() - start
+    return {'decoded': True, 'boxes': boxes, 'timings': timings}
+
+
+def run_encoding(buf, profile, boxes=None, largest_only=None):
+    """decode -> detect -> encode โดยไม่ค้นดัชนี คืน dict: decoded, boxes, encodings, timings
+
+    ระบุ boxes เมื่อรู้ตำแหน่งใบหน้าแล้ว (ไม่ตรวจหาใหม่) largest_only=False ให้ encode ทุกใบหน้า (รูปหมู่)
+    """
+    timings = {}
+    start = time.perf_counter()
+    rgb = _decode_rgb(buf)
+    if rgb is None:
+        return {'decoded': False, 'boxes': [], 'encodings': [], 'timings': timings}
+    now = time.perf_counter()
+    timings['decode'], start = now - start, now
+
+    if boxes is None:
+        boxes = detect_faces(rgb, profile, largest_only)
+        now = time.perf_counter()
+        timings['detect'], start = now - start, now
+    if not boxes:
+        return {'decoded': True, 'boxes': [], 'encodings': [], 'timings': timings}
+
+    encodings = encode_boxes(rgb, boxes, profile)
+    timings['encode'] = time.perf_counter() - start
+    return {'decoded': True, 'boxes': list(boxes), 'encodings': encodings, 'timings': timings}
+
+
+def run_recognition(buf, profile, index, classroom_ids=None, tolerance=None):
+    """จดจำใบหน้าจากไฟล์ภาพ (JPEG/PNG bytes) คืน dict ที่ส่งข้าม process ได้
+
+    ถ้าระบุ classroom_ids (รหัสนักเรียนในห้อง) จะค้นในห้องก่อน แล้วค้นทั้งโรงเรียนเฉพาะใบหน้าที่เกิน tolerance
+    decoded: อ่านภาพได้หรือไม่, faces: จำนวนใบหน้า, matches: FaceMatch (หรือ None) ต่อใบหน้า,
+    scopes: 'partition' / 'all' ต่อใบหน้า, timings: เวลาแต่ละขั้นตอน (วินาที)
+    """
+    encoded = run_encoding(buf, profile)
+    encodings = encoded['encodings']
+    result = {'decoded': encoded['decoded'], 'faces': len(encoded['boxes']), 'matches': [], 'scopes': [],
+              'timings': encoded['timings']}
+    if not encodings:
+        return result
+
+    start = time.perf_counter()
+    if classroom_ids and tolerance is not None:
+        matches, scopes = index.search_partitioned(encodings, classroom_ids, tolerance)
+    else:
+        matches, scopes = index.search_many(encodings), ['all'] * len(encodings)
+    result['timings']['match'] = time.perf_counter() - start
+    result.update(matches=matches, scopes=scopes)
+    return result
+
+
+# --- ฝั่ง worker process ---
+_store_path = None
+_ann_min_faces = None
+_index = FaceIndex([], [])
+_index_stamp = None
+
+
+def _worker_index():
+    """ดัชนีของ worker (เปิดไฟล์ใหม่เมื่อ encode_faces เขียนไฟล์ชุดใหม่ทับ)"""
+    global _index, _index_stamp
+    stamp = store_stamp(_store_path)
+    if stamp != _index_stamp:
+        if stamp is None:
+            _index = FaceIndex([], [])
+        else:
+            _index = FaceIndex.from_store(load_store(_store_path), ann_min_faces=_ann_min_faces)
+        _index_stamp = stamp
+    return _index
+
+
+def _init_worker(store_path, ann_min_faces):
+    global _store_path, _ann_min_faces
+    _store_path, _ann_min_faces = store_path, ann_min_faces
+    # โหลดโมเดล dlib ตอนเริ่ม worker ไม่ใช่ตอนคำขอแรก
+    import face_recognition  # noqa: F401
+    _worker_index()
+
+
+def _worker_recognize(buf, profile, classroom_ids, tolerance):
+    return run_recognition(buf, profile, _worker_index(), classroom_ids, tolerance)
+
+
+def _worker_run(job, submitted_at, *args):
+    # time.monotonic ใช้นาฬิกาเดียวกันทั้งเครื่อง จึงเทียบข้าม process ได้
+    queue_wait = time.monotonic() - submitted_at
+    result = job(*args)
+    result['queue_wait'] = queue_wait
+    return result
+
+
+def _ping():
+    return True
+
+
+class InferencePool:
+    """ส่งงานจดจำใบหน้าเข้า worker process พร้อมจำกัดจำนวนงานที่รอ (backpressure)"""
+
+    def __init__(self, store_path, workers=2, queue_depth=8, queue_timeout=0.2, timeout=30, ann_min_faces=None):
+        self.store_path = store_path
+        self.ann_min_faces = ann_min_faces
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._executor = None
+        self._lock = threading.Lock()
+        WORKERS.set(workers)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: ไม่ fork process ของเว็บที่มีหลาย thread (และใช้ได้เหมือนกันบน Windows)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker, initargs=(self.store_path, self.ann_min_faces))
+            return self._executor
+
+    def _reset(self, executor):
+        # worker ตาย (เช่น dlib crash) ทั้ง pool ใช้ต่อไม่ได้ สร้างชุดใหม่ในคำขอถัดไป
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def warm_up(self):
+        """เริ่ม worker ทุกตัวล่วงหน้า (ไม่รอให้เสร็จ) ให้คำขอแรกไม่ต้องรอโหลดโมเดล"""
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(_ping)
+
+    def _release(self, _future=None):
+        QUEUE_DEPTH.dec()
+        self._slots.release()
+
+    def recognize(self, buf, profile, classroom_ids=None, tolerance=None):
+        """เหมือน run_recognition แต่รันใน worker process (โยน InferenceBusy เมื่อคิวเต็ม, InferenceTimeout เมื่อรอเกิน timeout)"""
+        return self._submit(_worker_recognize, buf, profile, classroom_ids, tolerance)
+
+    def detect(self, buf, profile):
+        """เหมือน run_detection แต่รันใน worker process (ใช้คิวและ timeout เดียวกับ recognize)"""
+        return self._submit(run_detection, buf, profile)
+
+    def encode(self, buf, profile, boxes=None, largest_only=None):
+        """เหมือน run_encoding แต่รันใน worker process สำหรับงานที่จับคู่กับดัชนีเอง (รูปหมู่, สแกนต่อเนื่อง)"""
+        return self._submit(run_encoding, buf, profile, boxes, largest_only)
+
+    def _submit(self, job, *args):
+        waited_from = time.monotonic()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            REJECTED.inc()
+            raise InferenceBusy()
+        slot_wait = time.monotonic() - waited_from
+        QUEUE_DEPTH.inc()
+
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_worker_run, job, time.monotonic(), *args)
+        except Exception:
+            self._release()
+            self._reset(executor)
+            raise
+        # คืนช่องเมื่องานเสร็จจริง (แม้ผู้เรียกจะหมดเวลารอไปก่อน) จำนวนงานใน worker จะไม่เกินที่กำหนด
+        future.add_done_callback(self._release)
+
+        try:
+            result = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            TIMEOUTS.inc()
+            raise InferenceTimeout(f"recognition did not finish within {self.timeout:g}s") from None
+        except BrokenProcessPool:
+            self._reset(executor)
+            raise
+        QUEUE_WAIT_SECONDS.observe(slot_wait + result['queue_wait'])
+        return result
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,58 @@
+"""แคชข้อมูลที่อ่านบ่อยแต่แทบไม่เปลี่ยน (ค่าตั้งค่าระบบ, ข้อมูลนักเรียน) ไว้ในหน่วยความจำของ process
+
+ทุกการสแกนต้องใช้ค่าตั้งค่าและชื่อนักเรียน ถ้าอ่านจาก Database ทุกครั้งช่วงเช้าที่ Kiosk สแกนพร้อมกัน
+จะเป็นการ query ซ้ำๆ โดยเปล่าประโยชน์ ค่าในแคชเป็น dict ธรรมดา (ไม่ใช่ ORM object) จึงใช้ข้าม thread ได้
+
+ฝั่งที่แก้ข้อมูลต้องเรียก invalidate เอง ส่วน TTL มีไว้กันค่าค้างเมื่อแก้จาก process อื่น
+(เช่น สคริปต์ add_student.py หรือ worker อื่นของเว็บเซิร์ฟเวอร์)
+"""
+import threading
+import time
+
+_MISSING = object()
+
+
+class TTLCache:
+    """แคชแบบ read-through: get(key, loader) จะเรียก loader เมื่อไม่มีค่าหรือค่าหมดอายุ
+
+    ค่า None ก็ถูกแคชด้วย (เช่น รหัสที่ไม่มีในระบบ) จะได้ไม่ query ซ้ำทุกเฟรม แต่ใช้อายุ miss_ttl (ถ้ากำหนด)
+    รหัสที่เพิ่งเพิ่มจาก process อื่นจะได้ไม่ถูกตอบว่าไม่มีจนครบ ttl เต็ม
+    """
+
+    def __init__(self, ttl=60.0, max_size=10000, miss_ttl=None):
+        self.ttl = ttl
+        self.miss_ttl = ttl if miss_ttl is None else miss_ttl
+        self.max_size = max_size
+        self._data = {}
+        self._version = 0  # เพิ่มทุกครั้งที่ invalidate
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            version = self._version
+
+        value = loader()
+        with self._lock:
+            # ถ้ามีการ invalidate ระหว่างที่กำลังโหลด ค่าที่โหลดมาอาจเก่าแล้ว จึงไม่เก็บลงแคช
+            if self._version == version:
+                if len(self._data) >= self.max_size and key not in self._data:
+                    self._data.clear()
+                self._data[key] = (now + (self.miss_ttl if value is None else self.ttl), value)
+        return value
+
+    def invalidate(self, key=_MISSING):
+        """ลบค่าของ key เดียว หรือทั้งหมดเมื่อไม่ระบุ key"""
+        with self._lock:
+            self._version += 1
+            if key is _MISSING:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
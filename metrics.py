@@ -0,0 +1,199 @@
+"""ตัวเก็บสถิติการทำงาน (Counter / Gauge / Histogram) และแปลงเป็นข้อความรูปแบบ Prometheus
+
+การบันทึกค่าแต่ละครั้งเป็นแค่การบวกตัวเลขใต้ lock จึงแทบไม่มีต้นทุน
+การจัดรูปแบบข้อความทำเฉพาะตอนที่มีผู้ดึง /metrics เท่านั้น
+
+ตัวอย่าง:
+    SCAN_SECONDS = histogram('scan_seconds', 'เวลาที่ใช้สแกน', labelnames=('stage',))
+    with timed(SCAN_SECONDS, stage='detect'):
+        ...
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# หน่วยวินาที ครอบคลุมตั้งแต่การค้นดัชนี (ms) จนถึงการสร้าง Encodings ใหม่ทั้งหมด (นาที)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """รวม metric ทั้งหมดของ process"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """ข้อความรูปแบบ Prometheus text exposition ของทุก metric"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{self._label_text(key)} {_format_value(value)}" for key, value in items]
+
+
+class Counter(_Metric):
+    """ตัวนับที่เพิ่มขึ้นอย่างเดียว"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """ค่าที่ขึ้นลงได้ (เช่น จำนวนใบหน้าในดัชนี, จำนวนงานในคิว)"""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    """นับจำนวนค่าที่ตกในแต่ละช่วง (bucket) พร้อมผลรวม ใช้ดู p50/p95 ของเวลาแต่ละขั้นตอน"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(float(b) for b in buckets if b != math.inf))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [จำนวนต่อ bucket ..., จำนวนที่เกิน bucket สุดท้าย], ผลรวม
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return sum(state[0]) if state else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1])) for key, state in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._label_text(key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {cumulative}")
+        return lines
+
+
+def _get_or_create(cls, name, *args):
+    # module ถูก import ซ้ำได้ (เช่น รันเป็นสคริปต์แล้วถูก import อีกครั้ง) ให้ใช้ metric เดิม
+    existing = REGISTRY.get(name)
+    if existing is not None:
+        if not isinstance(existing, cls):
+            raise ValueError(f"metric {name} already registered as {existing.kind}")
+        return existing
+    return cls(name, *args)
+
+
+def counter(name, documentation, labelnames=()):
+    return _get_or_create(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    return _get_or_create(Gauge, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _get_or_create(Histogram, name, documentation, labelnames, buckets)
+
+
+@contextmanager
+def timed(metric, **labels):
+    """จับเวลาโค้ดในบล็อก with แล้วบันทึกลง Histogram (หน่วยวินาที) บันทึกแม้จะเกิด exception"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metric.observe(time.perf_counter() - start, **labels)
+
+
+def render():
+    return REGISTRY.render()
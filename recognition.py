@@ -0,0 +1,81 @@
+"""ขั้นตอนตรวจหาใบหน้าและสร้างรหัสใบหน้า (Detect + Encode) ตามโปรไฟล์ความเร็ว/ความแม่นยำ
+
+cv2 และ face_recognition (dlib) ถูก import เมื่อเรียกใช้ครั้งแรก โหลดเว็บหรือสคริปต์ที่ไม่ได้สแกนใบหน้าจะได้เร็ว
+"""
+import os
+
+# detect_width: ย่อภาพให้กว้างไม่เกินค่านี้ก่อนตรวจหาใบหน้า (None = ใช้ภาพเต็ม)
+# largest_only: encode เฉพาะใบหน้าที่ใหญ่ที่สุด (คนที่ยืนหน้ากล้อง)
+PROFILES = {
+    'fast': {
+        'detect_width': 320, 'model': 'hog', 'upsample': 1, 'num_jitters': 1, 'largest_only': True,
+    },
+    'balanced': {
+        'detect_width': 640, 'model': 'hog', 'upsample': 1, 'num_jitters': 1, 'largest_only': False,
+    },
+    'accurate': {
+        # ตั้ง ACCURATE_DETECTION_MODEL=cnn เมื่อเครื่องมี GPU (dlib แบบ CUDA)
+        'detect_width': None, 'model': os.environ.get('ACCURATE_DETECTION_MODEL', 'hog'),
+        'upsample': 1, 'num_jitters': 3, 'largest_only': False,
+    },
+}
+DEFAULT_PROFILE = 'balanced'
+PROFILE_LABELS = {
+    'fast': 'เร็ว (Fast)',
+    'balanced': 'สมดุล (Balanced)',
+    'accurate': 'แม่นยำ (Accurate)',
+}
+
+
+def resolve_profile(name, default=DEFAULT_PROFILE):
+    """คืนชื่อโปรไฟล์ที่ใช้ได้จริง (ชื่อที่ไม่รู้จักจะใช้ค่า default)"""
+    if name in PROFILES:
+        return name
+    return default if default in PROFILES else DEFAULT_PROFILE
+
+
+def detect_faces(rgb, profile, largest_only=None):
+    """หาตำแหน่งใบหน้าบนภาพย่อ แล้วขยายกรอบกลับเป็นพิกัดของภาพจริง (top, right, bottom, left)"""
+    import cv2
+    import face_recognition
+
+    options = PROFILES[profile]
+    if largest_only is None:
+        largest_only = options['largest_only']
+    height, width = rgb.shape[:2]
+    scale = 1.0
+    if options['detect_width'] and width > options['detect_width']:
+        scale = options['detect_width'] / width
+
+    small = rgb if scale == 1.0 else cv2.resize(rgb, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    boxes = face_recognition.face_locations(small, number_of_times_to_upsample=options['upsample'],
+                                            model=options['model'])
+    if scale != 1.0:
+        boxes = [
+            (max(0, int(top / scale)), min(width, int(right / scale)),
+             min(height, int(bottom / scale)), max(0, int(left / scale)))
+            for top, right, bottom, left in boxes
+        ]
+
+    if largest_only and len(boxes) > 1:
+        boxes = [max(boxes, key=lambda b: (b[2] - b[0]) * (b[1] - b[3]))]
+    return boxes
+
+
+def detect_and_encode(rgb, profile=DEFAULT_PROFILE, largest_only=None):
+    """ตรวจหาใบหน้าแล้วสร้างรหัสใบหน้า 128 มิติ (encode บนภาพความละเอียดเต็มเสมอ)
+
+    largest_only=False ใช้กับรูปหมู่ ให้ encode ทุกใบหน้าแม้โปรไฟล์จะเลือกเฉพาะใบหน้าใหญ่สุด
+    """
+    profile = resolve_profile(profile)
+    boxes = detect_faces(rgb, profile, largest_only)
+    if not boxes:
+        return [], []
+    return boxes, encode_boxes(rgb, boxes, profile)
+
+
+def encode_boxes(rgb, boxes, profile=DEFAULT_PROFILE):
+    """สร้างรหัสใบหน้าของกรอบที่รู้ตำแหน่งแล้ว (ใช้ตอนติดตามใบหน้าที่ไม่ต้องตรวจหาใหม่)"""
+    import face_recognition
+
+    return face_recognition.face_encodings(rgb, boxes, num_jitters=PROFILES[resolve_profile(profile)]['num_jitters'])
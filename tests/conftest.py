@@ -0,0 +1,14 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+# โมดูลของโปรเจคอยู่ที่รากของ repo (ไม่ได้เป็น package)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app อ่านค่าเหล่านี้ตอน import: ใช้ฐานข้อมูลชั่วคราว (ไม่แตะ school_data.db) และไม่เปิด inference worker
+_workdir = tempfile.mkdtemp(prefix='attendance-tests-')
+atexit.register(shutil.rmtree, _workdir, ignore_errors=True)
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_workdir, 'test.db')
+os.environ['INFERENCE_WORKERS'] = '0'
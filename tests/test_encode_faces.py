@@ -0,0 +1,107 @@
+import hashlib
+import os
+
+import numpy as np
+import pytest
+
+import encode_faces
+from face_store import open_store
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """images_db / encodings.bin / manifest ในโฟลเดอร์ชั่วคราว พร้อม encoder ปลอมที่นับรูปที่ถูก encode"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(encode_faces, 'MAX_PER_STUDENT', 0)
+    monkeypatch.setattr(encode_faces, 'STORE_PRECISION', 'float32')
+    encoded = []
+
+    def fake_encode(image_path):
+        encoded.append(os.path.basename(image_path))
+        with open(image_path, 'rb') as f:
+            seed = int.from_bytes(hashlib.sha1(f.read()).digest()[:4], 'little')
+        return [np.random.default_rng(seed).normal(0, 0.1, 128)]
+
+    monkeypatch.setattr(encode_faces, '_encode_image', fake_encode)
+    return encoded
+
+
+def _write_image(student_id, name, content):
+    folder = os.path.join('images_db', student_id)
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, name), 'wb') as f:
+        f.write(content)
+
+
+def _store():
+    matrix, ids = open_store('encodings.bin', use_mmap=False)
+    return np.asarray(matrix), ids
+
+
+def test_incremental_run_encodes_only_new_or_changed_images(workspace):
+    _write_image('s1', 'a.jpg', b'one')
+    _write_image('s1', 'b.jpg', b'two')
+    _write_image('s2', 'a.jpg', b'three')
+    encode_faces.create_encodings()
+    assert sorted(workspace) == ['a.jpg', 'a.jpg', 'b.jpg']
+    first_matrix, ids = _store()
+    assert ids == ['s1', 's1', 's2']
+
+    workspace.clear()
+    encode_faces.create_encodings()
+    assert workspace == []
+    np.testing.assert_array_equal(_store()[0], first_matrix)
+
+    # เนื้อหาเปลี่ยน (ขนาดเปลี่ยน) encode ใหม่เฉพาะรูปนั้น
+    _write_image('s1', 'b.jpg', b'two, retaken')
+    encode_faces.create_encodings()
+    assert workspace == ['b.jpg']
+
+
+def test_copied_image_reuses_encoding_by_hash(workspace):
+    _write_image('s1', 'a.jpg', b'same photo')
+    encode_faces.create_encodings()
+    workspace.clear()
+
+    _write_image('s1', 'copy.jpg', b'same photo')
+    encode_faces.create_encodings()
+    assert workspace == []
+    matrix, ids = _store()
+    assert ids == ['s1', 's1']
+    np.testing.assert_array_equal(matrix[0], matrix[1])
+
+
+def test_deleted_images_and_students_leave_the_store(workspace):
+    _write_image('s1', 'a.jpg', b'one')
+    _write_image('s2', 'a.jpg', b'two')
+    _write_image('s2', 'b.jpg', b'three')
+    encode_faces.create_encodings()
+
+    os.remove(os.path.join('images_db', 's2', 'b.jpg'))
+    encode_faces.create_encodings()
+    assert _store()[1] == ['s1', 's2']
+
+    encode_faces.remove_student_encodings('s2')
+    assert _store()[1] == ['s1']
+
+
+def test_add_student_encodings_scans_one_folder(workspace):
+    _write_image('s1', 'a.jpg', b'one')
+    encode_faces.create_encodings()
+    workspace.clear()
+
+    _write_image('s1', 'b.jpg', b'not rescanned yet')
+    _write_image('s2', 'a.jpg', b'new student')
+    encode_faces.add_student_encodings('s2')
+    assert workspace == ['a.jpg']
+    assert _store()[1] == ['s1', 's2']
+
+
+def test_full_rebuild_ignores_manifest(workspace):
+    _write_image('s1', 'a.jpg', b'one')
+    _write_image('s1', 'b.jpg', b'two')
+    encode_faces.create_encodings()
+    workspace.clear()
+
+    encode_faces.create_encodings(full=True)
+    assert sorted(workspace) == ['a.jpg', 'b.jpg']
@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+
+from face_index import FaceIndex, IVFIndex
+from face_store import load_store, write_store
+
+
+def _dataset(students=40, per_student=3, seed=0):
+    rng = np.random.default_rng(seed)
+    # ใบหน้าของคนเดียวกันอยู่ใกล้กัน (ระยะราว 0.3) คนละคนอยู่ห่างกัน เหมือน Encodings จริง
+    centers = rng.normal(0, 0.09, (students, 128)).astype(np.float32)
+    matrix = np.repeat(centers, per_student, axis=0) + rng.normal(0, 0.02, (students * per_student, 128))
+    ids = [f"s{i:03d}" for i in range(students) for _ in range(per_student)]
+    # สลับลำดับแถว: FaceIndex ต้องจัดกลุ่มตามรหัสเอง
+    order = rng.permutation(len(ids))
+    return matrix[order].astype(np.float32), [ids[i] for i in order], rng
+
+
+def _brute_force(matrix, ids, query, k, allowed=None):
+    """ระยะต่อนักเรียน (ค่าต่ำสุดของทุกรูป) ด้วย np.linalg.norm เรียงจากใกล้ไปไกล"""
+    best = {}
+    for row, student_id in zip(matrix, ids):
+        if allowed is not None and student_id not in allowed:
+            continue
+        distance = float(np.linalg.norm(row.astype(np.float64) - query))
+        best[student_id] = min(distance, best.get(student_id, np.inf))
+    return sorted(best.items(), key=lambda item: item[1])[:k]
+
+
+def _assert_same(result, expected):
+    assert [sid for sid, _ in result] == [sid for sid, _ in expected]
+    np.testing.assert_allclose([d for _, d in result], [d for _, d in expected], atol=1e-3)
+
+
+def test_top_k_many_matches_brute_force():
+    matrix, ids, rng = _dataset()
+    index = FaceIndex(matrix, ids)
+    queries = matrix[:10] + rng.normal(0, 0.01, (10, 128)).astype(np.float32)
+
+    assert len(index) == len(ids) and index.num_students == 40
+    for query, result in zip(queries, index.top_k_many(queries, k=3)):
+        _assert_same(result, _brute_force(matrix, ids, query, 3))
+
+
+def test_search_many_margin_and_empty_index():
+    matrix, ids, _ = _dataset()
+    index = FaceIndex(matrix, ids)
+    match = index.search(matrix[5])
+    expected = _brute_force(matrix, ids, matrix[5], 2)
+    assert match.student_id == ids[5]
+    assert match.distance == pytest.approx(0.0, abs=1e-3)
+    assert match.margin == pytest.approx(expected[1][1] - expected[0][1], abs=1e-3)
+
+    assert FaceIndex([], []).search_many(matrix[:2]) == [None, None]
+
+
+def test_subset_only_searches_given_students():
+    matrix, ids, _ = _dataset()
+    index = FaceIndex(matrix, ids)
+    allowed = {f"s{i:03d}" for i in range(0, 40, 3)} | {"not-enrolled"}
+    sub = index.subset(allowed)
+
+    assert set(sub.student_ids) == allowed - {"not-enrolled"}
+    assert index.subset(sorted(allowed)) is sub  # แคชตามชุดรหัส ไม่ขึ้นกับลำดับ
+    for query in matrix[:10]:
+        _assert_same(sub.top_k_many(query, k=2)[0], _brute_force(matrix, ids, query, 2, allowed))
+
+
+def test_search_partitioned_falls_back_to_whole_index():
+    matrix, ids, _ = _dataset()
+    index = FaceIndex(matrix, ids)
+    classroom = sorted({ids[0], ids[1]})
+    outsider = next(i for i, sid in enumerate(ids) if sid not in classroom)
+
+    matches, scopes = index.search_partitioned(matrix[[0, outsider]], classroom, tolerance=0.1)
+    assert scopes == ['partition', 'all']
+    assert [m.student_id for m in matches] == [ids[0], ids[outsider]]
+
+
+def test_top_k_partitioned_keeps_classroom_candidates():
+    matrix, ids, rng = _dataset()
+    index = FaceIndex(matrix, ids)
+    classroom = sorted(set(ids[:6]))
+    outsider = next(i for i, sid in enumerate(ids) if sid not in classroom)
+    queries = matrix[[0, 3, outsider]] + rng.normal(0, 0.01, (3, 128)).astype(np.float32)
+
+    tops, scopes = index.top_k_partitioned(queries, classroom, tolerance=0.3, k=2)
+    assert scopes == ['partition', 'partition', 'all']
+    # อันดับ 2 ของใบหน้าที่พบในห้องมาจากนักเรียนในห้องเดียวกันเท่านั้น
+    _assert_same(tops[0], _brute_force(matrix, ids, queries[0], 2, set(classroom)))
+    _assert_same(tops[1], _brute_force(matrix, ids, queries[1], 2, set(classroom)))
+    _assert_same(tops[2], _brute_force(matrix, ids, queries[2], 2))
+
+
+def test_ivf_rerank_distances_are_exact():
+    matrix, ids, rng = _dataset(students=200, per_student=2)
+    index = FaceIndex(matrix, ids)
+    queries = matrix[:20] + rng.normal(0, 0.01, (20, 128)).astype(np.float32)
+
+    # ค้นทุกกลุ่ม: ผลต้องเท่ากับการค้นทุกแถว
+    full_probe = IVFIndex(index, nlist=16, nprobe=16)
+    for query, result in zip(queries, full_probe.top_k_many(queries, k=3)):
+        _assert_same(result, _brute_force(matrix, ids, query, 3))
+
+    # ค้นบางกลุ่ม: ผู้สมัครอาจขาดไป แต่ระยะที่คืนมาต้องเป็นระยะจริงของนักเรียนคนนั้น
+    partial = IVFIndex(index, nlist=16, nprobe=2)
+    exact = {sid: d for sid, d in _brute_force(matrix, ids, queries[0], 200)}
+    for sid, distance in partial.top_k_many(queries[:1], k=5)[0]:
+        assert distance >= exact[sid] - 1e-3
+    assert partial.top_k_many(queries[:1], k=1)[0][0][0] == ids[0]
+
+
+def test_ann_index_is_used_above_threshold_and_exact_overrides_it():
+    matrix, ids, _ = _dataset(students=60, per_student=2)
+    index = FaceIndex(matrix, ids, ann_min_faces=100)
+    assert index.ann is not None
+    assert FaceIndex(matrix, ids, ann_min_faces=1000).ann is None
+    _assert_same(index.top_k_many(matrix[3], exact=True)[0], _brute_force(matrix, ids, matrix[3], 2))
+
+
+@pytest.mark.parametrize('precision', ['float16', 'int8'])
+def test_reduced_precision_rechecks_with_float32(tmp_path, precision):
+    matrix, ids, rng = _dataset()
+    path = str(tmp_path / 'encodings.bin')
+    write_store(path, matrix, ids, precision=precision)
+    index = FaceIndex.from_store(load_store(path))
+    assert index.reduced and index.matrix.dtype == np.dtype(precision)
+
+    queries = matrix[:10] + rng.normal(0, 0.01, (10, 128)).astype(np.float32)
+    for query, result in zip(queries, index.top_k_many(queries, k=2)):
+        expected = _brute_force(matrix, ids, query, 2)
+        # อันดับ 1 ถูกคำนวณซ้ำด้วย float32 ค่าที่เทียบกับ tolerance จึงตรงกับค่าจริง
+        assert result[0][0] == expected[0][0]
+        assert result[0][1] == pytest.approx(expected[0][1], abs=1e-4)
@@ -0,0 +1,65 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from face_store import StoreError, load_store, migrate_pickle, open_store, store_stamp, write_store
+
+
+@pytest.mark.parametrize('use_mmap', [True, False])
+def test_round_trip(tmp_path, use_mmap):
+    path = str(tmp_path / 'encodings.bin')
+    matrix = np.random.default_rng(0).normal(0, 0.1, (5, 128)).astype(np.float32)
+    ids = ['s1', 's1', 's2', 'นักเรียน3', 's4']
+    write_store(path, matrix, ids)
+
+    loaded, loaded_ids = open_store(path, use_mmap=use_mmap)
+    assert isinstance(loaded, np.memmap) == use_mmap
+    np.testing.assert_array_equal(loaded, matrix)
+    assert loaded_ids == ids
+    assert not os.path.exists(path + '.tmp')
+
+
+def test_empty_store(tmp_path):
+    path = str(tmp_path / 'encodings.bin')
+    write_store(path, np.zeros((0, 128), dtype=np.float32), [])
+    data = load_store(path)
+    assert data.matrix.shape == (0, 128) and data.ids == []
+
+
+def test_rejects_mismatched_ids_and_bad_files(tmp_path):
+    path = str(tmp_path / 'encodings.bin')
+    with pytest.raises(ValueError):
+        write_store(path, np.zeros((2, 128), dtype=np.float32), ['s1'])
+
+    with open(path, 'wb') as f:
+        f.write(b'not a store')
+    with pytest.raises(StoreError):
+        load_store(path)
+    with open(path, 'wb') as f:
+        f.write(b'\0' * 64)
+    with pytest.raises(StoreError):
+        load_store(path)
+
+
+def test_stamp_changes_when_file_is_replaced(tmp_path):
+    path = str(tmp_path / 'encodings.bin')
+    assert store_stamp(path) is None
+    write_store(path, np.zeros((1, 128), dtype=np.float32), ['s1'])
+    before = store_stamp(path)
+    write_store(path, np.ones((2, 128), dtype=np.float32), ['s1', 's2'])
+    assert store_stamp(path) != before
+
+
+def test_migrate_pickle_sorts_by_student_id(tmp_path):
+    pickle_path = str(tmp_path / 'encodings.pickle')
+    path = str(tmp_path / 'encodings.bin')
+    encodings = [np.full(128, value, dtype=np.float64) for value in (0.3, 0.1, 0.2)]
+    with open(pickle_path, 'wb') as f:
+        pickle.dump({'encodings': encodings, 'names': ['s3', 's1', 2]}, f)
+
+    migrate_pickle(pickle_path, path)
+    matrix, ids = open_store(path, use_mmap=False)
+    assert ids == ['2', 's1', 's3']
+    np.testing.assert_allclose(matrix[:, 0], [0.2, 0.1, 0.3])
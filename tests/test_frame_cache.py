@@ -0,0 +1,42 @@
+import cv2
+import numpy as np
+
+from frame_cache import FrameCache, content_key, frame_hash, hamming
+
+SCOPE = ('balanced', 'A', 0.45, None)
+
+
+def _frame(face_value, quality=90):
+    # ห้องเรียนเดิม (พื้นหลังมีลาย) มีใบหน้าเล็กๆ อยู่กลางภาพ เหมือนกล้อง Kiosk ที่ตั้งอยู่กับที่
+    rng = np.random.default_rng(0)
+    img = cv2.resize(rng.integers(0, 255, (12, 16, 3), dtype=np.uint8), (640, 480), interpolation=cv2.INTER_CUBIC)
+    cv2.ellipse(img, (320, 240), (40, 55), 0, 0, 360, face_value, -1)
+    return cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+
+def test_different_faces_on_same_background_miss():
+    first, second = _frame((180, 190, 200)), _frame((60, 80, 120))
+    # ยืนยันว่า dHash ทั้งเฟรมแทบไม่ต่างกันจริง ซึ่งเป็นเหตุผลที่ห้ามใช้กับผลที่ระบุตัวคน
+    assert hamming(frame_hash(first), frame_hash(second)) <= 4
+
+    cache = FrameCache(ttl=60, max_distance=4)
+    match = ('match', {'status': 'success', 'student_id': 's1'})
+    cache.put('kiosk', frame_hash(first), SCOPE, match, key=content_key(first), near=False)
+
+    assert cache.get('kiosk', frame_hash(second), SCOPE, key=content_key(second)) is None
+    # ไฟล์เดิมที่ถูกส่งซ้ำยังได้ผลเดิม
+    assert cache.get('kiosk', frame_hash(first), SCOPE, key=content_key(first)) == match
+
+
+def test_similar_frame_reuses_only_non_identifying_result():
+    first, reencoded = _frame((180, 190, 200)), _frame((180, 190, 200), quality=70)
+    assert content_key(first) != content_key(reencoded)
+    assert hamming(frame_hash(first), frame_hash(reencoded)) <= 1
+
+    cache = FrameCache(ttl=60)
+    no_face = ('no_face', {'status': 'error', 'message': 'ไม่พบใบหน้าในรูปภาพ'})
+    cache.put('kiosk', frame_hash(first), SCOPE, no_face, key=content_key(first), near=True)
+
+    assert cache.get('kiosk', frame_hash(reencoded), SCOPE, key=content_key(reencoded)) == no_face
+    assert cache.get('other-kiosk', frame_hash(reencoded), SCOPE, key=content_key(reencoded)) is None
+    assert cache.get('kiosk', frame_hash(reencoded), SCOPE[:3] + ('new-store',), key=content_key(reencoded)) is None
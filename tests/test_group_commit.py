@@ -0,0 +1,88 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine, event, text
+
+from app import configure_engine
+from group_commit import GroupCommitTimeout, GroupCommitWriter
+
+
+def _engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    configure_engine(engine)
+    statements = []
+    # ดูคำสั่งที่ SQLite ได้รับจริง (รวม BEGIN/COMMIT ที่ pysqlite ส่งเอง)
+    event.listen(engine, 'connect', lambda dbapi_connection, record: dbapi_connection.set_trace_callback(statements.append))
+    with engine.begin() as conn:
+        conn.exec_driver_sql('CREATE TABLE item (id INTEGER PRIMARY KEY, value INTEGER)')
+    statements.clear()
+    return engine, statements
+
+
+def _insert(value):
+    def write(conn):
+        conn.execute(text('INSERT INTO item (value) VALUES (:value)'), {'value': value})
+        return value
+    return write
+
+
+def test_batch_commits_once(tmp_path):
+    engine, statements = _engine(tmp_path)
+    writer = GroupCommitWriter(window=0.5, max_batch=100, execution_options={'sqlite_begin': 'IMMEDIATE'})
+    results = []
+    threads = [threading.Thread(target=lambda v=v: results.append(writer.run(engine, _insert(v)))) for v in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(results) == list(range(20))
+    assert [s for s in statements if s.startswith('BEGIN')] == ['BEGIN IMMEDIATE']
+    assert [s for s in statements if s == 'COMMIT'] == ['COMMIT']
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql('SELECT COUNT(*) FROM item').scalar() == 20
+
+
+def test_failed_job_rolls_back_only_itself(tmp_path):
+    engine, statements = _engine(tmp_path)
+    writer = GroupCommitWriter(window=0.5, max_batch=100)
+
+    def broken(conn):
+        conn.execute(text('INSERT INTO item (value) VALUES (-1)'))
+        raise ValueError('boom')
+
+    errors = []
+
+    def run(fn):
+        try:
+            writer.run(engine, fn)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(fn,)) for fn in (_insert(1), broken, _insert(2))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(errors) == 1
+    assert [s for s in statements if s == 'COMMIT'] == ['COMMIT']
+    with engine.connect() as conn:
+        assert sorted(conn.exec_driver_sql('SELECT value FROM item').scalars()) == [1, 2]
+
+
+def test_timeout_raises_but_write_still_commits(tmp_path):
+    engine, _ = _engine(tmp_path)
+    writer = GroupCommitWriter(window=0.01)
+
+    def slow(conn):
+        time.sleep(0.3)
+        return _insert(7)(conn)
+
+    with pytest.raises(GroupCommitTimeout):
+        writer.run(engine, slow, timeout=0.05)
+    # งานยังอยู่ในก้อนที่กำลังเขียน ผู้เรียกแค่เลิกรอ
+    assert writer.run(engine, _insert(8)) == 8
+    with engine.connect() as conn:
+        assert sorted(conn.exec_driver_sql('SELECT value FROM item').scalars()) == [7, 8]
@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import app as attendance_app
+from app import Attendance, IngestKey, Student, app, db
+from group_commit import GroupCommitTimeout
+
+
+@pytest.fixture
+def client():
+    attendance_app.startup()
+    with app.app_context():
+        for model in (IngestKey, Attendance, Student):
+            db.session.query(model).delete()
+        db.session.add_all([Student(id=sid, roll_number=n, name_th=f'นักเรียน {n}', name_en=f'Student {n}',
+                                    classroom='ม.1/1') for n, sid in enumerate(('s1', 's2'), start=1)])
+        db.session.commit()
+    attendance_app.invalidate_student_caches()
+    attendance_app._ingest_pruned_on = None
+    return app.test_client()
+
+
+def _record(key, student_id='s1', subject='คณิตศาสตร์', captured_at=None, **extra):
+    captured_at = captured_at or datetime.now().replace(hour=8, minute=0, second=0, microsecond=0).isoformat()
+    return dict({'key': key, 'student_id': student_id, 'subject': subject, 'start_time': '08:30',
+                 'captured_at': captured_at}, **extra)
+
+
+def _attendance_count():
+    with app.app_context():
+        return db.session.query(Attendance).count()
+
+
+def test_replayed_batch_returns_original_results(client):
+    batch = {'records': [_record('k1'), _record('k2', student_id='s2')]}
+    first = client.post('/api/attendance/batch', json=batch).get_json()
+    assert first['created'] == 2
+    assert [(r['key'], r['result'], r['replayed']) for r in first['results']] == [
+        ('k1', 'Present', False), ('k2', 'Present', False)]
+
+    # Kiosk ไม่ได้รับคำตอบ (WiFi หลุด) จึงส่งก้อนเดิมซ้ำ: ได้ผลเดิมและไม่มีแถวเพิ่ม
+    again = client.post('/api/attendance/batch', json=batch).get_json()
+    assert again['created'] == 0
+    assert [(r['key'], r['result'], r['replayed']) for r in again['results']] == [
+        ('k1', 'Present', True), ('k2', 'Present', True)]
+    assert _attendance_count() == 2
+
+    # key ใหม่ของการเช็กชื่อเดิม: ไม่บันทึกซ้ำ (unique index) และจำผล duplicate ไว้กับ key นั้น
+    other = client.post('/api/attendance/batch', json={'records': [_record('k3')]}).get_json()
+    assert other['results'][0]['result'] == 'duplicate'
+    assert _attendance_count() == 2
+
+
+def test_partial_invalid_batch_saves_valid_records(client):
+    records = [
+        _record('ok'),
+        _record('unknown', student_id='nobody'),
+        _record('bad-time', captured_at='yesterday'),
+        _record('bad-start', student_id='s2', start_time='8.30'),
+        {'student_id': 's2'},
+        _record('ok', student_id='s2'),
+        _record('leave', student_id='s2', subject=None, start_time=None, status='Sick Leave'),
+    ]
+    body = client.post('/api/attendance/batch', json={'records': records}).get_json()
+    results = body['results']
+
+    # ตอบครบทุกรายการตามลำดับเดิม รายการที่ผิดไม่ทำให้ทั้งก้อนล้ม
+    assert [r['key'] for r in results] == ['ok', 'unknown', 'bad-time', 'bad-start', '', 'ok', 'leave']
+    assert [r['status'] for r in results] == ['success', 'error', 'error', 'error', 'error', 'success', 'success']
+    assert results[1]['message'] == 'ไม่พบรหัสนักเรียน'
+    assert 'ISO 8601' in results[2]['message']
+    assert 'HH:MM' in results[3]['message']
+    # key ซ้ำในก้อนเดียวกันใช้รายการแรก
+    assert results[0] == results[5]
+    assert results[6]['result'] == 'Sick Leave'
+    assert body['created'] == 2 and _attendance_count() == 2
+
+
+def test_capture_time_ahead_of_server_clock_is_rejected(client):
+    now = datetime.now()
+    records = [
+        _record('future', captured_at=(now + timedelta(minutes=10)).isoformat()),
+        _record('slightly-ahead', student_id='s2', captured_at=(now + timedelta(minutes=2)).isoformat()),
+        _record('utc', subject='วิทยาศาสตร์', captured_at=datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')),
+    ]
+    results = client.post('/api/attendance/batch', json={'records': records}).get_json()['results']
+
+    assert results[0]['status'] == 'error' and 'อนาคต' in results[0]['message']
+    assert [r['status'] for r in results[1:]] == ['success', 'success']
+    with app.app_context():
+        saved = db.session.query(Attendance).filter_by(student_id='s1', subject='วิทยาศาสตร์').one()
+    # เวลาแบบ UTC ถูกแปลงเป็นเวลาท้องถิ่นของเซิร์ฟเวอร์ก่อนบันทึก
+    assert abs(datetime.combine(saved.date, saved.time) - now) < timedelta(minutes=1)
+
+
+def test_expired_keys_are_pruned_once_the_batch_commits(client, monkeypatch):
+    old = datetime.now() - timedelta(days=attendance_app.INGEST_KEY_RETENTION_DAYS + 1)
+    with app.app_context():
+        db.session.add(IngestKey(key='old', student_id='s1', result='Present', received_at=old))
+        db.session.commit()
+
+    def timeout(engine, fn, timeout=30):
+        raise GroupCommitTimeout('write did not commit')
+
+    with monkeypatch.context() as m:
+        m.setattr(attendance_app.group_commit, 'run', timeout)
+        response = client.post('/api/attendance/batch', json={'records': [_record('k1')]})
+    assert response.status_code == 503
+    assert attendance_app._ingest_pruned_on is None
+
+    client.post('/api/attendance/batch', json={'records': [_record('k1')]})
+    assert attendance_app._ingest_pruned_on == datetime.now().date()
+    with app.app_context():
+        assert db.session.get(IngestKey, 'old') is None
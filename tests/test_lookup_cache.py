@@ -0,0 +1,33 @@
+from lookup_cache import TTLCache
+
+
+def test_misses_expire_sooner_than_values(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr('lookup_cache.time.monotonic', lambda: clock[0])
+    cache = TTLCache(ttl=300, miss_ttl=5)
+    calls = []
+
+    def loader(value):
+        def load():
+            calls.append(value)
+            return value
+        return load
+
+    assert cache.get('new', loader(None)) is None
+    assert cache.get('found', loader({'id': 'found'})) == {'id': 'found'}
+    clock[0] += 10
+    # รหัสที่ไม่พบหมดอายุแล้ว (เช่น เพิ่งถูกเพิ่มจาก process อื่น) ส่วนค่าที่พบยังอยู่ในแคช
+    assert cache.get('new', loader({'id': 'new'})) == {'id': 'new'}
+    assert cache.get('found', loader('reloaded')) == {'id': 'found'}
+    assert calls == [None, {'id': 'found'}, {'id': 'new'}]
+
+
+def test_invalidate_during_load_is_not_cached():
+    cache = TTLCache(ttl=300)
+
+    def load():
+        cache.invalidate('k')
+        return 'stale'
+
+    assert cache.get('k', load) == 'stale'
+    assert cache.get('k', lambda: 'fresh') == 'fresh'
@@ -0,0 +1,86 @@
+"""วาดข้อความภาษาไทยลงบนภาพ OpenCV (BGR)
+
+OpenCV วาดภาษาไทยไม่ได้ จึงใช้ PIL วาดข้อความเป็นป้ายขนาดเล็ก (RGBA) แล้วผสมเฉพาะบริเวณป้ายลงในเฟรม
+ฟอนต์และป้ายที่วาดแล้วถูกแคชไว้ ใช้กับภาพวิดีโอทุกเฟรมได้โดยไม่ต้องแปลงทั้งเฟรมไปมา
+"""
+import os
+from functools import lru_cache
+
+import numpy as np
+
+# ลิสต์ฟอนต์ภาษาไทยที่ค้นหาตามลำดับ (ตั้ง THAI_FONT_PATH เพื่อระบุฟอนต์เองได้)
+FONT_PATHS = [
+    os.environ.get('THAI_FONT_PATH', ''),
+    "font/Sarabun-Regular.ttf",                                # หาในโฟลเดอร์โปรเจคก่อน
+    "C:/Windows/Fonts/tahoma.ttf",                             # ฟอนต์ Tahoma (Windows ทั่วไป)
+    "C:/Windows/Fonts/LeelawUI.ttf",                           # ฟอนต์ Leelawadee UI (Windows 10/11)
+    "C:/Windows/Fonts/angsana.ttc",                            # ฟอนต์ Angsana
+    "C:/Windows/Fonts/cordiau.ttf",                            # ฟอนต์ Cordia
+    "/usr/share/fonts/truetype/tlwg/Sarabun.ttf",              # Linux (แพ็กเกจ fonts-thai-tlwg)
+    "/usr/share/fonts/truetype/tlwg/Garuda.ttf",
+    "/usr/share/fonts/truetype/tlwg/Loma.ttf",
+    "/usr/share/fonts/truetype/noto/NotoSansThai-Regular.ttf", # Linux (แพ็กเกจ fonts-noto)
+    "/usr/share/fonts/noto/NotoSansThai-Regular.ttf",
+    "/usr/share/fonts/google-noto/NotoSansThai-Regular.ttf",
+    "/System/Library/Fonts/Thonburi.ttc",                      # macOS
+    "/System/Library/Fonts/Supplemental/Ayuthaya.ttf",
+]
+
+
+@lru_cache(maxsize=1)
+def find_font_path():
+    """ฟอนต์ภาษาไทยไฟล์แรกที่มีอยู่ในเครื่อง (ค้นครั้งเดียว) คืน None ถ้าไม่พบเลย"""
+    for path in FONT_PATHS:
+        if path and os.path.exists(path):
+            return path
+    print("Warning: ไม่พบไฟล์ฟอนต์ภาษาไทยเลยในเครื่อง! ข้อความจะเป็นสี่เหลี่ยม")
+    return None
+
+
+@lru_cache(maxsize=32)
+def load_font(path, size):
+    """โหลดฟอนต์หนึ่งครั้งต่อ (ไฟล์, ขนาด)"""
+    from PIL import ImageFont
+
+    if path:
+        try:
+            return ImageFont.truetype(path, size)
+        except IOError:
+            print(f"Warning: โหลดฟอนต์ {path} ไม่สำเร็จ")
+    return ImageFont.load_default()
+
+
+@lru_cache(maxsize=512)
+def render_label(text, font_size=30, color=(255, 255, 255)):
+    """วาดข้อความเป็นป้าย คืนค่า (alpha uint8 ขนาด h x w, สี BGR) โดยมุมซ้ายบนของป้ายคือจุดที่วาดข้อความ"""
+    from PIL import Image, ImageDraw
+
+    font = load_font(find_font_path(), font_size)
+    _, _, right, bottom = font.getbbox(text)
+    width, height = max(int(right), 1), max(int(bottom), 1)
+
+    label = Image.new('L', (width, height), 0)
+    ImageDraw.Draw(label).text((0, 0), text, font=font, fill=255)
+    alpha = np.asarray(label, dtype=np.uint8)
+    alpha.flags.writeable = False
+    # color เป็น RGB เหมือน PIL แต่เฟรมของ OpenCV เป็น BGR
+    return alpha, tuple(int(c) for c in reversed(color[:3]))
+
+
+def put_thai_text(img, text, position, font_size=30, color=(255, 255, 255)):
+    """วาดภาษาไทยลงบนภาพ BGR ที่ตำแหน่ง position (x, y) แก้ภาพเดิมเฉพาะบริเวณป้าย แล้วคืนภาพเดิม"""
+    alpha, bgr = render_label(text, font_size, tuple(color))
+    x, y = int(position[0]), int(position[1])
+    height, width = img.shape[:2]
+
+    # ตัดป้ายส่วนที่ล้นขอบภาพ
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + alpha.shape[1], width), min(y + alpha.shape[0], height)
+    if x0 >= x1 or y0 >= y1:
+        return img
+
+    a = alpha[y0 - y:y1 - y, x0 - x:x1 - x, None].astype(np.uint16)
+    roi = img[y0:y1, x0:x1]
+    blended = (roi.astype(np.uint16) * (255 - a) + np.array(bgr, dtype=np.uint16) * a + 127) // 255
+    roi[...] = blended.astype(np.uint8)
+    return img